@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user
 from flask_socketio import SocketIO, emit
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -14,14 +14,23 @@ from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 from functools import wraps
 import hashlib
+import mimetypes
 import time
+from urllib.parse import quote
+import atexit
 from modules.config import Config
+from modules.history_index import HistoryIndex
 from modules.git_manager import GitManager
 from modules.task_manager import TaskManager
 from modules.auth_manager import AuthManager
 from modules.notification_manager import NotificationManager
 from modules.logger import setup_logger
 from modules.restore_manager import RestoreManager
+from modules.worktree_restore import WorktreeRestoreManager
+from modules.git_pool import GitProcessPool
+from modules.backup_executor import QueueFullError
+from modules.git_env import cleanup_key_dir
+from modules.socket_emitter import SocketEmitter
 import sys
 
 # 加载环境变量
@@ -56,6 +65,9 @@ logger = setup_logger()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'dev')
 socketio = SocketIO(app, async_mode='gevent', cors_allowed_origins="*")
+# 备份执行器等线程中产生的事件通过队列交给事件循环发送
+socket_emitter = SocketEmitter(socketio)
+socket_emitter.start()
 
 # 初始化登录管理器
 login_manager = LoginManager()
@@ -68,13 +80,29 @@ scheduler.start()
 
 # 初始化各个管理器
 config = Config()
-git_manager = GitManager()
+git_pool = GitProcessPool()
+atexit.register(git_pool.close_all)
+atexit.register(cleanup_key_dir)
+history_index = HistoryIndex(config.DATABASE_PATH, git_pool)
+git_manager = GitManager(config.BACKUP_DIR, git_pool, history_index)
+atexit.register(git_manager.ssh_mux.close_all)
 notification_manager = NotificationManager()
 task_manager = TaskManager(config, git_manager, notification_manager, scheduler)
 
+def emit_job_status(job):
+    """推送备份执行状态到前端（在执行器线程中调用）"""
+    socket_emitter.emit('job_status', job.to_dict())
+
+task_manager.executor.add_listener(emit_job_status)
+
 # 初始化还原管理器
-restore_manager = RestoreManager(config.BACKUP_DIR)
-restore_manager.set_socketio(socketio)  # 设置WebSocket实例
+restore_manager = RestoreManager(config.BACKUP_DIR, git_pool, git_manager.ssh_mux, config, history_index,
+                                 git_manager.remote_refs)
+restore_manager.set_socketio(socket_emitter)  # 还原和快照状态也会在线程中发送
+worktree_manager = WorktreeRestoreManager(restore_manager, config.BACKUP_DIR)
+atexit.register(worktree_manager.shutdown)
+scheduler.add_job(worktree_manager.cleanup_expired, 'interval', minutes=10, id='worktree_cleanup',
+                  replace_existing=True)
 
 # 在文件开头的环境变量加载部分添加
 HOSTS = os.getenv('HOSTS', '0.0.0.0').split(',')
@@ -131,6 +159,8 @@ def get_tasks():
     """获取所有任务"""
     try:
         tasks = task_manager.get_all_tasks()
+        # 附加实际的下次执行时间（启用错峰时包含偏移）
+        tasks = [dict(task, **task_manager.get_schedule_info(task.get('id'))) for task in tasks]
         return jsonify(tasks)
     except Exception as e:
         logger.error(f"获取任务列表失败: {str(e)}")
@@ -188,27 +218,79 @@ def toggle_task(task_id):
 
 @app.route('/api/tasks/<int:task_id>/run', methods=['POST'])
 def run_task(task_id):
-    """立即执行任务"""
+    """提交任务到备份队列，立即返回执行ID"""
     try:
-        success = task_manager.git_backup_wrapper(task_id)
-        return jsonify({'success': success})
+        job = task_manager.submit_backup(task_id)
+        response = jsonify(job.to_dict())
+        response.headers['Location'] = url_for('get_job', job_id=job.id)
+        return response, 202
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
+    except QueueFullError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+    except Exception as e:
+        logger.error(f"提交任务失败: {str(e)}")
+        return jsonify({'error': '提交任务失败'}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """获取最近的备份执行记录"""
+    try:
+        task_id = request.args.get('task_id', type=int)
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        return jsonify([job.to_dict() for job in task_manager.list_jobs(task_id, limit)])
+    except Exception as e:
+        logger.error(f"获取执行记录失败: {str(e)}")
+        return jsonify({'error': '获取执行记录失败'}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询备份执行状态"""
+    job = task_manager.get_job(job_id)
+    if not job:
+        return jsonify({'error': '执行记录不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/tasks/<int:task_id>/runs', methods=['GET'])
+def get_task_runs(task_id):
+    """获取任务的备份执行记录，before 为上一页最后一条的开始时间"""
+    try:
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        before = request.args.get('before', type=float)
+        return jsonify(task_manager.get_runs(task_id, limit, before))
     except Exception as e:
-        logger.error(f"执行任务失败: {str(e)}")
-        return jsonify({'error': '执行任务失败'}), 500
+        logger.error(f"获取执行记录失败: {str(e)}")
+        return jsonify({'error': '获取执行记录失败'}), 500
 
 @app.route('/api/tasks/<int:task_id>/commits', methods=['GET'])
 def get_commit_history(task_id):
     """获取任务的提交历史"""
     try:
-        page = request.args.get('page', 1, type=int)
-        history = restore_manager.get_commit_history(task_id, page)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 10, type=int), 1), 100)
+        cursor = request.args.get('cursor') or None
+        history = restore_manager.get_commit_history(task_id, page, per_page, cursor)
         return jsonify(history)
     except Exception as e:
         logger.error(f"获取提交历史失败: {str(e)}")
         return jsonify({"error": "获取提交历史失败"}), 500
 
+@app.route('/api/tasks/<int:task_id>/files/history', methods=['GET'])
+def get_file_history(task_id):
+    """获取单个文件的修改记录"""
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        history = restore_manager.get_file_history(task_id, request.args.get('path', ''), limit,
+                                                   request.args.get('cursor') or None)
+        return jsonify(history)
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"获取文件修改记录失败: {str(e)}")
+        return jsonify({"error": "获取文件修改记录失败"}), 500
+
 @app.route('/api/tasks/<int:task_id>/restore', methods=['POST'])
 def restore_task(task_id):
     """还原任务到指定版本"""
@@ -224,7 +306,8 @@ def restore_task(task_id):
             return jsonify({"error": "任务不存在"}), 404
 
         # 执行还原
-        restore_manager.restore_to_commit(task_id, commit_hash)
+        if not restore_manager.restore_commit(task_id, commit_hash, data.get('branch')):
+            return jsonify({"error": "还原任务失败"}), 500
 
         # 发送通知
         notification_manager.send_notification(
@@ -240,6 +323,168 @@ def restore_task(task_id):
         logger.error(f"还原任务失败: {str(e)}")
         return jsonify({"error": "还原任务失败"}), 500
 
+def attachment_headers(filename):
+    """生成下载文件的Content-Disposition，非ASCII文件名使用RFC 5987编码"""
+    fallback = filename.encode('ascii', 'replace').decode('ascii').replace('?', '_').replace('"', '_')
+    return {'Content-Disposition': f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"}
+
+@app.route('/api/tasks/<int:task_id>/commits/<commit_hash>/archive', methods=['GET'])
+def download_snapshot_archive(task_id, commit_hash):
+    """以 tar/tar.gz/zip 格式下载指定提交中的文件、目录或整个目录树"""
+    try:
+        chunks, filename, mimetype = restore_manager.stream_archive(
+            task_id, commit_hash, request.args.get('path', ''), request.args.get('format', 'tar'))
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers=attachment_headers(filename))
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"导出快照失败: {str(e)}")
+        return jsonify({"error": "导出快照失败"}), 500
+
+@app.route('/api/tasks/<int:task_id>/commits/<commit_hash>/tree', methods=['GET'])
+def list_snapshot_tree(task_id, commit_hash):
+    """分页浏览指定提交中的目录"""
+    try:
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        return jsonify(restore_manager.list_tree(task_id, commit_hash, request.args.get('path', ''),
+                                                 max(request.args.get('offset', 0, type=int), 0), limit))
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"浏览快照失败: {str(e)}")
+        return jsonify({"error": "浏览快照失败"}), 500
+
+@app.route('/api/tasks/<int:task_id>/commits/<commit_hash>/file', methods=['GET'])
+def download_snapshot_file(task_id, commit_hash):
+    """下载指定提交中的单个文件，支持 Range 断点续传"""
+    try:
+        info = restore_manager.stat_file(task_id, commit_hash, request.args.get('path', ''))
+        size = info['size']
+        etag = info['sha']
+        headers = attachment_headers(info['filename'])
+        headers['Accept-Ranges'] = 'bytes'
+        headers['ETag'] = f'"{etag}"'
+        mimetype = mimetypes.guess_type(info['filename'])[0] or 'application/octet-stream'
+        status = 200
+        start, stop = 0, size
+        # 快照中的文件不会变化，只有 If-Range 给出了不同的ETag时才返回完整内容
+        if request.range and request.if_range.etag in (None, etag):
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+            start, stop = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        chunks = restore_manager.iter_file(info, start, stop)
+        return Response(stream_with_context(chunks), status=status, mimetype=mimetype, headers=headers)
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"下载文件失败: {str(e)}")
+        return jsonify({"error": "下载文件失败"}), 500
+
+@app.route('/api/tasks/<int:task_id>/commits/<commit_hash>/extract', methods=['POST'])
+def extract_snapshot(task_id, commit_hash):
+    """把指定提交中的文件或目录写入其他目录（不修改源目录）"""
+    try:
+        data = request.get_json() or {}
+        result = restore_manager.extract_snapshot(task_id, commit_hash, data.get('path', ''),
+                                                  data.get('target_dir'), bool(data.get('overwrite')))
+        return jsonify(result)
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"导出快照失败: {str(e)}")
+        return jsonify({"error": "导出快照失败"}), 500
+
+@app.route('/api/tasks/<int:task_id>/commits/<commit_hash>/diff', methods=['GET'])
+def get_restore_diff(task_id, commit_hash):
+    """还原前预览：分页列出还原到指定提交时会变化的文件"""
+    try:
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        result = restore_manager.get_diff_summary(task_id, commit_hash, request.args.get('base', 'worktree'),
+                                                  max(request.args.get('offset', 0, type=int), 0), limit)
+        return jsonify(result)
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"获取还原预览失败: {str(e)}")
+        return jsonify({"error": "获取还原预览失败"}), 500
+
+@app.route('/api/tasks/<int:task_id>/commits/<commit_hash>/diff/file', methods=['GET'])
+def get_restore_file_diff(task_id, commit_hash):
+    """还原前预览：单个文件的补丁"""
+    try:
+        return jsonify(restore_manager.get_file_diff(task_id, commit_hash, request.args.get('path', ''),
+                                                     request.args.get('base', 'worktree')))
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"获取文件差异失败: {str(e)}")
+        return jsonify({"error": "获取文件差异失败"}), 500
+
+@app.route('/api/tasks/<int:task_id>/worktrees', methods=['POST'])
+def create_worktree(task_id):
+    """把快照还原到独立目录（不修改源目录和远程仓库），立即返回202"""
+    try:
+        data = request.get_json() or {}
+        commit_hash = data.get('commit_hash')
+        if not commit_hash:
+            return jsonify({"error": "未提供提交哈希值"}), 400
+        ttl = data.get('ttl')
+        info = worktree_manager.create(task_id, commit_hash, data.get('path', ''), int(ttl) if ttl else None)
+        return jsonify(info), 202, {'Location': url_for('get_worktree', worktree_id=info['id'])}
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"创建快照目录失败: {str(e)}")
+        return jsonify({"error": "创建快照目录失败"}), 500
+
+@app.route('/api/worktrees', methods=['GET'])
+def list_worktrees():
+    """列出快照目录"""
+    return jsonify(worktree_manager.list(request.args.get('task_id', type=int)))
+
+@app.route('/api/worktrees/<worktree_id>', methods=['GET'])
+def get_worktree(worktree_id):
+    """查询快照目录状态"""
+    info = worktree_manager.get(worktree_id)
+    if not info:
+        return jsonify({'error': '快照目录不存在'}), 404
+    return jsonify(info)
+
+@app.route('/api/worktrees/<worktree_id>', methods=['DELETE'])
+def delete_worktree(worktree_id):
+    """删除快照目录"""
+    try:
+        if not worktree_manager.remove(worktree_id):
+            return jsonify({'error': '快照目录不存在'}), 404
+        return jsonify({'message': '快照目录已删除'})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+
+@app.route('/api/git/stats', methods=['GET'])
+def get_git_stats():
+    """获取Git进程池统计信息"""
+    try:
+        stats = git_pool.get_stats()
+        stats['ssh'] = git_manager.ssh_mux.get_stats()
+        stats['remote_refs'] = git_manager.remote_refs.get_stats()
+        return jsonify(stats)
+    except Exception as e:
+        logger.error(f"获取Git统计信息失败: {str(e)}")
+        return jsonify({'error': '获取Git统计信息失败'}), 500
+
+@app.route('/api/executor/stats', methods=['GET'])
+def get_executor_stats():
+    """获取备份执行器队列状态"""
+    try:
+        return jsonify(task_manager.get_executor_stats())
+    except Exception as e:
+        logger.error(f"获取执行器状态失败: {str(e)}")
+        return jsonify({'error': '获取执行器状态失败'}), 500
+
 # WebSocket事件
 @socketio.on('connect')
 def handle_connect():
@@ -253,6 +498,32 @@ def handle_disconnect():
 def handle_task_update(data):
     emit('task_updated', data, broadcast=True)
 
+def stream_diff_preview(sid, task_id, commit_hash, base, per_page):
+    """逐页推送变更文件列表给发起请求的客户端"""
+    try:
+        for page in restore_manager.iter_diff_pages(task_id, commit_hash, base, per_page):
+            page['task_id'] = task_id
+            socketio.emit('diff_done' if page.get('done') else 'diff_page', page, to=sid)
+    except Exception as e:
+        logger.error(f"推送还原预览失败: {str(e)}")
+        socketio.emit('diff_error', {'task_id': task_id, 'commit': commit_hash, 'error': str(e)}, to=sid)
+
+@socketio.on('diff_preview')
+def handle_diff_preview(data):
+    """请求还原预览：先逐页推送 diff_page，结束时推送 diff_done（总数和各状态数量）"""
+    per_page = min(max(int(data.get('per_page') or 100), 1), 1000)
+    socketio.start_background_task(stream_diff_preview, request.sid, data.get('task_id'),
+                                   data.get('commit_hash'), data.get('base', 'worktree'), per_page)
+
+@socketio.on('diff_file')
+def handle_diff_file(data):
+    """按需请求单个文件的补丁"""
+    try:
+        emit('diff_file', restore_manager.get_file_diff(data.get('task_id'), data.get('commit_hash'),
+                                                        data.get('path', ''), data.get('base', 'worktree')))
+    except Exception as e:
+        emit('diff_error', {'task_id': data.get('task_id'), 'path': data.get('path'), 'error': str(e)})
+
 def run_app():
     """运行应用"""
     try:
@@ -0,0 +1,91 @@
+"""在合成的大目录树上对比启用加速配置前后的 git status 耗时
+
+用法：
+    python benchmarks/status_latency.py --files 200000 --dirs 2000 --runs 5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import git
+from modules.repo_accel import RepoAccelerator, GitCapabilities
+
+
+def build_tree(root, files, dirs):
+    """生成合成目录树"""
+    per_dir = max(1, files // dirs)
+    created = 0
+    for d in range(dirs):
+        dir_path = os.path.join(root, f"d{d // 100:03d}", f"d{d:05d}")
+        os.makedirs(dir_path, exist_ok=True)
+        for f in range(per_dir):
+            with open(os.path.join(dir_path, f"f{f:05d}.txt"), 'w') as fh:
+                fh.write(f"{d}-{f}\n")
+            created += 1
+            if created >= files:
+                return created
+    return created
+
+
+def time_status(repo_path, runs):
+    """多次执行 git status 并返回各次耗时（毫秒）"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(['git', 'status', '--porcelain'], cwd=repo_path,
+                       stdout=subprocess.DEVNULL, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='git status 加速配置基准测试')
+    parser.add_argument('--files', type=int, default=100000, help='文件数量')
+    parser.add_argument('--dirs', type=int, default=1000, help='目录数量')
+    parser.add_argument('--runs', type=int, default=5, help='每种配置的测量次数')
+    parser.add_argument('--keep', action='store_true', help='保留生成的临时目录')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='git_status_bench_')
+    repo_path = os.path.join(work_dir, 'repo')
+    state_dir = os.path.join(work_dir, 'state')
+    try:
+        print(f"Git能力: {GitCapabilities.probe()}")
+        print(f"生成目录树: {args.files} 个文件, {args.dirs} 个目录 -> {repo_path}")
+        os.makedirs(repo_path)
+        build_tree(repo_path, args.files, args.dirs)
+
+        repo = git.Repo.init(repo_path)
+        repo.git.add('-A')
+        repo.index.commit('bench')
+        # 预热文件系统缓存和索引stat信息
+        time_status(repo_path, 1)
+        before = time_status(repo_path, args.runs)
+
+        task = {'id': 'bench', 'source_path': repo_path, 'accelerate': True}
+        RepoAccelerator(state_dir).apply(task, repo)
+        repo.git.commit_graph('write', '--reachable')
+        # 第一次status会填充untracked cache / fsmonitor状态
+        time_status(repo_path, 1)
+        after = time_status(repo_path, args.runs)
+
+        print(f"{'配置':<12}{'中位数(ms)':>14}{'最小(ms)':>12}{'最大(ms)':>12}")
+        for name, samples in (('默认', before), ('加速', after)):
+            print(f"{name:<12}{statistics.median(samples):>14.1f}{min(samples):>12.1f}{max(samples):>12.1f}")
+        print(f"加速比: {statistics.median(before) / statistics.median(after):.2f}x")
+    finally:
+        if args.keep:
+            print(f"已保留临时目录: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
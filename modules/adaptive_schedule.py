@@ -0,0 +1,101 @@
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from modules.task_state import get_task_state_dir, load_json, save_json
+
+logger = logging.getLogger('git_backup')
+
+# 自适应调度的默认最短/最长间隔（秒）
+DEFAULT_MIN_INTERVAL = int(os.getenv('ADAPTIVE_MIN_INTERVAL', '300'))
+DEFAULT_MAX_INTERVAL = int(os.getenv('ADAPTIVE_MAX_INTERVAL', '86400'))
+# 变化率的指数加权系数
+RATE_ALPHA = 0.3
+# 每次提交平均变化文件数达到该值时视为繁忙任务，间隔减半
+BUSY_FILES = 100
+
+
+class AdaptiveScheduler:
+    """根据任务历史的变化情况调整备份间隔
+
+    每次备份后更新变化率（单位时间内产生提交的次数，指数加权平均），
+    下次间隔约为两次变化之间的平均时间：连续空跑时逐步放宽，连续有变化时逐步收紧，
+    始终限制在 [最短间隔, min(最长间隔, RPO)] 之内，保证恢复点目标。
+    """
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.logger = logger
+
+    @staticmethod
+    def is_enabled(task):
+        return bool(task.get('adaptive'))
+
+    @staticmethod
+    def get_bounds(task):
+        """返回 (最短间隔, 最长间隔)，最长间隔不超过任务的RPO"""
+        low = int(task.get('adaptive_min_interval') or DEFAULT_MIN_INTERVAL)
+        high = int(task.get('adaptive_max_interval') or DEFAULT_MAX_INTERVAL)
+        if task.get('rpo'):
+            high = min(high, int(task['rpo']))
+        low = max(1, min(low, high))
+        return low, high
+
+    def _state_file(self, task):
+        return os.path.join(get_task_state_dir(self.state_dir, task), 'adaptive.json')
+
+    def get_state(self, task):
+        return load_json(self._state_file(task), {})
+
+    def record(self, task, success, committed=False, files_changed=0, now=None):
+        """记录一次备份结果并计算下次间隔"""
+        now = now or time.time()
+        low, high = self.get_bounds(task)
+        state = self.get_state(task)
+        previous = state.get('interval', low)
+
+        if not success:
+            # 失败时不学习，尽快重试
+            state.update(interval=low, last_run=now, last_success=False)
+            save_json(self._state_file(task), state)
+            return state
+
+        rate = state.get('rate', 1.0 / low)
+        files = state.get('files', 0.0)
+        last_run = state.get('last_run')
+        if last_run:
+            elapsed = max(1.0, now - last_run)
+            rate = RATE_ALPHA * ((1.0 if committed else 0.0) / elapsed) + (1 - RATE_ALPHA) * rate
+        if committed:
+            files = RATE_ALPHA * files_changed + (1 - RATE_ALPHA) * files
+
+        interval = 1.0 / rate if rate > 0 else high
+        if committed:
+            # 有变化时至少收紧一些
+            interval = min(interval, previous * 0.75)
+        else:
+            # 空跑时至少放宽一些
+            interval = max(interval, previous * 1.25)
+        # 单次最多放宽一倍，避免估计偏差导致跳跃
+        interval = min(interval, previous * 2)
+        if files >= BUSY_FILES:
+            interval /= 2
+        interval = int(max(low, min(high, interval)))
+
+        state.update(rate=rate, files=files, interval=interval, last_run=now,
+                     last_success=True, runs=state.get('runs', 0) + 1)
+        save_json(self._state_file(task), state)
+        self.logger.debug(f"任务 {task.get('id')} 自适应间隔: {interval}s (变化率 {rate * 3600:.2f}/小时)")
+        return state
+
+    def next_run_time(self, task, timezone=None):
+        """计算下次执行时间"""
+        low, high = self.get_bounds(task)
+        state = self.get_state(task)
+        interval = min(max(state.get('interval', low), low), high)
+        now = datetime.now(timezone)
+        last_run = state.get('last_run')
+        if not last_run:
+            return now + timedelta(seconds=interval)
+        run_time = datetime.fromtimestamp(last_run, timezone) + timedelta(seconds=interval)
+        return max(run_time, now + timedelta(seconds=1))
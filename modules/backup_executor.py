@@ -0,0 +1,362 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import deque, Counter, OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger('git_backup')
+
+# 并发执行备份的工作线程数
+DEFAULT_WORKERS = int(os.getenv('BACKUP_WORKERS', '4'))
+# 同一远程主机同时执行的备份数量上限
+DEFAULT_HOST_CONCURRENCY = int(os.getenv('BACKUP_HOST_CONCURRENCY', '2'))
+# 等待执行的任务数量上限
+DEFAULT_QUEUE_SIZE = int(os.getenv('BACKUP_QUEUE_SIZE', '1000'))
+# 合并推送的等待窗口（秒）：推送到同一远程的任务在窗口内到达时合并为一次推送，0表示不合并
+DEFAULT_COALESCE_WINDOW = float(os.getenv('BACKUP_COALESCE_WINDOW', '2'))
+# 一次合并推送包含的任务数量上限
+DEFAULT_PUSH_BATCH = int(os.getenv('BACKUP_PUSH_BATCH', '20'))
+# 保留的已完成任务记录数量
+FINISHED_JOBS_LIMIT = 1000
+
+
+def get_remote_host(remote_url):
+    """从远程仓库地址中解析主机名"""
+    if not remote_url:
+        return 'unknown'
+    if '://' in remote_url:
+        parsed = urlparse(remote_url)
+        if parsed.scheme == 'file':
+            return 'local'
+        return (parsed.hostname or 'unknown').lower()
+    if '@' in remote_url and ':' in remote_url.split('@', 1)[1]:
+        # scp格式: git@github.com:user/repo.git
+        return remote_url.split('@', 1)[1].split(':', 1)[0].lower()
+    return 'local'
+
+
+class QueueFullError(Exception):
+    """等待队列已满"""
+
+
+class BackupJob:
+    """一次备份执行"""
+
+    def __init__(self, task_id, repo_key, host, source, group_key=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.task_id = task_id
+        self.repo_key = repo_key
+        self.host = host
+        self.source = source
+        self.group_key = group_key
+        self.batch_size = 1
+        self.status = 'queued'
+        self.success = None
+        self.message = ''
+        self.error = None
+        self.stats = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """等待执行完成"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'task_id': self.task_id,
+            'status': self.status,
+            'success': self.success,
+            'message': self.message,
+            'error': self.error,
+            'source': self.source,
+            'host': self.host,
+            'batch_size': self.batch_size,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class BackupExecutor:
+    """有界并发的备份执行器
+
+    - 固定数量的工作线程
+    - 同一仓库路径同一时间只执行一个备份
+    - 每个远程主机的并发数量有上限，避免触发托管平台的限流
+    - 同一任务已在队列中等待时，新的请求合并到等待中的任务
+    - 推送到同一远程（相同认证）的任务在合并窗口内到达时，交给 batch_func 一次推送，
+      整批只占用一个主机名额
+
+    run_func(任务ID) 返回 (是否成功, 消息)，batch_func(任务ID列表) 返回 {任务ID: (是否成功, 消息)}，
+    消息保存在执行记录中。
+    """
+
+    def __init__(self, run_func, max_workers=DEFAULT_WORKERS,
+                 host_concurrency=DEFAULT_HOST_CONCURRENCY, max_queue=DEFAULT_QUEUE_SIZE,
+                 batch_func=None, group_func=None, coalesce_window=DEFAULT_COALESCE_WINDOW,
+                 max_batch=DEFAULT_PUSH_BATCH, stats_func=None):
+        self.run_func = run_func
+        self.stats_func = stats_func
+        self.batch_func = batch_func
+        self.group_func = group_func
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.max_workers = max_workers
+        self.host_concurrency = host_concurrency
+        self.max_queue = max_queue
+        self.logger = logger
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._queued_by_task = {}
+        self._running = {}
+        self._running_repos = set()
+        self._running_hosts = Counter()
+        self._finished = OrderedDict()
+        self._completed = 0
+        self._failed = 0
+        self._batches = 0
+        self._stopped = False
+        self._listeners = []
+        self._threads = []
+        for number in range(max_workers):
+            thread = threading.Thread(target=self._worker, name=f'backup-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info(f"备份执行器已启动: 工作线程 {max_workers} 个, 每主机并发 {host_concurrency}")
+
+    def add_listener(self, listener):
+        """注册状态变化回调，参数为执行记录"""
+        self._listeners.append(listener)
+
+    def _notify(self, jobs):
+        for job in jobs:
+            for listener in self._listeners:
+                try:
+                    listener(job)
+                except Exception as e:
+                    self.logger.debug(f"执行状态回调失败: {str(e)}")
+
+    def find_active(self, task_id):
+        """获取任务正在等待或执行中的记录"""
+        with self._cond:
+            job = self._queued_by_task.get(task_id)
+            if job:
+                return job
+            for job in self._running.values():
+                if job.task_id == task_id:
+                    return job
+            return None
+
+    def submit(self, task, source='manual', collapse_running=False, job_id=None):
+        """提交备份任务
+
+        同一任务已在等待时返回已有的执行；collapse_running 为真时，
+        正在执行的同一任务也直接返回，不再排队。job_id 用于恢复重启前的排队记录。
+        """
+        task_id = task['id']
+        with self._cond:
+            existing = self._queued_by_task.get(task_id)
+            if not existing and collapse_running:
+                existing = next((job for job in self._running.values() if job.task_id == task_id), None)
+            if existing:
+                return existing
+            if len(self._pending) >= self.max_queue:
+                raise QueueFullError(f"备份队列已满 ({self.max_queue})")
+            job = BackupJob(task_id, os.path.realpath(task['source_path']),
+                            get_remote_host(task.get('remote_url')), source,
+                            self._group_key(task) if source == 'schedule' else None, job_id)
+            self._pending.append(job)
+            self._queued_by_task[task_id] = job
+            self._cond.notify()
+        self.logger.debug(f"任务 {task_id} 已加入备份队列 ({source}), 当前排队 {len(self._pending)} 个")
+        self._notify([job])
+        return job
+
+    def _group_key(self, task):
+        """计算合并推送的分组键，不能合并时返回None"""
+        if not self.batch_func or not self.group_func or self.coalesce_window <= 0:
+            return None
+        try:
+            return self.group_func(task)
+        except Exception as e:
+            self.logger.debug(f"计算任务 {task.get('id')} 的推送分组失败: {str(e)}")
+            return None
+
+    def get_job(self, job_id):
+        """根据ID获取执行记录"""
+        with self._cond:
+            for job in self._pending:
+                if job.id == job_id:
+                    return job
+            for job in self._running.values():
+                if job.id == job_id:
+                    return job
+            return self._finished.get(job_id)
+
+    def _next_runnable(self):
+        """按提交顺序找到第一个可执行的任务
+
+        返回 (任务, 等待时间)。仓库正在备份或主机达到并发上限的任务跳过；
+        可合并推送的任务在合并窗口结束前不执行，等待时间为最近一个窗口的剩余秒数。
+        """
+        now = time.time()
+        delay = None
+        for job in self._pending:
+            if job.repo_key in self._running_repos:
+                continue
+            if self._running_hosts[job.host] >= self.host_concurrency:
+                continue
+            if job.group_key:
+                remaining = job.submitted_at + self.coalesce_window - now
+                if remaining > 0:
+                    delay = remaining if delay is None else min(delay, remaining)
+                    continue
+            return job, None
+        return None, delay
+
+    def _collect_batch(self, job):
+        """收集与该任务推送到同一远程的其他等待任务"""
+        batch = [job]
+        if not job.group_key:
+            return batch
+        repos = {job.repo_key}
+        for other in self._pending:
+            if len(batch) >= self.max_batch:
+                break
+            if other is job or other.group_key != job.group_key:
+                continue
+            if other.repo_key in repos or other.repo_key in self._running_repos:
+                continue
+            repos.add(other.repo_key)
+            batch.append(other)
+        return batch
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job, delay = self._next_runnable()
+                while job is None and not self._stopped:
+                    self._cond.wait(delay)
+                    job, delay = self._next_runnable()
+                if self._stopped:
+                    return
+                batch = self._collect_batch(job)
+                now = time.time()
+                for item in batch:
+                    self._pending.remove(item)
+                    self._queued_by_task.pop(item.task_id, None)
+                    self._running[item.id] = item
+                    self._running_repos.add(item.repo_key)
+                    item.status = 'running'
+                    item.started_at = now
+                    item.batch_size = len(batch)
+                # 合并推送的整批任务只占用一个主机名额
+                self._running_hosts[job.host] += 1
+                if len(batch) > 1:
+                    self._batches += 1
+            self._notify(batch)
+
+            if len(batch) == 1:
+                self._run_single(job)
+            else:
+                self._run_batch(batch)
+
+            with self._cond:
+                finished = time.time()
+                for item in batch:
+                    item.status = 'success' if item.success else 'failed'
+                    item.finished_at = finished
+                    self._running.pop(item.id, None)
+                    self._running_repos.discard(item.repo_key)
+                    self._completed += 1
+                    if not item.success:
+                        self._failed += 1
+                    self._finished[item.id] = item
+                self._running_hosts[job.host] -= 1
+                if self._running_hosts[job.host] <= 0:
+                    del self._running_hosts[job.host]
+                while len(self._finished) > FINISHED_JOBS_LIMIT:
+                    self._finished.popitem(last=False)
+                # 仓库和主机名额释放后，其他线程可能可以继续执行
+                self._cond.notify_all()
+            for item in batch:
+                item._done.set()
+            self._notify(batch)
+
+    def _run_single(self, job):
+        try:
+            success, message = self.run_func(job.task_id)
+            job.success = bool(success)
+            job.message = message or ('备份成功' if job.success else '备份失败')
+        except Exception as e:
+            job.success = False
+            job.message = job.error = str(e)
+            self.logger.error(f"执行备份任务 {job.task_id} 失败: {str(e)}")
+        self._collect_stats([job])
+
+    def _collect_stats(self, batch):
+        """在释放仓库之前读取本次执行的统计，避免被同一任务的下一次执行覆盖"""
+        if not self.stats_func:
+            return
+        for job in batch:
+            try:
+                job.stats = self.stats_func(job.task_id)
+            except Exception as e:
+                self.logger.debug(f"获取任务 {job.task_id} 执行统计失败: {str(e)}")
+
+    def _run_batch(self, batch):
+        """执行合并推送，每个任务单独记录结果"""
+        self.logger.info(f"合并推送 {len(batch)} 个任务: {[job.task_id for job in batch]}")
+        try:
+            results = self.batch_func([job.task_id for job in batch])
+        except Exception as e:
+            self.logger.error(f"合并推送失败: {str(e)}")
+            results = {}
+            for job in batch:
+                job.error = str(e)
+        for job in batch:
+            success, message = results.get(job.task_id, (False, None))
+            job.success = bool(success)
+            if job.error:
+                job.message = job.error
+            else:
+                job.message = message or ('备份成功' if job.success else '备份失败')
+        self._collect_stats(batch)
+
+    def list_jobs(self, task_id=None, limit=50):
+        """列出等待、执行中和最近完成的记录（新的在前）"""
+        with self._cond:
+            jobs = list(self._pending) + list(self._running.values()) + list(self._finished.values())
+        # 先按任务过滤再截取，否则其他任务较多时会漏掉该任务的完成记录
+        if task_id is not None:
+            jobs = [job for job in jobs if job.task_id == task_id]
+        jobs.sort(key=lambda job: job.submitted_at, reverse=True)
+        return jobs[:limit]
+
+    def get_stats(self):
+        """获取队列和执行状态"""
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'host_concurrency': self.host_concurrency,
+                'max_queue': self.max_queue,
+                'queued': len(self._pending),
+                'running': len(self._running),
+                'running_by_host': dict(self._running_hosts),
+                'completed': self._completed,
+                'failed': self._failed,
+                'coalesced_batches': self._batches,
+                'oldest_queued_seconds': round(time.time() - self._pending[0].submitted_at, 1) if self._pending else 0
+            }
+
+    def shutdown(self):
+        """停止工作线程，等待中的任务不再执行"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
@@ -0,0 +1,280 @@
+import os
+import sys
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+
+logger = logging.getLogger('git_backup')
+
+# inotify事件掩码
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# 日志中最多记录的路径数量，超过后视为溢出并回退到全量扫描
+DEFAULT_MAX_ENTRIES = int(os.getenv('WATCH_JOURNAL_MAX_ENTRIES', '50000'))
+
+
+class ChangeJournal:
+    """记录两次备份之间发生变化的路径
+
+    只保存在内存中：进程重启后监听器重新启动并标记溢出，下一次备份会全量扫描，
+    因此不需要持久化。溢出（路径过多、inotify队列溢出或监听器重启）后
+    下一次备份将回退到全量扫描。
+    """
+
+    def __init__(self, repo_path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.repo_path = repo_path
+        self.max_entries = max_entries
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._paths = set()
+        self._overflow = False
+
+    def reset(self):
+        """重置日志；重置前发生的变化未知，因此标记为溢出"""
+        with self._lock:
+            self._paths = set()
+            self._overflow = True
+
+    def mark_overflow(self, reason=''):
+        """标记日志溢出"""
+        with self._lock:
+            self._mark_overflow_locked(reason)
+
+    def _mark_overflow_locked(self, reason):
+        if self._overflow:
+            return
+        self._overflow = True
+        self._paths = set()
+        self.logger.warning(f"变更日志已溢出，下次备份将全量扫描: {self.repo_path} {reason}")
+
+    def record(self, paths):
+        """记录变化的相对路径"""
+        with self._lock:
+            if self._overflow:
+                return
+            new_paths = [path for path in paths if path not in self._paths]
+            if not new_paths:
+                return
+            if len(self._paths) + len(new_paths) > self.max_entries:
+                self._mark_overflow_locked(f"(超过 {self.max_entries} 条)")
+                return
+            self._paths.update(new_paths)
+
+    def peek(self):
+        """查看当前记录的变化路径（不清空），日志溢出时返回None"""
+        with self._lock:
+            return None if self._overflow else sorted(self._paths)
+
+    def take(self):
+        """取出并清空当前日志
+
+        返回变化路径列表；日志溢出时返回None，表示需要全量扫描。
+        """
+        with self._lock:
+            overflow = self._overflow
+            paths = sorted(self._paths)
+            self._paths = set()
+            self._overflow = False
+        return None if overflow else paths
+
+
+class InotifyWatcher:
+    """基于inotify的目录监听器，将变化写入ChangeJournal"""
+
+    def __init__(self, repo_path, journal):
+        self.repo_path = os.path.abspath(repo_path)
+        self.journal = journal
+        self.logger = logger
+        self._libc = None
+        self._fd = None
+        self._watches = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def is_supported():
+        """当前平台是否支持inotify"""
+        return sys.platform.startswith('linux') and ctypes.util.find_library('c') is not None
+
+    def start(self):
+        """启动监听线程"""
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+
+        # 监听器启动前的变化未知，先标记为溢出
+        self.journal.reset()
+        self._add_tree('')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f'watcher:{self.repo_path}', daemon=True)
+        self._thread.start()
+        self.logger.info(f"已启动目录监听: {self.repo_path} (监听目录 {len(self._watches)} 个)")
+
+    def stop(self):
+        """停止监听线程并释放inotify描述符"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._watches = {}
+        self.logger.info(f"已停止目录监听: {self.repo_path}")
+
+    def is_alive(self):
+        """监听线程是否在运行"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _add_watch(self, rel_path):
+        abs_path = os.path.join(self.repo_path, rel_path) if rel_path else self.repo_path
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(abs_path), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                self.journal.mark_overflow("(inotify监听数量达到上限)")
+            return False
+        self._watches[wd] = rel_path
+        return True
+
+    def _add_tree(self, rel_path):
+        """递归监听目录，跳过.git目录"""
+        stack = [rel_path]
+        while stack:
+            current = stack.pop()
+            if not self._add_watch(current):
+                continue
+            abs_path = os.path.join(self.repo_path, current) if current else self.repo_path
+            try:
+                with os.scandir(abs_path) as entries:
+                    for entry in entries:
+                        if entry.name == '.git':
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(f"{current}/{entry.name}" if current else entry.name)
+            except OSError:
+                continue
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                readable, _, _ = select.select([self._fd], [], [], 1.0)
+                if not readable:
+                    continue
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                self.logger.error(f"读取inotify事件失败: {str(e)}")
+                self.journal.mark_overflow("(监听异常)")
+                return
+            self._handle_events(data)
+
+    def _handle_events(self, data):
+        changed = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                self.journal.mark_overflow("(inotify队列溢出)")
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            parent = self._watches.get(wd)
+            if parent is None:
+                continue
+            if not name:
+                # 被监听目录自身被删除或移动
+                if parent and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    changed.append(parent)
+                continue
+
+            name = os.fsdecode(name)
+            if name == '.git':
+                continue
+            rel_path = f"{parent}/{name}" if parent else name
+            changed.append(rel_path)
+
+            # 新建或移入的目录需要补充监听
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(rel_path)
+
+        if changed:
+            self.journal.record(changed)
+
+
+class WatcherRegistry:
+    """管理各任务的目录监听器"""
+
+    def __init__(self):
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._watchers = {}
+
+    def start(self, key, repo_path):
+        """启动（或重启）任务的监听器"""
+        self.stop(key)
+        if not InotifyWatcher.is_supported():
+            self.logger.warning("当前平台不支持inotify，监听模式不可用")
+            return None
+        watcher = InotifyWatcher(repo_path, ChangeJournal(repo_path))
+        try:
+            watcher.start()
+        except OSError as e:
+            self.logger.error(f"启动目录监听失败 {repo_path}: {str(e)}")
+            return None
+        with self._lock:
+            self._watchers[key] = watcher
+        return watcher
+
+    def stop(self, key):
+        """停止任务的监听器"""
+        with self._lock:
+            watcher = self._watchers.pop(key, None)
+        if watcher:
+            watcher.stop()
+
+    def get(self, key):
+        """获取正在运行的监听器"""
+        with self._lock:
+            watcher = self._watchers.get(key)
+        if watcher and watcher.is_alive():
+            return watcher
+        return None
+
+    def stop_all(self):
+        """停止所有监听器"""
+        with self._lock:
+            keys = list(self._watchers)
+        for key in keys:
+            self.stop(key)
@@ -0,0 +1,132 @@
+import logging
+
+logger = logging.getLogger('git_backup')
+
+# 每个提交以 \x1e 开头，字段之间以 \x1f 分隔，最后一个字段之后是 --numstat 的输出
+LOG_FORMAT = '%x1e%H%x1f%an%x1f%ct%x1f%cI%x1f%B%x1f'
+
+
+def parse_numstat_files(text):
+    """解析 --numstat 输出，返回 [(路径, 新增行数, 删除行数)]；二进制文件的行数按0计"""
+    files = []
+    for line in text.splitlines():
+        parts = line.split('\t', 2)
+        if len(parts) != 3:
+            continue
+        insertions = int(parts[0]) if parts[0] != '-' else 0
+        deletions = int(parts[1]) if parts[1] != '-' else 0
+        files.append((parts[2], insertions, deletions))
+    return files
+
+
+def parse_raw_files(text):
+    """解析 --raw --no-abbrev 输出，返回 {路径: (状态, 新blob)}；删除的文件blob为None"""
+    files = {}
+    for line in text.splitlines():
+        if not line.startswith(':'):
+            continue
+        meta, path = line.split('\t', 1)
+        parts = meta.split()
+        blob = parts[3] if parts[3].strip('0') else None
+        files[path] = (parts[4][:1], blob)
+    return files
+
+
+def parse_log_record(record, with_files=False):
+    """解析一条 LOG_FORMAT 格式的提交记录
+
+    with_files 为真时（需要 --raw 输出）同时返回每个文件的 (路径, 新增行数, 删除行数, 状态, 新blob)。
+    """
+    commit_hash, author, timestamp, date, message, numstat = record.split('\x1f', 5)
+    file_stats = parse_numstat_files(numstat)
+    commit = {
+        'hash': commit_hash,
+        'message': message.strip(),
+        'date': date,
+        'timestamp': int(timestamp),
+        'author': author,
+        'stats': {
+            'files': len(file_stats),
+            'insertions': sum(f[1] for f in file_stats),
+            'deletions': sum(f[2] for f in file_stats)
+        }
+    }
+    if with_files:
+        raw = parse_raw_files(numstat)
+        commit['files'] = [(path, insertions, deletions) + raw.get(path, ('M', None))
+                           for path, insertions, deletions in file_stats]
+    return commit
+
+
+def _log_args(rev, skip=0, max_count=None, raw=False):
+    args = [rev, f'--format={LOG_FORMAT}', '--numstat', '--diff-merges=first-parent', '--no-renames']
+    if raw:
+        args += ['--raw', '--no-abbrev']
+    if skip:
+        args.append(f'--skip={skip}')
+    if max_count is not None:
+        args.append(f'--max-count={max_count}')
+    return args
+
+
+def read_log(git_cmd, rev, skip=0, max_count=None):
+    """用一次 git log 读取提交信息和变更统计（合并提交按第一个父提交统计）
+
+    git_cmd 为 GitProcessPool.command() 返回的独立命令对象：临时选项 -c 设置在命令对象上，
+    不能使用共享仓库句柄的 repo.git（除非持有仓库锁）。
+    """
+    output = git_cmd(c='core.quotePath=false').log(*_log_args(rev, skip, max_count),
+                                                   strip_newline_in_stdout=False)
+    return [parse_log_record(record) for record in output.split('\x1e') if record]
+
+
+def read_file_log(git_cmd, rev, path, skip=0, max_count=None):
+    """读取修改过指定路径的提交（带文件变更），用于提交索引建立之前"""
+    args = _log_args(rev, skip, max_count, raw=True) + ['--', path]
+    output = git_cmd(c='core.quotePath=false').log(*args, strip_newline_in_stdout=False,
+                                                   env={'GIT_LITERAL_PATHSPECS': '1'})
+    return [parse_log_record(record, with_files=True) for record in output.split('\x1e') if record]
+
+
+def iter_log(git_cmd, rev, chunk_size=1 << 16):
+    """流式读取 git log，逐个返回带文件变更（状态和blob）的提交，内存占用与历史长度无关"""
+    # 路径按原样输出（不转义非ASCII字符），与按路径查询时使用的路径一致
+    proc = git_cmd(c='core.quotePath=false').log(*_log_args(rev, raw=True), as_process=True)
+    buffer = b''
+    completed = False
+    try:
+        while True:
+            chunk = proc.stdout.read(chunk_size)
+            if not chunk:
+                break
+            records = (buffer + chunk).split(b'\x1e')
+            buffer = records.pop()
+            for record in records:
+                if record:
+                    yield parse_log_record(record.decode('utf-8', 'replace'), with_files=True)
+        if buffer:
+            yield parse_log_record(buffer.decode('utf-8', 'replace'), with_files=True)
+        completed = True
+    finally:
+        proc.stdout.close()
+        if completed:
+            proc.wait()
+        else:
+            # 调用方提前停止读取，git因管道关闭而退出不是错误
+            proc.proc.kill()
+            proc.proc.wait()
+
+
+def count_commits(git_cmd, rev):
+    """统计提交数量（只遍历提交图，不读取变更）"""
+    return int(git_cmd.rev_list('--count', rev))
+
+
+def resolve_history_ref(repo, branch):
+    """历史记录使用的分支：优先使用远程分支，不存在时使用本地分支，返回 (引用名, 顶端SHA)，都不存在时返回None"""
+    remote_ref = f'origin/{branch}'
+    if remote_ref in repo.refs:
+        return remote_ref, repo.refs[remote_ref].commit.hexsha
+    if branch in repo.heads:
+        return branch, repo.heads[branch].commit.hexsha
+    return None
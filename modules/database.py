@@ -1,25 +1,134 @@
-def init_db():
+import os
+import sqlite3
+
+
+def get_db(db_path):
+    """打开数据库连接（WAL模式，读写互不阻塞）"""
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    return conn
+
+
+def init_db(db_path):
     """初始化数据库"""
-    conn = get_db()
+    conn = get_db(db_path)
     c = conn.cursor()
     
-    # 创建任务表
+    # 早期草稿中的任务表没有 data 列且从未写入，直接重建
+    columns = [row[1] for row in c.execute('PRAGMA table_info(tasks)').fetchall()]
+    if columns and 'data' not in columns and not c.execute('SELECT 1 FROM tasks LIMIT 1').fetchone():
+        c.execute('DROP TABLE tasks')
+    
+    # 创建任务表：常用字段单独成列用于索引，完整配置保存在 data (JSON)
     c.execute('''
         CREATE TABLE IF NOT EXISTS tasks (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
             source_path TEXT NOT NULL,
             remote_url TEXT NOT NULL,
-            branch TEXT NOT NULL DEFAULT 'main',
-            auth_type TEXT NOT NULL,
-            access_token TEXT,
-            ssh_key_content TEXT,
-            schedule TEXT,
-            webhook_url TEXT,
             enabled INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            data TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_source_remote ON tasks (source_path, remote_url)')
+    
+    # 键值元数据（例如YAML迁移标记）
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    
+    # 备份执行记录：每次执行一行
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL UNIQUE,
+            task_id INTEGER NOT NULL,
+            source TEXT,
+            status TEXT NOT NULL,
+            message TEXT,
+            submitted_at REAL,
+            started_at REAL,
+            finished_at REAL,
+            duration REAL,
+            phases TEXT,
+            commit_sha TEXT,
+            files_changed INTEGER DEFAULT 0,
+            bytes_pushed INTEGER DEFAULT 0,
+            pushed INTEGER DEFAULT 0,
+            batch_size INTEGER DEFAULT 1
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_runs_task_started ON runs (task_id, started_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_runs_started ON runs (started_at DESC)')
+    
+    # 等待或执行中的备份，重启后恢复
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            task_id INTEGER NOT NULL,
+            source TEXT,
+            status TEXT NOT NULL,
+            submitted_at REAL NOT NULL,
+            started_at REAL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_submitted ON jobs (submitted_at)')
+    
+    # 提交元数据索引：seq 为提交在分支历史中的位置（最早的为1），分页直接按 seq 读取
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS commits (
+            task_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            timestamp INTEGER,
+            date TEXT,
+            author TEXT,
+            message TEXT,
+            files INTEGER DEFAULT 0,
+            insertions INTEGER DEFAULT 0,
+            deletions INTEGER DEFAULT 0,
+            PRIMARY KEY (task_id, seq)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_commits_hash ON commits (task_id, hash)')
+    
+    # 提交中每个文件的变更：按 (路径, seq) 存储，单个文件的修改历史直接按主键范围读取；
+    # status 为 A/M/D/T，blob 为该提交中的文件内容（删除时为空）
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS commit_files (
+            task_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            blob TEXT,
+            insertions INTEGER DEFAULT 0,
+            deletions INTEGER DEFAULT 0,
+            PRIMARY KEY (task_id, path, seq)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_commit_files_seq ON commit_files (task_id, seq)')
+    
+    # 每个任务已索引到的分支和顶端提交
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS commit_index (
+            task_id INTEGER PRIMARY KEY,
+            ref TEXT NOT NULL,
+            tip TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            updated_at REAL
         )
     ''')
     
     conn.commit()
-    conn.close() 
\ No newline at end of file
+    conn.close()
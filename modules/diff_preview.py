@@ -0,0 +1,112 @@
+import os
+import logging
+import git
+
+logger = logging.getLogger('git_backup')
+
+# 超过此大小（字节）的文件只返回大小，不生成补丁
+DIFF_MAX_FILE_SIZE = int(os.getenv('DIFF_PREVIEW_MAX_FILE_SIZE', str(1024 * 1024)))
+
+# 比较基准: 当前工作区（还原实际会改写的内容）或当前分支的 HEAD
+DIFF_BASES = ('worktree', 'head')
+
+# name-status 状态码
+DIFF_STATUS = {
+    'A': 'added',
+    'D': 'deleted',
+    'M': 'modified',
+    'T': 'type_changed',
+}
+
+
+def _diff_args(sha, base):
+    """比较 基准 -> 目标提交 的 git diff 参数"""
+    if base not in DIFF_BASES:
+        raise ValueError(f"不支持的比较基准: {base}")
+    # 工作区与提交比较时 git 以提交为旧版本，用 -R 反转为 工作区 -> 提交
+    return ['-R', sha] if base == 'worktree' else ['HEAD', sha]
+
+
+def iter_name_status(git_cmd, sha, base='worktree', chunk_size=1 << 16):
+    """流式读取变更文件列表，逐个返回 (状态, 路径)；只比较文件状态和对象ID，不读取内容差异
+
+    git_cmd 为 GitProcessPool.command() 返回的独立命令对象，不占用仓库句柄。
+    """
+    proc = git_cmd.diff('--name-status', '-z', '--no-renames', *_diff_args(sha, base), as_process=True)
+    buffer = b''
+    finished = False
+    try:
+        while True:
+            chunk = proc.stdout.read(chunk_size)
+            if not chunk:
+                finished = True
+                break
+            fields = (buffer + chunk).split(b'\0')
+            buffer = fields.pop()
+            # 字段成对出现（状态、路径），不完整的一对留到下一块
+            if len(fields) % 2:
+                buffer = fields.pop() + b'\0' + buffer
+            for status, path in zip(fields[0::2], fields[1::2]):
+                yield status.decode()[:1], os.fsdecode(path)
+    finally:
+        proc.stdout.close()
+        killed = not finished and proc.proc.poll() is None
+        if killed:
+            proc.proc.kill()
+        try:
+            proc.wait()
+        except git.exc.GitCommandError:
+            if not killed:
+                raise
+
+
+def summarize(status, path):
+    return {'path': path, 'status': DIFF_STATUS.get(status, status)}
+
+
+def _blob_size(git_cmd, spec):
+    try:
+        return int(git_cmd.cat_file('-s', spec))
+    except git.exc.GitCommandError:
+        return None
+
+
+def _current_size(git_cmd, base, path):
+    """基准一侧的文件大小，不存在时返回None"""
+    if base == 'head':
+        return _blob_size(git_cmd, f'HEAD:{path}')
+    try:
+        return os.lstat(os.path.join(git_cmd.working_dir, path)).st_size
+    except OSError:
+        return None
+
+
+def file_diff(git_cmd, sha, path, base='worktree', max_size=DIFF_MAX_FILE_SIZE):
+    """生成单个文件的补丁；二进制文件和超过 max_size 的文件只返回两侧大小"""
+    env = {'GIT_LITERAL_PATHSPECS': '1'}
+    args = _diff_args(sha, base)
+    output = git_cmd.diff('--name-status', '-z', '--no-renames', *args, '--', path, env=env)
+    fields = output.split('\0')
+    result = {
+        'path': path,
+        'status': DIFF_STATUS.get(fields[0][:1], fields[0][:1]) if len(fields) >= 2 else 'unchanged',
+        'old_size': _current_size(git_cmd, base, path),
+        'new_size': _blob_size(git_cmd, f'{sha}:{path}'),
+        'binary': False,
+        'too_large': False,
+        'patch': None
+    }
+    if result['status'] == 'unchanged':
+        return result
+    if max((result['old_size'] or 0, result['new_size'] or 0)) > max_size:
+        result['too_large'] = True
+        return result
+    # -R 会交换两侧的前缀，这里预先交换，补丁中仍以 a/ 表示基准、b/ 表示目标提交
+    prefixes = ['--src-prefix=b/', '--dst-prefix=a/'] if base == 'worktree' else []
+    patch = git_cmd.diff('--no-renames', '--no-color', '--no-ext-diff', *prefixes, *args, '--', path,
+                          env=env, stdout_as_string=False).decode('utf-8', 'replace')
+    if any(line.startswith('Binary files ') for line in patch.splitlines()):
+        result['binary'] = True
+    else:
+        result['patch'] = patch
+    return result
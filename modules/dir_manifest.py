@@ -0,0 +1,129 @@
+import os
+import time
+import hashlib
+import logging
+from modules.task_state import load_json, save_json
+
+logger = logging.getLogger('git_backup')
+
+# 修改时间距离扫描时间太近的文件不可信（同一时间粒度内可能还有写入）
+RACY_MTIME_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+
+class DirectoryManifest:
+    """源目录的Merkle目录清单
+
+    每个目录记录两个摘要：
+    - own: 目录下直接文件的 (名称, 大小, 修改时间, inode) 摘要
+    - hash: own 与所有子目录 hash 的组合摘要
+    根摘要不变即可判定整个源目录没有变化，无需调用git；
+    根摘要变化时逐层比较，找出发生变化的最小子树。
+    """
+
+    VERSION = 1
+
+    def __init__(self, repo_path, manifest_file, target=''):
+        self.repo_path = os.path.abspath(repo_path)
+        self.manifest_file = manifest_file
+        # 备份目标（远程仓库和分支），目标变化时旧清单失效
+        self.target = target
+        self.logger = logger
+        self.dirs = {}
+
+    def load(self):
+        """加载上次成功备份时保存的清单"""
+        data = load_json(self.manifest_file, {})
+        if (data.get('version') == self.VERSION and data.get('root') == self.repo_path
+                and data.get('target') == self.target):
+            return data.get('dirs', {})
+        return {}
+
+    def save(self):
+        """保存清单，应在备份成功后调用"""
+        save_json(self.manifest_file, {
+            'version': self.VERSION,
+            'root': self.repo_path,
+            'target': self.target,
+            'dirs': self.dirs
+        })
+
+    def build(self):
+        """扫描源目录并计算各目录摘要，返回根摘要"""
+        start = time.time()
+        self._now_ns = time.time_ns()
+        self.dirs = {}
+        root_hash = self._hash_dir('')
+        self.logger.info(f"目录清单计算完成: 目录 {len(self.dirs)} 个, 耗时 {time.time() - start:.2f}s")
+        return root_hash
+
+    def _hash_dir(self, rel_path):
+        abs_path = os.path.join(self.repo_path, rel_path) if rel_path else self.repo_path
+        own = hashlib.sha1()
+        subdirs = []
+        try:
+            with os.scandir(abs_path) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            self.logger.warning(f"读取目录失败 {abs_path}: {str(e)}")
+            entries = []
+
+        for entry in entries:
+            if entry.name == '.git':
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            own.update(f"{entry.name}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_ino}\0{st.st_mode}\n"
+                       .encode('utf-8', 'surrogateescape'))
+            if self._now_ns - st.st_mtime_ns < RACY_MTIME_WINDOW_NS:
+                # 刚修改过的文件可能还会在同一时间粒度内变化，让摘要永不相等
+                own.update(str(self._now_ns).encode())
+
+        combined = hashlib.sha1(own.digest())
+        child_dirs = []
+        for name in subdirs:
+            child_rel = f"{rel_path}/{name}" if rel_path else name
+            # 子目录Git仓库已加入.gitignore，不参与清单
+            if os.path.lexists(os.path.join(self.repo_path, child_rel, '.git')):
+                continue
+            child_hash = self._hash_dir(child_rel)
+            child_dirs.append(name)
+            combined.update(f"{name}\0{child_hash}\n".encode('utf-8', 'surrogateescape'))
+
+        digest = combined.hexdigest()
+        self.dirs[rel_path] = [digest, own.hexdigest(), child_dirs]
+        return digest
+
+    def changed_paths(self, old_dirs):
+        """与旧清单比较，返回发生变化的最小子树路径列表
+
+        返回None表示没有可比较的旧清单，需要全量扫描。
+        """
+        if '' not in old_dirs:
+            return None
+        changed = []
+        stack = ['']
+        while stack:
+            rel_path = stack.pop()
+            new_entry = self.dirs.get(rel_path)
+            old_entry = old_dirs.get(rel_path)
+            if old_entry is None:
+                changed.append(rel_path)
+                continue
+            if new_entry[0] == old_entry[0]:
+                continue
+            if new_entry[1] != old_entry[1]:
+                # 目录下的文件发生变化，整个子树交给git处理
+                changed.append(rel_path or '.')
+                continue
+            new_children = set(new_entry[2])
+            for name in old_entry[2]:
+                if name not in new_children:
+                    changed.append(f"{rel_path}/{name}" if rel_path else name)
+            for name in new_entry[2]:
+                stack.append(f"{rel_path}/{name}" if rel_path else name)
+        return sorted(changed)
@@ -0,0 +1,178 @@
+import os
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+from urllib.parse import urlparse
+from modules.task_state import get_task_key
+
+logger = logging.getLogger('git_backup')
+
+
+def get_key_dir():
+    """临时SSH密钥目录，优先使用内存文件系统，避免密钥落盘"""
+    base = os.getenv('GIT_KEY_DIR')
+    if base:
+        return base
+    shm = '/dev/shm'
+    root = shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else tempfile.gettempdir()
+    return os.path.join(root, f'git-backup-{os.getuid()}')
+
+
+_key_dir_lock = threading.Lock()
+_key_dir_ready = set()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _remove_keys(key_dir, predicate):
+    for name in os.listdir(key_dir):
+        pid = name.split('-', 1)[0]
+        if pid.isdigit() and predicate(int(pid)):
+            try:
+                os.remove(os.path.join(key_dir, name))
+            except OSError:
+                pass
+
+
+def ensure_key_dir():
+    """创建密钥目录并清理已退出进程遗留的密钥文件（每个进程只清理一次）"""
+    key_dir = get_key_dir()
+    with _key_dir_lock:
+        if key_dir in _key_dir_ready:
+            return key_dir
+        os.makedirs(key_dir, mode=0o700, exist_ok=True)
+        st = os.lstat(key_dir)
+        if st.st_uid != os.getuid() or not os.path.isdir(key_dir) or os.path.islink(key_dir):
+            raise PermissionError(f"SSH密钥目录不安全: {key_dir}")
+        if st.st_mode & 0o077:
+            os.chmod(key_dir, 0o700)
+        _remove_keys(key_dir, lambda pid: not _pid_alive(pid))
+        _key_dir_ready.add(key_dir)
+        return key_dir
+
+
+def cleanup_key_dir():
+    """删除本进程创建的密钥文件，进程退出时调用"""
+    key_dir = get_key_dir()
+    if os.path.isdir(key_dir):
+        _remove_keys(key_dir, lambda pid: pid == os.getpid())
+
+
+class GitAuthSession:
+    """单个任务一次Git操作的认证环境
+
+    凭据只通过 env 传给需要访问远程的git命令，不修改进程全局环境变量：
+    - token 认证通过 GIT_CONFIG_* 注入仅对该主机生效的 http.extraHeader，远程地址中不再包含令牌
+    - ssh 认证通过 GIT_SSH_COMMAND 指定密钥；密钥内容写入私有目录中的独立文件，会话结束后删除
+    """
+
+    def __init__(self, task, ssh_mux=None):
+        self.task = task
+        self.ssh_mux = ssh_mux
+        self.remote_url = None
+        self.env = {'GIT_TERMINAL_PROMPT': '0'}
+        self.key_file = None
+        self.logger = logger
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """生成远程地址和认证环境变量"""
+        auth_type = self.task.get('auth_type', 'token')
+        remote_url = self.task['remote_url']
+
+        if auth_type == 'token':
+            token = self.task.get('access_token')
+            if not token:
+                raise ValueError("未提供Personal Access Token")
+            # 确保使用HTTPS URL格式
+            if remote_url.startswith('git@'):
+                remote_url = remote_url.replace('git@github.com:', 'https://github.com/')
+            if not remote_url.startswith('https://'):
+                remote_url = f'https://github.com/{remote_url.split("github.com/")[1]}'
+            # 去掉旧版本写入地址中的令牌
+            parsed = urlparse(remote_url)
+            if parsed.username:
+                remote_url = parsed._replace(netloc=parsed.hostname + (f':{parsed.port}' if parsed.port else '')).geturl()
+                parsed = urlparse(remote_url)
+            credentials = base64.b64encode(f'x-access-token:{token}'.encode('utf-8')).decode('ascii')
+            self.env.update({
+                'GIT_CONFIG_COUNT': '1',
+                'GIT_CONFIG_KEY_0': f'http.{parsed.scheme}://{parsed.netloc}/.extraHeader',
+                'GIT_CONFIG_VALUE_0': f'Authorization: Basic {credentials}'
+            })
+        elif auth_type == 'ssh':
+            if self.task.get('ssh_key_path'):
+                key_path = self.task['ssh_key_path']
+                if not os.path.exists(key_path):
+                    raise FileNotFoundError(f"SSH密钥文件不存在: {key_path}")
+                # 检查并修复SSH密钥权限
+                if os.stat(key_path).st_mode & 0o777 != 0o600:
+                    os.chmod(key_path, 0o600)
+                    self.logger.info(f"已修复SSH密钥权限: {key_path}")
+                identity = os.path.abspath(key_path)
+            elif self.task.get('ssh_key_content'):
+                key_path = self._write_key(self.task['ssh_key_content'])
+                identity = hashlib.sha1(self.task['ssh_key_content'].encode('utf-8')).hexdigest()
+            else:
+                raise ValueError("未提供SSH密钥")
+            # 确保使用SSH URL格式
+            if remote_url.startswith('https://'):
+                remote_url = remote_url.replace('https://', 'git@')
+                remote_url = remote_url.replace('github.com/', 'github.com:')
+            control_path = None
+            if self.ssh_mux and self.task.get('ssh_multiplex', True):
+                control_path = self.ssh_mux.ensure(remote_url, key_path, identity)
+            self.env['GIT_SSH_COMMAND'] = self.ssh_command(key_path, control_path)
+        else:
+            raise ValueError(f"不支持的认证类型: {auth_type}")
+
+        self.remote_url = remote_url
+        return self
+
+    @staticmethod
+    def ssh_command(key_path, control_path=None):
+        """生成只使用指定密钥的SSH命令，指定控制套接字时复用已有的主连接"""
+        command = f"ssh -i '{key_path}' -o IdentitiesOnly=yes -o StrictHostKeyChecking=no"
+        if control_path:
+            command += f" -o ControlMaster=no -o ControlPath='{control_path}'"
+        return command
+
+    def _write_key(self, content):
+        """将密钥内容写入私有目录中本会话独占的文件"""
+        key_dir = ensure_key_dir()
+        fd, key_file = tempfile.mkstemp(prefix=f'{os.getpid()}-{get_task_key(self.task)}-', suffix='.key', dir=key_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+                if not content.endswith('\n'):
+                    f.write('\n')
+        except Exception:
+            os.remove(key_file)
+            raise
+        self.key_file = key_file
+        return key_file
+
+    def close(self):
+        """删除本会话的临时密钥"""
+        if self.key_file:
+            try:
+                os.remove(self.key_file)
+            except FileNotFoundError:
+                pass
+            self.key_file = None
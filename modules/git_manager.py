@@ -2,104 +2,73 @@ import git
 import os
 import logging
 import time
+import hashlib
+from modules.repo_index import NestedRepoIndex
+from modules.task_state import get_task_key, get_task_state_dir
+from modules.change_journal import WatcherRegistry
+from modules.dir_manifest import DirectoryManifest
+from modules.git_pool import GitProcessPool
+from modules.repo_accel import RepoAccelerator
+from modules.chunk_store import LargeFileManager
+from modules.push_state import PushStateCache, parse_porcelain_push, parse_push_bytes, strip_progress
+from modules.git_env import GitAuthSession
+from modules.ssh_mux import SSHMultiplexer
+from modules.push_hub import PushHub
+from modules.remote_refs import RemoteRefCache
 
 logger = logging.getLogger('git_backup')
 
 class GitManager:
-    def __init__(self):
+    def __init__(self, state_dir=None, git_pool=None, history_index=None):
         self.logger = logger
+        self.git_pool = git_pool or GitProcessPool()
+        self.git_version = None
+        # 任务状态目录（索引等持久化数据），默认放在项目的backups目录下
+        self.state_dir = state_dir or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'backups')
+        self.accelerator = RepoAccelerator(self.state_dir)
+        self.large_files = LargeFileManager(self.state_dir, self.git_pool)
+        self.watchers = WatcherRegistry()
+        # SSH主连接复用，RestoreManager共用同一实例
+        self.ssh_mux = SSHMultiplexer()
+        # 远程引用刷新缓存，RestoreManager共用同一实例
+        self.remote_refs = RemoteRefCache(self.git_pool, self.ssh_mux)
+        # 每个任务最近一次备份的统计（是否提交、变化文件数、是否推送）
+        self.run_stats = {}
+        # 提交元数据索引，备份产生新提交后追加
+        self.history_index = history_index
     
     def check_git_available(self):
         """检查Git是否可用"""
+        if self.git_version:
+            return True
         try:
             git_version = git.Git().version()
             self.logger.info(f"Git version: {git_version}")
+            self.git_version = git_version
             return True
         except Exception as e:
             self.logger.error(f"Git not available: {str(e)}")
             return False
     
     def setup_git_auth(self, task):
-        """配置Git认证"""
-        auth_type = task.get('auth_type', 'token')
-        remote_url = task['remote_url']
-        
+        """配置Git认证，返回只作用于本次备份的认证会话"""
         try:
-            if auth_type == 'token':
-                if task.get('access_token'):
-                    # 确保使用HTTPS URL格式
-                    if remote_url.startswith('git@'):
-                        remote_url = remote_url.replace('git@github.com:', 'https://github.com/')
-                    if not remote_url.startswith('https://'):
-                        remote_url = f'https://github.com/{remote_url.split("github.com/")[1]}'
-                    token = task['access_token']
-                    remote_url = remote_url.replace('https://', f'https://{token}@')
-                    self.logger.info("已配置Personal Access Token认证")
-                else:
-                    self.logger.error("未提供Personal Access Token")
-                    return None
-            elif auth_type == 'ssh':
-                if task.get('ssh_key_path'):
-                    if os.path.exists(task['ssh_key_path']):
-                        # 检查并修复SSH密钥权限
-                        try:
-                            current_mode = os.stat(task['ssh_key_path']).st_mode & 0o777
-                            if current_mode != 0o600:
-                                os.chmod(task['ssh_key_path'], 0o600)
-                                self.logger.info(f"已修复SSH密钥权限: {task['ssh_key_path']}")
-                        except Exception as e:
-                            self.logger.error(f"修复SSH密钥权限失败: {str(e)}")
-                            return None
-                        
-                        # 设置SSH命令，添加StrictHostKeyChecking=no选项
-                        ssh_command = f"ssh -i {task['ssh_key_path']} -o StrictHostKeyChecking=no"
-                        os.environ['GIT_SSH_COMMAND'] = ssh_command
-                        self.logger.info(f"已配置SSH密钥: {task['ssh_key_path']}")
-                        
-                        # 确保使用SSH URL格式
-                        if remote_url.startswith('https://'):
-                            remote_url = remote_url.replace('https://', 'git@')
-                            remote_url = remote_url.replace('github.com/', 'github.com:')
-                            self.logger.info(f"已转换为SSH格式URL: {remote_url}")
-                    else:
-                        self.logger.error(f"SSH密钥文件不存在: {task['ssh_key_path']}")
-                        return None
-                elif task.get('ssh_key_content'):
-                    # 如果提供了SSH密钥内容，创建临时密钥文件
-                    try:
-                        ssh_key_path = os.path.join(os.path.expanduser('~'), '.ssh', 'temp_key')
-                        os.makedirs(os.path.dirname(ssh_key_path), exist_ok=True)
-                        with open(ssh_key_path, 'w') as f:
-                            f.write(task['ssh_key_content'])
-                        os.chmod(ssh_key_path, 0o600)
-                        
-                        # 设置SSH命令
-                        ssh_command = f"ssh -i {ssh_key_path} -o StrictHostKeyChecking=no"
-                        os.environ['GIT_SSH_COMMAND'] = ssh_command
-                        self.logger.info("已配置临时SSH密钥")
-                        
-                        # 确保使用SSH URL格式
-                        if remote_url.startswith('https://'):
-                            remote_url = remote_url.replace('https://', 'git@')
-                            remote_url = remote_url.replace('github.com/', 'github.com:')
-                    except Exception as e:
-                        self.logger.error(f"配置SSH密钥内容失败: {str(e)}")
-                        return None
-                else:
-                    self.logger.error("未提供SSH密钥")
-                    return None
-            
-            return remote_url
+            auth = GitAuthSession(task, self.ssh_mux).open()
+            if task.get('auth_type', 'token') == 'token':
+                self.logger.info("已配置Personal Access Token认证")
+            else:
+                self.logger.info(f"已配置SSH密钥: {task.get('ssh_key_path') or '临时密钥'}")
+            return auth
         except Exception as e:
             self.logger.error(f"配置Git认证失败: {str(e)}")
             return None
     
-    def init_git_repo(self, repo_path, remote_url, branch='main'):
+    def init_git_repo(self, repo_path, remote_url, branch='main', env=None):
         """初始化Git仓库"""
         try:
             if not os.path.exists(os.path.join(repo_path, '.git')):
                 self.logger.info(f"初始化新仓库: {repo_path}")
-                repo = git.Repo.init(repo_path)
+                repo = self.git_pool.init_repo(repo_path)
                 
                 # 使用指定的分支名称
                 repo.git.branch('-M', branch)
@@ -111,7 +80,7 @@ class GitManager:
                 
                 return repo, branch, True  # True表示是新仓库
             else:
-                repo = git.Repo(repo_path)
+                repo = self.git_pool.get_repo(repo_path)
                 
                 # 获取当前分支，如果失败则使用指定的分支
                 try:
@@ -131,7 +100,7 @@ class GitManager:
                 # 确保分支存在并切换到指定分支
                 if branch not in repo.heads:
                     # 检查远程是否有这个分支
-                    repo.git.fetch('origin')
+                    repo.git.fetch('origin', env=env)
                     remote_branch = f'origin/{branch}'
                     if remote_branch in repo.refs:
                         # 从远程分支创建本地分支
@@ -140,8 +109,9 @@ class GitManager:
                         # 创建新的本地分支
                         repo.create_head(branch)
                 
-                # 切换到指定分支
-                repo.heads[branch].checkout()
+                # 切换到指定分支（已在该分支上时不再调用checkout）
+                if current_branch != branch:
+                    repo.heads[branch].checkout()
                 
                 return repo, branch, False
         except Exception as e:
@@ -224,115 +194,467 @@ class GitManager:
             self.logger.error(f"处理Git冲突时出错: {str(e)}")
             raise
     
+    def ignore_nested_repos(self, task, repo_path):
+        """将子目录中的Git仓库添加到.gitignore"""
+        index_file = os.path.join(get_task_state_dir(self.state_dir, task), 'nested_repos.json')
+        nested_repos = NestedRepoIndex(repo_path, index_file).refresh()
+        if not nested_repos:
+            return
+        
+        # 只读取一次.gitignore
+        gitignore_path = os.path.join(repo_path, '.gitignore')
+        ignored_paths = set()
+        if os.path.exists(gitignore_path):
+            with open(gitignore_path, 'r', encoding='utf-8') as f:
+                ignored_paths = set(line.strip() for line in f if line.strip())
+        
+        new_paths = [
+            relative_path for relative_path in nested_repos
+            if relative_path not in ignored_paths and f"{relative_path}/" not in ignored_paths
+        ]
+        if new_paths:
+            with open(gitignore_path, 'a', encoding='utf-8') as f:
+                for relative_path in new_paths:
+                    f.write(f"\n{relative_path}/")
+            for relative_path in new_paths:
+                self.logger.info(f"已将子目录Git仓库添加到.gitignore: {relative_path}")
+    
+    def update_watcher(self, task):
+        """根据任务配置启动或停止目录监听"""
+        key = get_task_key(task)
+        if task.get('watch') and task.get('enabled', True) and os.path.isdir(task.get('source_path', '')):
+            self.watchers.start(key, task['source_path'])
+        else:
+            self.watchers.stop(key)
+    
+    def stop_watcher(self, task):
+        """停止任务的目录监听"""
+        self.watchers.stop(get_task_key(task))
+    
+    def take_changed_paths(self, task):
+        """取出监听器记录的变化路径，返回None表示需要全量扫描"""
+        watcher = self.watchers.get(get_task_key(task))
+        if not watcher:
+            return None
+        changed_paths = watcher.journal.take()
+        if changed_paths is None:
+            self.logger.info("变更日志不可用，执行全量扫描")
+        else:
+            self.logger.info(f"变更日志记录了 {len(changed_paths)} 个变化路径")
+        return changed_paths
+    
+    def discard_changed_paths(self, task):
+        """备份失败时丢弃已取出的变化路径，下次回退到全量扫描"""
+        watcher = self.watchers.get(get_task_key(task))
+        if watcher:
+            watcher.journal.mark_overflow("(备份失败)")
+    
+    def commit_index(self, repo, message):
+        """使用git命令提交暂存区
+        
+        GitPython的IndexFile只能读取v1/v2格式的索引，启用index v4或skip-worktree后
+        必须交给git处理。提交身份与GitPython的默认身份保持一致。
+        """
+        actor = git.Actor.committer(repo.config_reader())
+        env = {
+            'GIT_AUTHOR_NAME': actor.name,
+            'GIT_AUTHOR_EMAIL': actor.email,
+            'GIT_COMMITTER_NAME': actor.name,
+            'GIT_COMMITTER_EMAIL': actor.email
+        }
+        repo.git.commit('-q', '--no-verify', '-m', message, env=env)
+    
+    def stage_changes(self, task, repo, repo_path, changed_paths=None):
+        """暂存更改，返回暂存区中相对HEAD变化的文件数量（0表示没有需要提交的内容）
+        
+        changed_paths为None时执行全量 add -A，否则只暂存给定的相对路径。
+        """
+        if changed_paths is None:
+            self.stage_all(repo, repo_path)
+        elif changed_paths:
+            self.stage_paths(task, repo, repo_path, changed_paths)
+        
+        # 比较暂存区与HEAD，不需要再次扫描工作区
+        output = repo.git.diff('--cached', '--name-only', '-z')
+        return len([path for path in output.split('\0') if path])
+    
+    def stage_all(self, repo, repo_path):
+        """全量暂存工作区中的所有更改"""
+        try:
+            repo.git.add('-A')
+        except git.exc.GitCommandError as e:
+            if "does not have a commit checked out" in str(e):
+                # 如果遇到子目录Git仓库的问题，使用更安全的方式添加文件
+                for root, dirs, files in os.walk(repo_path):
+                    # 跳过.git目录和.gitignore中指定的目录
+                    if '.git' in dirs:
+                        dirs.remove('.git')
+                    if '.gitignore' in files:
+                        with open(os.path.join(root, '.gitignore'), 'r', encoding='utf-8') as f:
+                            ignored = set(line.strip() for line in f if line.strip())
+                        dirs[:] = [d for d in dirs if d not in ignored]
+                    
+                    # 添加当前目录下的文件
+                    for file in files:
+                        if file != '.gitignore':
+                            file_path = os.path.join(root, file)
+                            try:
+                                repo.git.add(file_path)
+                            except git.exc.GitCommandError:
+                                self.logger.warning(f"无法添加文件: {file_path}")
+            else:
+                raise
+    
+    def stage_paths(self, task, repo, repo_path, changed_paths):
+        """批量暂存指定的路径：存在的路径执行 add -A，已删除的路径从索引中移除"""
+        existing = []
+        removed = []
+        for path in changed_paths:
+            if os.path.lexists(os.path.join(repo_path, path)):
+                existing.append(path)
+            else:
+                removed.append(path)
+        
+        env = {'GIT_LITERAL_PATHSPECS': '1'}
+        pathspec_file = os.path.join(get_task_state_dir(self.state_dir, task), 'pathspec')
+        try:
+            if existing:
+                self._write_pathspec(pathspec_file, existing)
+                try:
+                    repo.git.add('-A', f'--pathspec-from-file={pathspec_file}', '--pathspec-file-nul', env=env)
+                except git.exc.GitCommandError as e:
+                    # 被.gitignore忽略或标记为skip-worktree的路径会导致非零退出，其余路径已正常暂存
+                    stderr = str(e.stderr)
+                    if ("ignored by one of your .gitignore files" not in stderr
+                            and "outside of your sparse-checkout definition" not in stderr):
+                        raise
+            if removed:
+                self._write_pathspec(pathspec_file, removed)
+                repo.git.rm('-r', '-q', '--cached', '--ignore-unmatch',
+                            f'--pathspec-from-file={pathspec_file}', '--pathspec-file-nul', env=env)
+        finally:
+            if os.path.exists(pathspec_file):
+                os.remove(pathspec_file)
+        self.logger.info(f"已按变化路径暂存: 更新 {len(existing)} 个, 删除 {len(removed)} 个")
+    
+    def _write_pathspec(self, pathspec_file, paths):
+        with open(pathspec_file, 'wb') as f:
+            f.write(b'\0'.join(os.fsencode(path) for path in paths))
+    
+    def push_changes(self, task, repo, remote_url, branch, env=None):
+        """推送分支及附加引用，返回是否实际执行了推送
+        
+        本地引用与上次推送成功时记录的SHA一致时跳过推送；
+        推送结果通过 --porcelain 输出逐个引用校验，不再额外fetch。
+        """
+        refspecs = [f'{branch}:refs/heads/{branch}'] + self.large_files.push_refspecs(task, repo)
+        sources = [refspec.split(':', 1)[0] for refspec in refspecs]
+        destinations = [refspec.split(':', 1)[1] for refspec in refspecs]
+        
+        push_state = PushStateCache(
+            os.path.join(get_task_state_dir(self.state_dir, task), 'push_state.json'), remote_url)
+        try:
+            local_shas = repo.git.rev_parse(*sources).split()
+            local_refs = dict(zip(destinations, local_shas))
+        except git.exc.GitCommandError:
+            local_refs = None
+        if local_refs and push_state.is_current(local_refs):
+            return False
+        
+        status, stdout, stderr = repo.git.push(
+            'origin', '--porcelain', '--progress', '--force', *refspecs, env=env,
+            with_extended_output=True, with_exceptions=False)
+        results = parse_porcelain_push(stdout)
+        rejected = [result for result in results if not result['ok']]
+        if status != 0 or rejected or not results:
+            push_state.clear()
+            raise git.exc.GitCommandError(['git', 'push', 'origin'] + refspecs, status,
+                                          strip_progress(stderr), stdout)
+        if task.get('id') in self.run_stats:
+            self.run_stats[task['id']]['bytes_pushed'] = parse_push_bytes(stderr)
+        
+        if local_refs:
+            push_state.update({dst: sha for dst, sha in local_refs.items()
+                               if any(result['dst'] == dst for result in results)})
+        return True
+    
+    def check_source_changes(self, task, repo_path):
+        """在调用git之前快速检查源目录是否有变化
+        
+        返回 (是否有变化, 目录清单, 变化的子树路径)。未启用快速检查时清单为None；
+        子树路径为None表示需要全量扫描。
+        """
+        if not task.get('quick_check', True):
+            return True, None, None
+        
+        # 监听模式下变更日志有效时直接使用其中的路径，不遍历目录；
+        # 只有日志溢出或没有监听器时才通过目录清单检查
+        watcher = self.watchers.get(get_task_key(task))
+        changed_paths = watcher.journal.peek() if watcher else None
+        if changed_paths is not None:
+            return bool(changed_paths), None, changed_paths
+        
+        target = f"{task.get('remote_url', '')}\0{task.get('branch', 'main')}"
+        manifest_file = os.path.join(get_task_state_dir(self.state_dir, task), 'manifest.json')
+        manifest = DirectoryManifest(repo_path, manifest_file, target)
+        old_dirs = manifest.load()
+        root_hash = manifest.build()
+        if old_dirs.get('', [None])[0] == root_hash:
+            return False, manifest, []
+        return True, manifest, manifest.changed_paths(old_dirs)
+    
+    def get_run_stats(self, task_id):
+        """获取任务最近一次备份的统计"""
+        stats = dict(self.run_stats.get(task_id, {}))
+        if 'phases' in stats:
+            stats['phases'] = dict(stats['phases'])
+        return stats
+    
+    def push_group_key(self, task):
+        """合并推送的分组键：远程地址和认证信息都相同的任务才能合并，不能合并时返回None"""
+        if not task.get('coalesce_push', True) or self.large_files.is_enabled(task):
+            return None
+        credential = task.get('access_token') or task.get('ssh_key_path') or task.get('ssh_key_content') or ''
+        key = '\0'.join([task.get('auth_type', 'token'), task['remote_url'], credential])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+    
     def git_backup(self, task):
         """执行Git备份"""
+        # 本地的暂存和提交持有仓库锁；推送只访问网络，释放锁后执行，
+        # 读取历史、浏览快照等请求不会等待推送（同一仓库的备份由执行器串行调度）
+        with self.git_pool.lock(task['source_path']):
+            result, backup = self._commit_backup(task)
+        if result:
+            return result
+        try:
+            return self._push_backup(backup)
+        finally:
+            # 删除本次备份的临时密钥
+            backup['auth'].close()
+    
+    def git_backup_batch(self, tasks):
+        """备份推送到同一远程的多个任务：各自在本地提交后合并为一次推送
+        
+        返回 {任务ID: (是否成功, 消息)}，每个任务单独报告结果。
+        """
+        results = {}
+        backups = []
+        for task in tasks:
+            # 只在本地提交时持有各自的仓库锁，合并推送在锁外执行
+            with self.git_pool.lock(task['source_path']):
+                result, backup = self._commit_backup(task)
+            if result:
+                results[task['id']] = result
+            else:
+                backups.append(backup)
+        try:
+            results.update(self._push_batch(backups))
+        finally:
+            for backup in backups:
+                backup['auth'].close()
+        return results
+    
+    def _commit_backup(self, task):
+        """检查变化、暂存并在本地提交
+        
+        返回 (结果, None) 表示备份已结束（无变化或失败）；
+        返回 (None, 备份上下文) 表示需要继续推送，调用方负责关闭其中的认证会话。
+        """
+        repo_path = task['source_path']
+        self.run_stats[task['id']] = {'committed': False, 'files_changed': 0, 'pushed': False,
+                                      'commit_sha': None, 'bytes_pushed': 0, 'phases': {}}
+        started = time.time()
+        
+        # 检查源文件夹是否存在
+        if not os.path.exists(repo_path):
+            error_msg = f"源文件夹不存在: {repo_path}"
+            self.logger.error(error_msg)
+            return (False, error_msg), None
+        
+        # 源目录没有变化时直接跳过，不调用git
+        try:
+            has_source_changes, manifest, changed_subtrees = self.check_source_changes(task, repo_path)
+        except Exception as e:
+            self.logger.warning(f"快速检查源目录失败，执行完整备份: {str(e)}")
+            has_source_changes, manifest, changed_subtrees = True, None, None
+        started = self._mark_phase(task, 'check', started)
+        if not has_source_changes:
+            self.logger.info(f"源目录没有变化，跳过备份: {task.get('name', '')} ({repo_path})")
+            return (True, "没有需要备份的更改"), None
+        
         if not self.check_git_available():
             error_msg = "Git不可用，备份失败"
             self.logger.error(error_msg)
-            return False, error_msg
+            return (False, error_msg), None
         
         try:
             self.logger.info(f"开始备份任务: {task.get('name', '')} ({task['source_path']})")
-            repo_path = task['source_path']
             branch = task.get('branch', 'main')  # 获取指定的分支
             
-            # 检查源文件夹是否存在
-            if not os.path.exists(repo_path):
-                error_msg = f"源文件夹不存在: {repo_path}"
-                self.logger.error(error_msg)
-                return False, error_msg
-            
             # 配置Git认证
-            remote_url = self.setup_git_auth(task)
-            if not remote_url:
+            auth = self.setup_git_auth(task)
+            if not auth:
                 error_msg = "Git认证配置失败"
                 self.logger.error(error_msg)
-                return False, error_msg
+                return (False, error_msg), None
             
             # 初始化或获取Git仓库
             try:
-                repo, current_branch, is_new = self.init_git_repo(repo_path, remote_url, branch)
+                repo, current_branch, is_new = self.init_git_repo(repo_path, auth.remote_url, branch, auth.env)
             except Exception as e:
+                auth.close()
                 error_msg = f"初始化Git仓库失败: {str(e)}"
                 self.logger.error(error_msg)
-                return False, error_msg
+                return (False, error_msg), None
             
             try:
+                # 启用仓库加速配置
+                try:
+                    self.accelerator.apply(task, repo)
+                except Exception as e:
+                    self.logger.warning(f"设置仓库加速配置失败: {str(e)}")
+                
                 # 处理子目录中的Git仓库
-                for root, dirs, files in os.walk(repo_path):
-                    # 跳过.git目录
-                    if '.git' in dirs:
-                        dirs.remove('.git')
-                    
-                    # 检查是否有其他Git仓库
-                    for dir_name in dirs:
-                        dir_path = os.path.join(root, dir_name)
-                        if os.path.exists(os.path.join(dir_path, '.git')):
-                            # 将子目录中的Git仓库添加到.gitignore
-                            relative_path = os.path.relpath(dir_path, repo_path)
-                            gitignore_path = os.path.join(repo_path, '.gitignore')
-                            
-                            # 读取现有的.gitignore文件
-                            ignored_paths = set()
-                            if os.path.exists(gitignore_path):
-                                with open(gitignore_path, 'r', encoding='utf-8') as f:
-                                    ignored_paths = set(line.strip() for line in f if line.strip())
-                            
-                            # 添加新的路径到.gitignore
-                            if relative_path not in ignored_paths:
-                                with open(gitignore_path, 'a', encoding='utf-8') as f:
-                                    f.write(f"\n{relative_path}/")
-                                self.logger.info(f"已将子目录Git仓库添加到.gitignore: {relative_path}")
+                self.ignore_nested_repos(task, repo_path)
                 
-                # 添加所有文件到暂存区
-                try:
-                    repo.git.add('-A')
-                except git.exc.GitCommandError as e:
-                    if "does not have a commit checked out" in str(e):
-                        # 如果遇到子目录Git仓库的问题，使用更安全的方式添加文件
-                        for root, dirs, files in os.walk(repo_path):
-                            # 跳过.git目录和.gitignore中指定的目录
-                            if '.git' in dirs:
-                                dirs.remove('.git')
-                            if '.gitignore' in files:
-                                with open(os.path.join(root, '.gitignore'), 'r', encoding='utf-8') as f:
-                                    ignored = set(line.strip() for line in f if line.strip())
-                                dirs[:] = [d for d in dirs if d not in ignored]
-                            
-                            # 添加当前目录下的文件
-                            for file in files:
-                                if file != '.gitignore':
-                                    file_path = os.path.join(root, file)
-                                    try:
-                                        repo.git.add(file_path)
-                                    except git.exc.GitCommandError:
-                                        self.logger.warning(f"无法添加文件: {file_path}")
-                    else:
-                        raise
+                started = self._mark_phase(task, 'prepare', started)
+                
+                # 添加更改到暂存区：监听模式下只暂存变更日志中的路径
+                changed_paths = self.take_changed_paths(task)
+                if changed_paths is None:
+                    changed_paths = changed_subtrees
+                
+                # 大文件分块模式：指针写入索引，原始文件不再交给 add -A
+                large_paths = self.large_files.prepare(task, repo, repo_path, changed_paths)
+                if changed_paths is not None and large_paths:
+                    changed_paths = [path for path in changed_paths if path not in large_paths]
+                files_changed = self.stage_changes(task, repo, repo_path, changed_paths)
+                started = self._mark_phase(task, 'stage', started)
                 
                 # 检查是否有更改需要提交
-                if repo.is_dirty() or repo.untracked_files:
+                if files_changed:
                     # 创建提交
                     commit_message = f"Git备份 - {time.strftime('%Y-%m-%d %H:%M:%S')}"
-                    repo.index.commit(commit_message)
+                    self.commit_index(repo, commit_message)
                     self.logger.info("已创建新的提交")
-                
-                # 推送到远程仓库
-                try:
-                    repo.git.push('origin', current_branch, '--force')
-                    self.logger.info(f"已推送到远程仓库: {current_branch}")
-                    return True, "备份成功"
-                except git.exc.GitCommandError as e:
-                    error_msg = f"推送到远程仓库失败: {str(e)}"
-                    self.logger.error(error_msg)
-                    return False, error_msg
-                
+                    self.run_stats[task['id']].update(committed=True, files_changed=files_changed,
+                                                      commit_sha=repo.head.commit.hexsha)
+                    self.accelerator.after_commit(task, repo)
+                    self._mark_phase(task, 'commit', started)
             except Exception as e:
-                error_msg = f"Git操作失败: {str(e)}"
-                self.logger.error(error_msg)
-                return False, error_msg
+                auth.close()
+                return self._fail_backup(task, f"Git操作失败: {str(e)}"), None
             
+            return None, {'task': task, 'repo': repo, 'branch': current_branch,
+                          'auth': auth, 'manifest': manifest}
         except Exception as e:
             error_msg = f"备份过程出错: {str(e)}"
             self.logger.error(error_msg)
-            return False, error_msg 
\ No newline at end of file
+            return (False, error_msg), None
+    
+    def _push_backup(self, backup):
+        """单独推送一个任务（远程已是最新时跳过）"""
+        task, repo, branch, auth = backup['task'], backup['repo'], backup['branch'], backup['auth']
+        started = time.time()
+        try:
+            pushed = self.push_changes(task, repo, auth.remote_url, branch, auth.env)
+            self._mark_phase(task, 'push', started)
+            if pushed:
+                self.run_stats[task['id']]['pushed'] = True
+                self.remote_refs.mark_fresh(task)
+                self.logger.info(f"已推送到远程仓库: {branch}")
+            else:
+                self.logger.info(f"远程分支 {branch} 已是最新，跳过推送")
+            return self._finish_backup(backup)
+        except git.exc.GitCommandError as e:
+            return self._fail_backup(task, f"推送到远程仓库失败: {str(e)}")
+        except Exception as e:
+            return self._fail_backup(task, f"Git操作失败: {str(e)}")
+    
+    def _push_batch(self, backups):
+        """通过中转仓库把多个任务的分支合并为一次推送"""
+        results = {}
+        entries = []
+        singles = []
+        destinations = set()
+        for backup in backups:
+            task, repo, branch, auth = backup['task'], backup['repo'], backup['branch'], backup['auth']
+            # 带附加引用的任务和推送到同一分支的任务单独推送
+            if branch in destinations or self.large_files.push_refspecs(task, repo):
+                singles.append(backup)
+                continue
+            try:
+                sha = repo.git.rev_parse(branch)
+            except git.exc.GitCommandError:
+                singles.append(backup)
+                continue
+            backup['sha'] = sha
+            backup['push_state'] = PushStateCache(
+                os.path.join(get_task_state_dir(self.state_dir, task), 'push_state.json'), auth.remote_url)
+            if backup['push_state'].is_current({f'refs/heads/{branch}': sha}):
+                self.logger.info(f"远程分支 {branch} 已是最新，跳过推送")
+                results[task['id']] = self._finish_backup(backup)
+                continue
+            destinations.add(branch)
+            entries.append(backup)
+        
+        if len(entries) == 1:
+            singles.extend(entries)
+        elif entries:
+            auth = entries[0]['auth']
+            started = time.time()
+            bytes_pushed = 0
+            try:
+                hub = PushHub(self.state_dir, auth.remote_url)
+                pushed, bytes_pushed = hub.push(
+                    auth.remote_url, [(b['task'], b['repo'], b['branch'], b['sha']) for b in entries], auth.env)
+            except Exception as e:
+                pushed = {b['task']['id']: (False, str(e)) for b in entries}
+            self.logger.info(f"合并推送完成: {len(entries)} 个分支")
+            for backup in entries:
+                task = backup['task']
+                self._mark_phase(task, 'push', started)
+                # 合并推送的数据量记录整批的总量
+                self.run_stats[task['id']].update(bytes_pushed=bytes_pushed, batch_size=len(entries))
+                ok, message = pushed[task['id']]
+                if ok:
+                    backup['push_state'].update({f"refs/heads/{backup['branch']}": backup['sha']})
+                    # 通过中转仓库推送不会更新远程跟踪分支，手动同步
+                    backup['repo'].git.update_ref(f"refs/remotes/origin/{backup['branch']}", backup['sha'])
+                    self.remote_refs.mark_fresh(task)
+                    self.run_stats[task['id']]['pushed'] = True
+                    self.logger.info(f"已推送到远程仓库: {backup['branch']}")
+                    results[task['id']] = self._finish_backup(backup)
+                else:
+                    backup['push_state'].clear()
+                    results[task['id']] = self._fail_backup(task, f"推送到远程仓库失败: {message}")
+        
+        for backup in singles:
+            results[backup['task']['id']] = self._push_backup(backup)
+        return results
+    
+    def _mark_phase(self, task, phase, started):
+        """记录阶段耗时，返回当前时间作为下一阶段的开始"""
+        now = time.time()
+        self.run_stats[task['id']]['phases'][phase] = round(now - started, 3)
+        return now
+    
+    def _finish_backup(self, backup):
+        """推送成功后保存目录清单并更新提交索引"""
+        if backup['manifest']:
+            backup['manifest'].save()
+        task = backup['task']
+        if self.history_index and self.run_stats[task['id']]['committed']:
+            try:
+                # 读取引用会用到仓库句柄的常驻 cat-file 进程，需要持有仓库锁
+                with self.git_pool.lock(task['source_path']):
+                    self.history_index.sync(task, backup['repo'])
+            except Exception as e:
+                self.logger.warning(f"更新提交索引失败: {str(e)}")
+        return True, "备份成功"
+    
+    def _fail_backup(self, task, error_msg):
+        """记录失败，变更日志中的路径留到下次备份"""
+        self.logger.error(error_msg)
+        self.discard_changed_paths(task)
+        return False, error_msg
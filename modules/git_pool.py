@@ -0,0 +1,362 @@
+import os
+import time
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+from collections import OrderedDict
+import git
+
+logger = logging.getLogger('git_backup')
+
+# 同时缓存的仓库句柄数量
+DEFAULT_POOL_SIZE = int(os.getenv('GIT_POOL_SIZE', '32'))
+# 每个仓库保留的空闲 cat-file --batch 读取进程数（用于下载文件）
+BLOB_READERS_PER_REPO = int(os.getenv('GIT_BLOB_READERS', '4'))
+# 读取器被提前归还时，剩余内容不超过此大小（字节）则读完后复用，否则结束进程
+BLOB_READER_DRAIN_LIMIT = 1024 * 1024
+
+
+def check_batch_rev(rev):
+    """检查写入 cat-file --batch 进程的对象名
+
+    常驻进程按行读取请求，对象名中的换行等控制字符会被当作多个请求，
+    使后续读取与请求错位，因此直接拒绝。
+    """
+    if any(ord(c) < 0x20 or ord(c) == 0x7f for c in rev):
+        raise ValueError(f"无效的对象名: {rev!r}")
+    return rev
+
+
+class GitCommandStats:
+    """统计git子进程的创建次数和耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.forks = 0
+        self.total_time = 0.0
+        self.commands = {}
+
+    def record(self, command, elapsed):
+        """记录一次git调用"""
+        name = command[1] if isinstance(command, (list, tuple)) and len(command) > 1 else str(command)
+        with self._lock:
+            self.forks += 1
+            self.total_time += elapsed
+            count, total = self.commands.get(name, (0, 0.0))
+            self.commands[name] = (count + 1, total + elapsed)
+
+    def snapshot(self):
+        """获取统计快照"""
+        with self._lock:
+            return {
+                'forks': self.forks,
+                'total_ms': round(self.total_time * 1000, 2),
+                'avg_ms': round(self.total_time * 1000 / self.forks, 2) if self.forks else 0,
+                'commands': {
+                    name: {
+                        'count': count,
+                        'total_ms': round(total * 1000, 2),
+                        'avg_ms': round(total * 1000 / count, 2)
+                    }
+                    for name, (count, total) in sorted(self.commands.items())
+                }
+            }
+
+
+class InstrumentedGit(git.Git):
+    """记录每次子进程调用的Git命令包装器"""
+
+    __slots__ = ('command_stats',)
+
+    def execute(self, command, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(command, *args, **kwargs)
+        finally:
+            stats = getattr(self, 'command_stats', None)
+            if stats is not None:
+                stats.record(command, time.perf_counter() - start)
+
+
+class PooledRepo(git.Repo):
+    """使用InstrumentedGit的仓库对象"""
+
+    GitCommandWrapperType = InstrumentedGit
+
+
+class BlobReader:
+    """独占的常驻 git cat-file --batch 进程
+
+    与仓库句柄共用的 cat-file 进程不同，读取期间不需要持有仓库锁，
+    适合把大对象流式发送给较慢的客户端；读完后归还给连接池复用。
+    """
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.proc = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=repo_path,
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL)
+        # 当前对象未读取的字节数（包括结尾的换行符）
+        self._remaining = 0
+
+    def open(self, rev):
+        """开始读取对象，返回 (sha, 类型, 大小)，对象不存在时返回None"""
+        if self._remaining:
+            raise ValueError("上一个对象还未读取完毕")
+        self.proc.stdin.write(check_batch_rev(rev).encode('utf-8') + b'\n')
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline()
+        if not header:
+            raise OSError("cat-file 进程已退出")
+        parts = header.split()
+        if len(parts) != 3:
+            return None
+        self._remaining = int(parts[2]) + 1
+        return parts[0].decode(), parts[1].decode(), int(parts[2])
+
+    def read(self, size):
+        """读取当前对象的下一段内容，读完时返回空字节串"""
+        size = min(size, self._remaining - 1)
+        if size <= 0:
+            return b''
+        data = self.proc.stdout.read(size)
+        if not data:
+            raise OSError("cat-file 进程已退出")
+        self._remaining -= len(data)
+        if self._remaining == 1:
+            self.proc.stdout.read(1)
+            self._remaining = 0
+        return data
+
+    def skip(self, size):
+        """跳过当前对象的 size 字节"""
+        while size > 0:
+            size -= len(self.read(min(size, 1 << 16)))
+
+    def finish(self, limit=BLOB_READER_DRAIN_LIMIT):
+        """读完当前对象的剩余内容，剩余内容超过 limit 时返回False（进程不能再复用）"""
+        if self._remaining - 1 > limit:
+            return False
+        while self._remaining:
+            if not self.read(1 << 16) and self._remaining:
+                # 空对象只剩结尾的换行符
+                self.proc.stdout.read(1)
+                self._remaining = 0
+        return True
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+
+class GitProcessPool:
+    """按仓库复用Repo句柄及其常驻的 cat-file --batch/--batch-check 进程
+
+    句柄按LRU淘汰，淘汰或显式关闭时结束对应的常驻进程。
+    同一仓库的句柄不是线程安全的，需要并发访问时通过 lock() 串行化。
+    """
+
+    def __init__(self, max_repos=DEFAULT_POOL_SIZE):
+        self.max_repos = max_repos
+        self.logger = logger
+        self.stats = GitCommandStats()
+        self._lock = threading.Lock()
+        self._repos = OrderedDict()
+        self._repo_locks = {}
+        self._blob_readers = {}
+        self.blob_reader_spawns = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(repo_path):
+        return os.path.realpath(repo_path)
+
+    def lock(self, repo_path):
+        """获取仓库级别的可重入锁"""
+        key = self._key(repo_path)
+        with self._lock:
+            repo_lock = self._repo_locks.get(key)
+            if repo_lock is None:
+                repo_lock = self._repo_locks[key] = threading.RLock()
+            return repo_lock
+
+    def _try_lock(self, key):
+        """不阻塞地获取仓库锁，用于淘汰句柄；其他线程或当前线程正在使用时返回None"""
+        repo_lock = self._repo_locks.get(key)
+        if repo_lock is None:
+            repo_lock = self._repo_locks[key] = threading.RLock()
+        if repo_lock._is_owned() or not repo_lock.acquire(blocking=False):
+            return None
+        return repo_lock
+
+    def get_repo(self, repo_path):
+        """获取仓库句柄，不存在时打开并加入缓存
+
+        超过数量上限时只淘汰当前没有被使用（能立即获得仓库锁）的句柄，
+        都在使用时暂时超过上限，等下次打开新句柄时再淘汰。
+        """
+        key = self._key(repo_path)
+        evicted = []
+        with self._lock:
+            repo = self._repos.get(key)
+            if repo is not None and os.path.isdir(repo.git_dir):
+                self._repos.move_to_end(key)
+                self.hits += 1
+                return repo
+            if repo is not None:
+                # 仓库已被删除或重新初始化，正在使用时不关闭，由使用方结束后回收
+                evicted.append((self._repos.pop(key), self._try_lock(key)))
+
+            repo = PooledRepo(key)
+            repo.git.command_stats = self.stats
+            self._repos[key] = repo
+            self.misses += 1
+            for old_key in list(self._repos):
+                if len(self._repos) <= self.max_repos:
+                    break
+                if old_key == key:
+                    continue
+                repo_lock = self._try_lock(old_key)
+                if repo_lock is not None:
+                    evicted.append((self._repos.pop(old_key), repo_lock))
+                    self.evictions += 1
+
+        for old_repo, repo_lock in evicted:
+            if repo_lock is None:
+                continue
+            try:
+                self._close_repo(old_repo)
+            finally:
+                repo_lock.release()
+        return repo
+
+    def command(self, repo_path):
+        """独立的git命令对象，只用于启动子进程（例如流式输出）
+
+        不共享仓库句柄的常驻 cat-file 进程和临时选项，使用时不需要持有仓库锁。
+        """
+        cmd = InstrumentedGit(self._key(repo_path))
+        cmd.command_stats = self.stats
+        return cmd
+
+    def init_repo(self, repo_path):
+        """初始化新仓库并加入缓存"""
+        git.Repo.init(repo_path).close()
+        self.close(repo_path)
+        return self.get_repo(repo_path)
+
+    def read_object(self, repo_path, rev):
+        """通过常驻的 cat-file --batch 进程读取对象，返回 (sha, 类型, 大小, 数据)"""
+        check_batch_rev(rev)
+        with self.lock(repo_path):
+            return self.get_repo(repo_path).git.get_object_data(rev)
+
+    def object_header(self, repo_path, rev):
+        """通过常驻的 cat-file --batch-check 进程读取对象头，返回 (sha, 类型, 大小)"""
+        check_batch_rev(rev)
+        with self.lock(repo_path):
+            return self.get_repo(repo_path).git.get_object_header(rev)
+
+    def object_headers(self, repo_path, revs):
+        """一次持有锁批量读取对象头，返回 {rev: (sha, 类型, 大小)}，不存在的对象不包含在结果中"""
+        for rev in revs:
+            check_batch_rev(rev)
+        headers = {}
+        with self.lock(repo_path):
+            repo_git = self.get_repo(repo_path).git
+            for rev in revs:
+                try:
+                    sha, obj_type, size = repo_git.get_object_header(rev)
+                except ValueError:
+                    continue
+                headers[rev] = (sha.decode(), obj_type.decode(), size)
+        return headers
+
+    @contextmanager
+    def blob_reader(self, repo_path):
+        """借用仓库的独占 cat-file --batch 进程，退出时归还（对象未读完且剩余较多时结束进程）"""
+        key = self._key(repo_path)
+        reader = None
+        with self._lock:
+            idle = self._blob_readers.get(key)
+            while idle and reader is None:
+                reader = idle.pop()
+                if not reader.alive():
+                    reader = None
+        if reader is None:
+            reader = BlobReader(key)
+            with self._lock:
+                self.blob_reader_spawns += 1
+        try:
+            yield reader
+        finally:
+            try:
+                reusable = reader.alive() and reader.finish()
+            except OSError:
+                reusable = False
+            with self._lock:
+                idle = self._blob_readers.setdefault(key, [])
+                if reusable and len(idle) < BLOB_READERS_PER_REPO:
+                    idle.append(reader)
+                    reader = None
+            if reader is not None:
+                reader.close()
+
+    def _close_blob_readers(self, keys=None):
+        with self._lock:
+            keys = list(self._blob_readers) if keys is None else keys
+            readers = [reader for key in keys for reader in self._blob_readers.pop(key, [])]
+        for reader in readers:
+            reader.close()
+
+    def close(self, repo_path):
+        """关闭指定仓库的句柄"""
+        with self._lock:
+            repo = self._repos.pop(self._key(repo_path), None)
+        if repo is not None:
+            self._close_repo(repo)
+        self._close_blob_readers([self._key(repo_path)])
+
+    def close_all(self):
+        """关闭所有仓库句柄"""
+        with self._lock:
+            repos = list(self._repos.values())
+            self._repos.clear()
+        for repo in repos:
+            self._close_repo(repo)
+        self._close_blob_readers()
+
+    def _close_repo(self, repo):
+        try:
+            repo.close()
+        except Exception as e:
+            self.logger.debug(f"关闭仓库句柄失败 {repo.working_dir}: {str(e)}")
+
+    def get_stats(self):
+        """获取连接池和git子进程统计"""
+        with self._lock:
+            pool_stats = {
+                'cached_repos': len(self._repos),
+                'max_repos': self.max_repos,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'blob_readers': {
+                    'idle': sum(len(readers) for readers in self._blob_readers.values()),
+                    'spawns': self.blob_reader_spawns
+                }
+            }
+        pool_stats['git'] = self.stats.snapshot()
+        return pool_stats
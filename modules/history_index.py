@@ -0,0 +1,260 @@
+import time
+import logging
+import threading
+import git
+from modules.database import get_db, init_db
+from modules.commit_log import iter_log, count_commits, resolve_history_ref
+
+logger = logging.getLogger('git_backup')
+
+# 全量建立索引时每个事务写入的提交数
+BACKFILL_BATCH = 500
+
+
+class HistoryIndex:
+    """按任务保存在SQLite中的提交元数据索引（提交信息、作者、时间和numstat统计）
+
+    首次使用时在后台通过一次流式 git log --numstat 建立索引，之后只追加新提交；
+    提交的 seq 从最早的提交开始连续编号，分页和游标都直接按 seq 范围读取，
+    与历史长度无关。分支被改写（旧的顶端不再是祖先）时重新建立索引。
+    读取提交的git命令都通过 git_pool.command() 的独立命令对象执行，不使用共享的仓库句柄。
+    """
+
+    def __init__(self, db_path, git_pool):
+        self.db_path = db_path
+        self.git_pool = git_pool
+        self.logger = logger
+        init_db(db_path)
+        self._conn = get_db(db_path)
+        self._lock = threading.Lock()
+        self._task_locks = {}
+        self._building = set()
+        self._cancelled = set()
+
+    def _task_lock(self, task_id):
+        with self._lock:
+            return self._task_locks.setdefault(task_id, threading.Lock())
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get_state(self, task_id):
+        """获取任务已索引到的分支、顶端提交和提交数量"""
+        rows = self._query('SELECT ref, tip, count, updated_at FROM commit_index WHERE task_id = ?', (task_id,))
+        return dict(rows[0]) if rows else None
+
+    @staticmethod
+    def _is_ancestor(git_cmd, old, new):
+        try:
+            git_cmd.merge_base('--is-ancestor', old, new)
+            return True
+        except git.exc.GitCommandError:
+            return False
+
+    def sync(self, task, repo, resolved=None):
+        """让索引与历史分支的顶端一致，索引可用时返回True
+
+        已有索引时同步追加新提交；还没有索引或分支被改写时在后台重建并返回False，
+        调用方在此期间直接读取仓库。解析分支引用使用 repo，调用方需持有仓库锁。
+        """
+        task_id = task['id']
+        resolved = resolved or resolve_history_ref(repo, task.get('branch', 'main'))
+        if not resolved:
+            return False
+        ref, tip = resolved
+        with self._lock:
+            if task_id in self._building:
+                return False
+        state = self.get_state(task_id)
+        if state and state['ref'] == ref and state['tip'] == tip:
+            return True
+        git_cmd = self.git_pool.command(repo.working_dir)
+        if state and state['ref'] == ref and self._is_ancestor(git_cmd, state['tip'], tip):
+            with self._task_lock(task_id):
+                state = self.get_state(task_id)
+                if state and state['tip'] != tip:
+                    self._append(task_id, git_cmd, ref, state, tip)
+            return True
+        self._start_backfill(task_id, git_cmd, ref, tip)
+        return False
+
+    def _insert(self, task_id, rows):
+        """写入一批 (seq, 提交)"""
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO commits (task_id, seq, hash, timestamp, date, author, message, '
+            'files, insertions, deletions) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(task_id, seq, c['hash'], c['timestamp'], c['date'], c['author'], c['message'],
+              c['stats']['files'], c['stats']['insertions'], c['stats']['deletions']) for seq, c in rows])
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO commit_files (task_id, path, seq, status, blob, insertions, deletions) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(task_id, path, seq, status, blob, insertions, deletions)
+             for seq, c in rows for path, insertions, deletions, status, blob in c['files']])
+
+    def _save_state(self, task_id, ref, tip, count):
+        self._conn.execute('INSERT OR REPLACE INTO commit_index (task_id, ref, tip, count, updated_at) '
+                           'VALUES (?, ?, ?, ?, ?)', (task_id, ref, tip, count, time.time()))
+
+    def _append(self, task_id, git_cmd, ref, state, tip):
+        """追加旧顶端之后的新提交"""
+        rev = f"{state['tip']}..{tip}"
+        new_count = count_commits(git_cmd, rev)
+        rows = [(state['count'] + new_count - i, commit) for i, commit in enumerate(iter_log(git_cmd, rev))]
+        with self._lock:
+            with self._conn:
+                self._insert(task_id, rows)
+                self._save_state(task_id, ref, tip, state['count'] + new_count)
+        self.logger.debug(f"任务 {task_id} 提交索引追加 {new_count} 个提交")
+
+    def _start_backfill(self, task_id, git_cmd, ref, tip):
+        with self._lock:
+            if task_id in self._building:
+                return
+            self._building.add(task_id)
+        threading.Thread(target=self._backfill, args=(task_id, git_cmd, ref, tip), daemon=True).start()
+
+    def _write_batch(self, task_id, batch, state=None):
+        """写入一批提交，任务的索引已被删除（建立被取消）时不写入并返回False"""
+        with self._lock:
+            if task_id in self._cancelled:
+                return False
+            with self._conn:
+                self._insert(task_id, batch)
+                if state:
+                    self._save_state(task_id, *state)
+        return True
+
+    def _backfill(self, task_id, git_cmd, ref, tip):
+        """清空任务的旧索引并流式写入全部提交，完成后才记录索引状态
+
+        每批写入前检查是否已被 drop 取消，取消后停止读取 git log。
+        """
+        started = time.time()
+        try:
+            with self._task_lock(task_id):
+                total = count_commits(git_cmd, tip)
+                self._delete_rows(task_id)
+                batch = []
+                commits = iter_log(git_cmd, tip)
+                try:
+                    for i, commit in enumerate(commits):
+                        batch.append((total - i, commit))
+                        if len(batch) >= BACKFILL_BATCH:
+                            if not self._write_batch(task_id, batch):
+                                self.logger.info(f"任务 {task_id} 的提交索引已删除，停止建立索引")
+                                return
+                            batch = []
+                finally:
+                    commits.close()
+                if not self._write_batch(task_id, batch, (ref, tip, total)):
+                    return
+            self.logger.info(f"任务 {task_id} 提交索引已建立: {total} 个提交，耗时 {time.time() - started:.1f}s")
+        except Exception as e:
+            self.logger.error(f"建立任务 {task_id} 的提交索引失败: {str(e)}")
+        finally:
+            with self._lock:
+                self._building.discard(task_id)
+                self._cancelled.discard(task_id)
+
+    def _delete_rows(self, task_id):
+        with self._lock:
+            with self._conn:
+                self._delete_task_rows(task_id)
+
+    def _delete_task_rows(self, task_id):
+        self._conn.execute('DELETE FROM commit_index WHERE task_id = ?', (task_id,))
+        self._conn.execute('DELETE FROM commits WHERE task_id = ?', (task_id,))
+        self._conn.execute('DELETE FROM commit_files WHERE task_id = ?', (task_id,))
+
+    def drop(self, task_id):
+        """删除任务的索引
+
+        正在后台建立索引时不等待：标记取消并立即删除，之后的批次不会再写入
+        （标记和删除在同一次加锁中完成，与批次写入互斥）。
+        """
+        with self._lock:
+            if task_id in self._building:
+                self._cancelled.add(task_id)
+                with self._conn:
+                    self._delete_task_rows(task_id)
+                return
+        # 追加新提交很快，等待其完成后再删除
+        with self._task_lock(task_id):
+            self._delete_rows(task_id)
+
+    @staticmethod
+    def _row_to_commit(row):
+        return {
+            'hash': row['hash'],
+            'message': row['message'],
+            'date': row['date'],
+            'timestamp': row['timestamp'],
+            'author': row['author'],
+            'stats': {
+                'files': row['files'],
+                'insertions': row['insertions'],
+                'deletions': row['deletions']
+            }
+        }
+
+    def get_page(self, task_id, count, skip, per_page, cursor=None):
+        """按 seq 范围读取一页（新的在前），游标提交不在索引中时返回None"""
+        if cursor:
+            rows = self._query('SELECT seq FROM commits WHERE task_id = ? AND hash = ?', (task_id, cursor))
+            if not rows:
+                return None
+            high = rows[0]['seq'] - 1
+        else:
+            high = count - skip
+        rows = self._query('SELECT * FROM commits WHERE task_id = ? AND seq BETWEEN ? AND ? ORDER BY seq DESC',
+                           (task_id, high - per_page + 1, high))
+        return [self._row_to_commit(row) for row in rows]
+
+    def get_commit(self, task_id, commit_hash):
+        """读取索引中的提交及其文件变更，不在索引中时返回None"""
+        rows = self._query('SELECT * FROM commits WHERE task_id = ? AND hash = ?', (task_id, commit_hash))
+        if not rows:
+            return None
+        commit = self._row_to_commit(rows[0])
+        commit['files'] = [dict(row) for row in self._query(
+            'SELECT path, status, insertions, deletions FROM commit_files WHERE task_id = ? AND seq = ? ORDER BY path',
+            (task_id, rows[0]['seq']))]
+        return commit
+
+    def get_file_history(self, task_id, path, limit=50, cursor=None):
+        """按路径读取修改过该文件的提交（新的在前），每个版本附带上一个版本的blob
+
+        cursor 为上一页最后一个提交，不在索引中时返回None。返回 (版本列表, 是否还有更多)。
+        """
+        high = None
+        if cursor:
+            rows = self._query('SELECT seq FROM commits WHERE task_id = ? AND hash = ?', (task_id, cursor))
+            if not rows:
+                return None
+            high = rows[0]['seq']
+        # 多读一条：用于判断是否还有下一页，以及当前页最后一个版本之前的内容
+        rows = self._query(
+            'SELECT f.seq, f.status, f.blob, f.insertions, f.deletions, c.hash, c.timestamp, c.date, c.author, '
+            'c.message FROM commit_files f JOIN commits c ON c.task_id = f.task_id AND c.seq = f.seq '
+            'WHERE f.task_id = ? AND f.path = ? AND f.seq < ? ORDER BY f.seq DESC LIMIT ?',
+            (task_id, path, high if high is not None else 1 << 62, limit + 1))
+        revisions = []
+        for i, row in enumerate(rows[:limit]):
+            revisions.append({
+                'hash': row['hash'],
+                'message': row['message'],
+                'date': row['date'],
+                'timestamp': row['timestamp'],
+                'author': row['author'],
+                'status': row['status'],
+                'blob': row['blob'],
+                'previous_blob': rows[i + 1]['blob'] if i + 1 < len(rows) else None,
+                'insertions': row['insertions'],
+                'deletions': row['deletions']
+            })
+        return revisions, len(rows) > limit
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,83 @@
+import os
+import hashlib
+import logging
+import threading
+import git
+from modules.task_state import get_task_key
+from modules.push_state import parse_porcelain_push, parse_push_bytes, strip_progress
+
+logger = logging.getLogger('git_backup')
+
+
+class PushHub:
+    """推送到同一远程仓库的中转裸仓库，用于把多个任务的分支合并为一次推送
+
+    中转仓库通过 objects/info/alternates 直接引用各任务仓库的对象库，
+    只需更新引用 refs/tasks/<任务>/<分支>，不复制任何对象。
+    """
+
+    _locks = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, state_dir, remote_url):
+        self.remote_key = hashlib.sha1(remote_url.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(state_dir, 'push_hub', f'{self.remote_key}.git')
+        self.logger = logger
+        with PushHub._locks_guard:
+            self.lock = PushHub._locks.setdefault(self.path, threading.Lock())
+        if not os.path.exists(os.path.join(self.path, 'HEAD')):
+            os.makedirs(self.path, exist_ok=True)
+            git.Repo.init(self.path, bare=True)
+        self.repo = git.Repo(self.path)
+
+    def _alternates_file(self):
+        return os.path.join(self.path, 'objects', 'info', 'alternates')
+
+    def _add_alternates(self, object_dirs):
+        """把任务仓库的对象库加入alternates，同时移除已不存在的目录"""
+        alternates_file = self._alternates_file()
+        current = []
+        if os.path.exists(alternates_file):
+            with open(alternates_file, 'r', encoding='utf-8') as f:
+                current = [line.strip() for line in f if line.strip()]
+        wanted = [path for path in current if os.path.isdir(path)]
+        for path in object_dirs:
+            if path not in wanted:
+                wanted.append(path)
+        if wanted != current:
+            os.makedirs(os.path.dirname(alternates_file), exist_ok=True)
+            tmp_file = f'{alternates_file}.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(''.join(f'{path}\n' for path in wanted))
+            os.replace(tmp_file, alternates_file)
+
+    def push(self, remote_url, entries, env=None):
+        """一次推送多个任务的分支
+
+        entries 为 (task, repo, branch, sha) 列表，返回 ({任务ID: (是否成功, 消息)}, 推送字节数)。
+        """
+        with self.lock:
+            self._add_alternates([os.path.realpath(os.path.join(repo.git_dir, 'objects'))
+                                  for _, repo, _, _ in entries])
+            refspecs = []
+            destinations = {}
+            for task, repo, branch, sha in entries:
+                hub_ref = f'refs/tasks/{get_task_key(task)}/{branch}'
+                self.repo.git.update_ref(hub_ref, sha)
+                dst = f'refs/heads/{branch}'
+                refspecs.append(f'{hub_ref}:{dst}')
+                destinations[dst] = task['id']
+
+            status, stdout, stderr = self.repo.git.push(
+                remote_url, '--porcelain', '--progress', '--force', *refspecs, env=env,
+                with_extended_output=True, with_exceptions=False)
+
+        results = {}
+        for result in parse_porcelain_push(stdout):
+            task_id = destinations.get(result['dst'])
+            if task_id is not None:
+                results[task_id] = (result['ok'], result['summary'])
+        error = strip_progress(stderr).strip() or f'git push exit {status}'
+        for task, _, _, _ in entries:
+            results.setdefault(task['id'], (False, error))
+        return results, parse_push_bytes(stderr)
@@ -0,0 +1,101 @@
+import os
+import re
+import time
+import hashlib
+import logging
+from modules.task_state import load_json, save_json
+
+logger = logging.getLogger('git_backup')
+
+# 超过该时间（秒）后即使本地引用未变化也重新推送一次，用于修复远程被外部改动的情况
+PUSH_CACHE_TTL = int(os.getenv('PUSH_CACHE_TTL', '86400'))
+
+# push --porcelain 输出中表示推送成功的标记
+PUSH_OK_FLAGS = (' ', '+', '-', '*', '=')
+
+
+# git push --progress 输出中的进度行前缀
+PROGRESS_PREFIXES = ('Enumerating objects', 'Counting objects', 'Delta compression',
+                     'Compressing objects', 'Writing objects', 'Total ')
+SIZE_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3}
+
+
+def parse_push_bytes(stderr):
+    """从 git push --progress 的输出中解析写入的数据量（字节）"""
+    matches = re.findall(r'Writing objects: 100% \(\d+/\d+\), ([\d.]+) (bytes|KiB|MiB|GiB)', stderr or '')
+    if not matches:
+        return 0
+    size, unit = matches[-1]
+    return int(float(size) * SIZE_UNITS[unit])
+
+
+def strip_progress(stderr):
+    """去掉进度行，保留错误信息"""
+    lines = re.split(r'[\r\n]+', stderr or '')
+    return '\n'.join(line for line in lines if line and not line.startswith(PROGRESS_PREFIXES))
+
+
+def parse_porcelain_push(output):
+    """解析 git push --porcelain 的输出
+
+    每个引用一行：<flag>\\t<from>:<to>\\t<summary>，返回字典列表。
+    """
+    results = []
+    for line in (output or '').splitlines():
+        if not line or line.startswith('To ') or line == 'Done':
+            continue
+        parts = line.split('\t')
+        if len(parts) < 3 or len(parts[0]) != 1:
+            continue
+        src, _, dst = parts[1].partition(':')
+        results.append({
+            'flag': parts[0],
+            'src': src,
+            'dst': dst,
+            'summary': parts[2],
+            'ok': parts[0] in PUSH_OK_FLAGS
+        })
+    return results
+
+
+class PushStateCache:
+    """记录每个任务最后一次成功推送到远程的引用SHA
+
+    本地引用与缓存一致时说明远程已是最新，可以跳过推送。
+    远程地址只保存摘要，避免在状态文件中留下访问令牌。
+    """
+
+    def __init__(self, state_file, remote_url):
+        self.state_file = state_file
+        self.remote_key = hashlib.sha1(remote_url.encode('utf-8')).hexdigest()
+        self.logger = logger
+
+    def _load(self):
+        state = load_json(self.state_file, {})
+        if state.get('remote') != self.remote_key:
+            return {}
+        return state
+
+    def is_current(self, local_refs):
+        """本地引用是否都已推送到远程且缓存未过期"""
+        state = self._load()
+        if not state or time.time() - state.get('verified_at', 0) > PUSH_CACHE_TTL:
+            return False
+        pushed = state.get('refs', {})
+        return all(pushed.get(ref) == sha for ref, sha in local_refs.items())
+
+    def update(self, pushed_refs):
+        """记录推送成功的引用"""
+        state = self._load()
+        refs = state.get('refs', {})
+        refs.update(pushed_refs)
+        save_json(self.state_file, {
+            'remote': self.remote_key,
+            'refs': refs,
+            'verified_at': time.time()
+        })
+
+    def clear(self):
+        """清除缓存，下次必定推送"""
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
@@ -0,0 +1,116 @@
+import os
+import time
+import logging
+import threading
+from modules.git_env import GitAuthSession
+
+logger = logging.getLogger('git_backup')
+
+# 远程引用的有效期（秒），有效期内读取历史和还原都不再访问网络；0表示每次都刷新
+REMOTE_REFS_TTL = int(os.getenv('REMOTE_REFS_TTL', '300'))
+
+
+class RemoteRefCache:
+    """按任务仓库缓存远程引用的刷新时间
+
+    有效期内直接使用本地的远程跟踪分支；过期后由一个请求执行 git fetch，
+    同时到达的其他请求等待同一次刷新（或在不需要等待时直接返回），不会重复访问网络。
+    备份推送成功后远程分支与本地一致，直接标记为最新。
+    """
+
+    def __init__(self, git_pool, ssh_mux=None, ttl=REMOTE_REFS_TTL):
+        self.git_pool = git_pool
+        self.ssh_mux = ssh_mux
+        self.ttl = ttl
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._checked = {}
+        self._errors = {}
+        self._inflight = {}
+        self.fetches = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _key(task):
+        return os.path.realpath(task['source_path'])
+
+    def is_fresh(self, task, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        checked = self._checked.get(self._key(task))
+        return checked is not None and time.time() - checked < max_age
+
+    def has_checked(self, task):
+        """本进程中是否已经刷新过（成功或失败）"""
+        return self._key(task) in self._checked
+
+    def mark_fresh(self, task):
+        """推送或拉取成功后标记远程引用为最新"""
+        key = self._key(task)
+        with self._lock:
+            self._checked[key] = time.time()
+            self._errors.pop(key, None)
+
+    def invalidate(self, task):
+        with self._lock:
+            self._checked.pop(self._key(task), None)
+
+    def refresh(self, task, wait=True, max_age=None):
+        """远程引用过期时刷新
+
+        wait 为真时等待刷新完成（多个请求共用同一次fetch），返回是否成功；
+        wait 为假时在后台刷新并立即返回False。未过期时直接返回上次刷新是否成功，
+        max_age=0 表示强制刷新。
+        """
+        key = self._key(task)
+        with self._lock:
+            if self.is_fresh(task, max_age):
+                return key not in self._errors
+            done = self._inflight.get(key)
+            owner = done is None
+            if owner:
+                done = self._inflight[key] = threading.Event()
+            else:
+                self.coalesced += 1
+        if owner:
+            if wait:
+                self._fetch(key, task, done)
+            else:
+                threading.Thread(target=self._fetch, args=(key, task, done), daemon=True).start()
+        if not wait:
+            return False
+        done.wait()
+        return key not in self._errors
+
+    def _fetch(self, key, task, done):
+        # 不持有仓库锁：fetch 只更新远程跟踪分支，git 自身保证与提交等操作并发安全，
+        # 也避免持有仓库锁的请求等待刷新时互相阻塞。因此使用独立的命令对象，不使用共享的仓库句柄
+        try:
+            with GitAuthSession(task, self.ssh_mux) as auth:
+                self.git_pool.command(task['source_path']).fetch('origin', '--prune', env=auth.env)
+            with self._lock:
+                self._errors.pop(key, None)
+            self.logger.info(f"已刷新远程引用: {task['source_path']}")
+        except Exception as e:
+            with self._lock:
+                self._errors[key] = str(e)
+            self.logger.warning(f"获取远程更新失败: {str(e)}")
+        finally:
+            with self._lock:
+                # 失败也记录时间，有效期内不再反复重试
+                self._checked[key] = time.time()
+                self.fetches += 1
+                self._inflight.pop(key, None)
+            done.set()
+
+    def get_error(self, task):
+        return self._errors.get(self._key(task))
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'ttl': self.ttl,
+                'tracked': len(self._checked),
+                'fetches': self.fetches,
+                'coalesced': self.coalesced,
+                'inflight': len(self._inflight)
+            }
@@ -0,0 +1,168 @@
+import os
+import re
+import time
+import logging
+import tempfile
+import threading
+import git
+from modules.task_state import get_task_state_dir, load_json, save_json
+
+logger = logging.getLogger('git_backup')
+
+# 默认加速配置；任务的 accelerate 可以为 true 或覆盖部分选项的字典
+DEFAULT_PROFILE = {
+    'fsmonitor': True,
+    'untracked_cache': True,
+    'index_version': 4,
+    'split_index': False,
+    'commit_graph': True
+}
+
+# 两次写入commit-graph之间的最短间隔（秒）
+COMMIT_GRAPH_INTERVAL = int(os.getenv('COMMIT_GRAPH_INTERVAL', '3600'))
+
+
+class GitCapabilities:
+    """探测已安装git版本支持的加速特性，每个进程只探测一次"""
+
+    _lock = threading.Lock()
+    _cached = None
+
+    @classmethod
+    def probe(cls):
+        """返回git能力字典"""
+        with cls._lock:
+            if cls._cached is None:
+                cls._cached = cls._probe()
+            return cls._cached
+
+    @staticmethod
+    def _probe():
+        g = git.Git()
+        output = g.version()
+        match = re.search(r'(\d+)\.(\d+)(?:\.(\d+))?', output)
+        version = tuple(int(part or 0) for part in match.groups()) if match else (0, 0, 0)
+
+        builtin_fsmonitor = False
+        if version >= (2, 36, 0):
+            # 在临时仓库中查询守护进程状态：支持时守护进程未运行返回1（正在运行返回0），
+            # 不支持当前平台时返回128并提示 not supported
+            try:
+                with tempfile.TemporaryDirectory(prefix='git-probe-') as probe_dir:
+                    g.execute(['git', 'init', '-q', probe_dir])
+                    status, _, stderr = git.Git(probe_dir).execute(
+                        ['git', 'fsmonitor--daemon', 'status'],
+                        with_exceptions=False, with_extended_output=True)
+                builtin_fsmonitor = status in (0, 1) and 'not supported' not in stderr
+            except Exception as e:
+                logger.debug(f"探测fsmonitor守护进程失败: {str(e)}")
+                builtin_fsmonitor = False
+
+        capabilities = {
+            'version': '.'.join(str(part) for part in version),
+            'builtin_fsmonitor': builtin_fsmonitor,
+            'untracked_cache': version >= (2, 8, 0),
+            'index_v4': version >= (1, 8, 0),
+            'split_index': version >= (2, 9, 0),
+            'commit_graph': version >= (2, 18, 0),
+            'fetch_write_commit_graph': version >= (2, 24, 0)
+        }
+        logger.info(f"Git能力探测结果: {capabilities}")
+        return capabilities
+
+
+class RepoAccelerator:
+    """为任务仓库启用并维护加速特性（fsmonitor、untracked cache、index v4、commit-graph）"""
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.logger = logger
+
+    @staticmethod
+    def get_profile(task):
+        """获取任务的加速配置，未启用时返回None"""
+        option = task.get('accelerate')
+        if not option:
+            return None
+        profile = dict(DEFAULT_PROFILE)
+        if isinstance(option, dict):
+            profile.update(option)
+        return profile
+
+    def _state_file(self, task):
+        return os.path.join(get_task_state_dir(self.state_dir, task), 'accel.json')
+
+    def apply(self, task, repo):
+        """按任务配置为仓库设置加速选项，配置未变化时不重复设置"""
+        profile = self.get_profile(task)
+        if not profile:
+            return
+        capabilities = GitCapabilities.probe()
+        state_file = self._state_file(task)
+        state = load_json(state_file, {})
+        applied_key = {'profile': profile, 'version': capabilities['version'], 'git_dir': repo.git_dir}
+        if state.get('applied') == applied_key:
+            return
+
+        settings = {}
+        if profile['fsmonitor'] and capabilities['builtin_fsmonitor']:
+            settings['core.fsmonitor'] = 'true'
+        if profile['untracked_cache'] and capabilities['untracked_cache']:
+            if self._untracked_cache_supported(repo, state):
+                settings['core.untrackedCache'] = 'true'
+        if profile['index_version'] == 4 and capabilities['index_v4']:
+            settings['index.version'] = '4'
+        if profile['split_index'] and capabilities['split_index']:
+            settings['core.splitIndex'] = 'true'
+        if profile['commit_graph'] and capabilities['commit_graph']:
+            settings['core.commitGraph'] = 'true'
+            settings['gc.writeCommitGraph'] = 'true'
+            if capabilities['fetch_write_commit_graph']:
+                settings['fetch.writeCommitGraph'] = 'true'
+
+        with repo.config_writer() as writer:
+            for key, value in settings.items():
+                section, option = key.split('.', 1)
+                writer.set_value(section, option, value)
+
+        # 转换已有的索引文件格式
+        if os.path.exists(os.path.join(repo.git_dir, 'index')):
+            if 'index.version' in settings:
+                repo.git.update_index('--index-version', '4')
+            if 'core.splitIndex' in settings:
+                repo.git.update_index('--split-index')
+            if 'core.untrackedCache' in settings:
+                repo.git.update_index('--untracked-cache')
+
+        state['applied'] = applied_key
+        state['settings'] = settings
+        save_json(state_file, state)
+        self.logger.info(f"已为仓库启用加速配置 {repo.working_dir}: {settings}")
+
+    def _untracked_cache_supported(self, repo, state):
+        """检查文件系统是否支持untracked cache（检测较慢，结果保存在状态文件中）"""
+        if 'untracked_cache_ok' not in state:
+            try:
+                repo.git.update_index('--test-untracked-cache')
+                state['untracked_cache_ok'] = True
+            except git.exc.GitCommandError:
+                state['untracked_cache_ok'] = False
+                self.logger.warning(f"文件系统不支持untracked cache: {repo.working_dir}")
+        return state['untracked_cache_ok']
+
+    def after_commit(self, task, repo):
+        """提交后按间隔增量更新commit-graph"""
+        profile = self.get_profile(task)
+        if not profile or not profile['commit_graph'] or not GitCapabilities.probe()['commit_graph']:
+            return
+        state_file = self._state_file(task)
+        state = load_json(state_file, {})
+        if time.time() - state.get('commit_graph_at', 0) < COMMIT_GRAPH_INTERVAL:
+            return
+        try:
+            repo.git.commit_graph('write', '--reachable', '--split')
+            state['commit_graph_at'] = time.time()
+            save_json(state_file, state)
+            self.logger.info(f"已更新commit-graph: {repo.working_dir}")
+        except git.exc.GitCommandError as e:
+            self.logger.warning(f"更新commit-graph失败: {str(e)}")
@@ -0,0 +1,108 @@
+import os
+import time
+import logging
+from modules.task_state import load_json, save_json
+
+logger = logging.getLogger('git_backup')
+
+# 目录修改时间距离扫描时间太近时不可信（同一时间粒度内可能还有写入）
+RACY_MTIME_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+
+class NestedRepoIndex:
+    """持久化的子目录Git仓库索引
+
+    索引中记录每个目录的修改时间、是否包含.git以及子目录列表。
+    刷新时只对修改时间发生变化的目录重新读取目录项，其余目录直接复用缓存，
+    从而避免每次备份都完整遍历源目录。
+    """
+
+    VERSION = 1
+
+    def __init__(self, repo_path, index_file):
+        self.repo_path = os.path.abspath(repo_path)
+        self.index_file = index_file
+        self.logger = logger
+        self.dirs = {}
+        self._load()
+
+    def _load(self):
+        """加载索引文件，源目录变化或版本不符时丢弃旧索引"""
+        data = load_json(self.index_file, {})
+        if data.get('version') == self.VERSION and data.get('root') == self.repo_path:
+            self.dirs = data.get('dirs', {})
+        else:
+            self.dirs = {}
+
+    def save(self):
+        """保存索引文件"""
+        save_json(self.index_file, {
+            'version': self.VERSION,
+            'root': self.repo_path,
+            'dirs': self.dirs
+        })
+
+    def _scan_dir(self, abs_path):
+        """读取单个目录，返回 (是否包含.git, 子目录列表)"""
+        has_git = False
+        subdirs = []
+        with os.scandir(abs_path) as entries:
+            for entry in entries:
+                if entry.name == '.git':
+                    has_git = True
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                except OSError:
+                    continue
+        subdirs.sort()
+        return has_git, subdirs
+
+    def refresh(self):
+        """增量刷新索引，返回子目录Git仓库的相对路径列表"""
+        start = time.time()
+        now_ns = time.time_ns()
+        new_dirs = {}
+        repos = []
+        scanned = 0
+        stack = ['']
+
+        while stack:
+            rel_path = stack.pop()
+            abs_path = os.path.join(self.repo_path, rel_path) if rel_path else self.repo_path
+            try:
+                mtime_ns = os.stat(abs_path).st_mtime_ns
+            except OSError:
+                continue
+
+            cached = self.dirs.get(rel_path)
+            if cached and cached[0] == mtime_ns:
+                has_git, subdirs = cached[1], cached[2]
+            else:
+                try:
+                    has_git, subdirs = self._scan_dir(abs_path)
+                except OSError as e:
+                    self.logger.warning(f"读取目录失败 {abs_path}: {str(e)}")
+                    continue
+                scanned += 1
+
+            # 刚修改过的目录下次必须重新读取
+            stored_mtime = mtime_ns if now_ns - mtime_ns > RACY_MTIME_WINDOW_NS else -1
+            new_dirs[rel_path] = [stored_mtime, has_git, subdirs]
+
+            if rel_path and has_git:
+                # 子目录本身是Git仓库，不再继续深入
+                repos.append(rel_path)
+                continue
+
+            for name in subdirs:
+                stack.append(f"{rel_path}/{name}" if rel_path else name)
+
+        self.dirs = new_dirs
+        self.save()
+        self.logger.info(
+            f"子目录仓库索引刷新完成: 目录 {len(new_dirs)} 个, 重新读取 {scanned} 个, "
+            f"发现仓库 {len(repos)} 个, 耗时 {time.time() - start:.2f}s"
+        )
+        return sorted(repos)
@@ -1,17 +1,59 @@
 import os
+import tarfile
+import posixpath
 import logging
 from datetime import datetime
 from typing import List, Dict, Optional
 from git import Repo, GitCommandError
 from flask_socketio import emit
 import time
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
 import git
+from modules.git_pool import GitProcessPool
+from modules.chunk_store import LargeFileManager, parse_pointer
+from modules.git_env import GitAuthSession
+from modules.ssh_mux import SSHMultiplexer
+from modules.commit_log import read_log, read_file_log, count_commits, resolve_history_ref
+from modules.history_index import HistoryIndex
+from modules.remote_refs import RemoteRefCache
+from modules.task_state import get_task_state_dir
+from modules.push_state import parse_porcelain_push, strip_progress
+from modules.diff_preview import iter_name_status, summarize, file_diff
+from modules.snapshot import (ARCHIVE_FORMATS, STREAM_CHUNK_SIZE, normalize_snapshot_path, object_type,
+                              stream_process, open_archive, snapshot_name, is_within, parse_tree, tree_entry)
+
+# 提交历史分页缓存的条目数
+HISTORY_CACHE_SIZE = 64
+# 浏览快照时缓存的已解析目录数（按tree SHA缓存，内容不会变化）
+TREE_CACHE_SIZE = 64
+# 不超过此大小的文件通过共享的 cat-file 进程一次读入内存，更大的文件使用独占的读取进程流式输出
+SMALL_BLOB_SIZE = 64 * 1024
+# 还原时并行检出文件的进程数（git checkout.workers）
+CHECKOUT_WORKERS = int(os.getenv('RESTORE_CHECKOUT_WORKERS', str(os.cpu_count() or 1)))
+# 导出快照允许写入的其他目录（多个用 os.pathsep 分隔），BACKUP_DIR/worktrees 和 BACKUP_DIR/exports 总是允许
+EXTRACT_ROOTS = [root for root in os.getenv('EXTRACT_ROOTS', '').split(os.pathsep) if root]
 
 class RestoreManager:
-    def __init__(self, base_dir: str):
+    def __init__(self, base_dir: str, git_pool: Optional[GitProcessPool] = None,
+                 ssh_mux: Optional[SSHMultiplexer] = None, config=None,
+                 history_index: Optional[HistoryIndex] = None,
+                 remote_refs: Optional[RemoteRefCache] = None):
         self.base_dir = base_dir
+        self.config = config
+        self.history_index = history_index
+        self.git_pool = git_pool or GitProcessPool()
+        self.ssh_mux = ssh_mux
+        self.remote_refs = remote_refs or RemoteRefCache(self.git_pool, ssh_mux)
+        self.large_files = LargeFileManager(base_dir, self.git_pool)
         self.logger = logging.getLogger('git_backup.restore')
         self.socketio = None
+        self._history_cache = OrderedDict()
+        self._history_lock = threading.Lock()
+        self._prefetching = set()
+        self._tree_cache = OrderedDict()
+        self.extract_roots = [os.path.join(base_dir, 'worktrees'), os.path.join(base_dir, 'exports')] + EXTRACT_ROOTS
         self.logger.info(f"初始化还原管理器，基础目录: {base_dir}")
 
     def set_socketio(self, socketio):
@@ -35,8 +77,10 @@ class RestoreManager:
 
     def get_task_info(self, task_id: int) -> Dict:
         """获取任务信息的辅助方法"""
-        from modules.config import Config
-        config = Config()
+        config = self.config
+        if config is None:
+            from modules.config import Config
+            config = self.config = Config()
         task = config.get_task(task_id)
         
         if not task:
@@ -51,89 +95,105 @@ class RestoreManager:
             
         return task
 
+    def repo_lock(self, task_id: int):
+        """获取任务仓库的锁，避免与备份等操作并发使用同一仓库句柄"""
+        try:
+            task = self.get_task_info(task_id)
+        except Exception:
+            # 任务无效时由具体操作报告错误
+            return nullcontext()
+        return self.git_pool.lock(task['source_path'])
+
     def init_repo(self, source_path: str) -> Repo:
         """初始化Git仓库的辅助方法"""
         try:
-            repo = Repo(source_path)
+            repo = self.git_pool.get_repo(source_path)
             if not repo.git_dir:
                 raise ValueError(f"无效的Git仓库: {source_path}")
             return repo
         except Exception as e:
             raise ValueError(f"初始化Git仓库失败: {str(e)}")
 
-    def get_commit_history(self, task_id: int, page: int = 1, per_page: int = 10) -> Dict:
+    def get_commit_history(self, task_id: int, page: int = 1, per_page: int = 10,
+                           cursor: Optional[str] = None) -> Dict:
         """获取提交历史"""
+        # 远程引用过期时在后台刷新，读取历史不等待网络（首次读取时等待一次）
+        self.refresh_remote_refs(task_id, wait=False)
+        with self.repo_lock(task_id):
+            return self._get_commit_history(task_id, page, per_page, cursor)
+
+    def _get_commit_history(self, task_id: int, page: int = 1, per_page: int = 10,
+                            cursor: Optional[str] = None) -> Dict:
+        """按页读取提交历史
+
+        只对返回的提交计算变更统计；总数来自 rev-list --count。
+        cursor 为上一页最后一个提交，此时从它的下一个提交开始读取，不需要跳过前面的页。
+        """
         try:
             self.logger.info(f"开始获取任务 {task_id} 的提交历史 (页码: {page}, 每页数量: {per_page})")
             self.emit_status(task_id, 'info', '开始获取提交历史...')
 
             task = self.get_task_info(task_id)
             repo = self.init_repo(task['source_path'])
-            commits = []
 
-            # 更新远程仓库
-            try:
-                self.logger.info("正在从远程仓库获取更新...")
-                self.emit_status(task_id, 'info', '正在从远程仓库获取更新...')
-                repo.git.fetch('--all')
-                self.logger.info("远程仓库更新成功")
-            except GitCommandError as e:
-                self.logger.warning(f"获取远程更新失败: {str(e)}")
+            if self.remote_refs.get_error(task):
                 self.emit_status(task_id, 'warning', '获取远程更新失败，将使用本地提交历史')
 
             # 获取任务配置的分支
             target_branch = task.get('branch', 'main')
-            
-            # 获取提交历史
+            branch_name = target_branch
+            empty = {"commits": [], "total_pages": 0, "current_page": page, "total_commits": 0,
+                     "per_page": per_page, "next_cursor": None}
+
             try:
-                # 优先尝试获取远程分支的提交历史
-                remote_ref = f'origin/{target_branch}'
-                if remote_ref in repo.refs:
-                    commit_iter = repo.iter_commits(remote_ref)
-                    branch_name = target_branch
-                else:
-                    # 如果远程分支不存在，尝试获取本地分支
-                    if target_branch in repo.heads:
-                        commit_iter = repo.iter_commits(target_branch)
-                        branch_name = target_branch
-                    else:
-                        self.logger.warning(f"分支 {target_branch} 不存在，无法获取提交历史")
-                        self.emit_status(task_id, 'warning', f'分支 {target_branch} 不存在')
-                        return {"commits": [], "total_pages": 0, "current_page": page, "total_commits": 0, "per_page": per_page}
-                
-                for commit in commit_iter:
-                    commit_info = {
-                        "hash": commit.hexsha,
-                        "message": commit.message.strip(),
-                        "date": commit.committed_datetime.isoformat(),
-                        "author": commit.author.name,
-                        "branch": branch_name,
-                        "stats": {
-                            "files": len(commit.stats.files),
-                            "insertions": commit.stats.total["insertions"],
-                            "deletions": commit.stats.total["deletions"]
-                        }
-                    }
-                    commits.append(commit_info)
+                resolved = resolve_history_ref(repo, target_branch)
+                if not resolved:
+                    self.logger.warning(f"分支 {target_branch} 不存在，无法获取提交历史")
+                    self.emit_status(task_id, 'warning', f'分支 {target_branch} 不存在')
+                    return empty
+                tip = resolved[1]
+                skip = 0 if cursor else (page - 1) * per_page
 
-            except GitCommandError as e:
+                commits = None
+                indexed = False
+                if self.history_index and self.history_index.sync(task, repo, resolved):
+                    # 索引已是最新，直接按位置读取
+                    total_commits = self.history_index.get_state(task_id)['count']
+                    commits = self.history_index.get_page(task_id, total_commits, skip, per_page, cursor)
+                    indexed = commits is not None
+                git_cmd = self.git_pool.command(task['source_path'])
+                if commits is None:
+                    total_commits = self._count_history(git_cmd, tip)
+                    if cursor:
+                        rev, skip = repo.commit(cursor).hexsha, 1
+                    else:
+                        rev = tip
+                    commits = self._read_history_page(git_cmd, rev, skip, per_page)
+            except (GitCommandError, ValueError, git.BadName, git.BadObject) as e:
                 self.logger.error(f"获取分支 {target_branch} 的提交历史失败: {str(e)}")
                 self.emit_status(task_id, 'error', f'获取分支 {target_branch} 的提交历史失败')
-                return {"commits": [], "total_pages": 0, "current_page": page, "total_commits": 0, "per_page": per_page}
+                return empty
 
-            # 分页处理
-            total_commits = len(commits)
-            total_pages = (total_commits + per_page - 1) // per_page
-            start_idx = (page - 1) * per_page
-            end_idx = start_idx + per_page
+            for commit in commits:
+                commit['branch'] = branch_name
+            has_more = len(commits) == per_page and (cursor or skip + per_page < total_commits)
+            next_cursor = commits[-1]['hash'] if has_more else None
+            if has_more and not indexed:
+                # 预读下一页（与下一次请求的方式一致），用户翻页时直接从缓存返回
+                if cursor:
+                    self._prefetch_history_page(git_cmd, next_cursor, 1, per_page)
+                else:
+                    self._prefetch_history_page(git_cmd, tip, skip + per_page, per_page)
 
+            total_pages = (total_commits + per_page - 1) // per_page
             result = {
-                "commits": commits[start_idx:end_idx],
+                "commits": commits,
                 "total_pages": total_pages,
                 "current_page": page,
                 "total_commits": total_commits,
                 "per_page": per_page,
-                "branch": branch_name
+                "branch": branch_name,
+                "next_cursor": next_cursor
             }
 
             self.logger.info(f"成功获取分支 {branch_name} 的提交历史，当前页: {page}/{total_pages}, 总提交数: {total_commits}")
@@ -147,8 +207,136 @@ class RestoreManager:
             self.emit_status(task_id, 'error', error_msg)
             raise
 
+    def _cache_get(self, key):
+        with self._history_lock:
+            if key in self._history_cache:
+                self._history_cache.move_to_end(key)
+                return self._history_cache[key]
+        return None
+
+    def _cache_put(self, key, value):
+        with self._history_lock:
+            self._history_cache[key] = value
+            self._history_cache.move_to_end(key)
+            while len(self._history_cache) > HISTORY_CACHE_SIZE:
+                self._history_cache.popitem(last=False)
+
+    def _count_history(self, git_cmd, tip: str) -> int:
+        """统计提交数量，按分支顶端SHA缓存"""
+        key = (git_cmd.working_dir, 'count', tip)
+        total = self._cache_get(key)
+        if total is None:
+            total = count_commits(git_cmd, tip)
+            self._cache_put(key, total)
+        return total
+
+    def _read_history_page(self, git_cmd, rev: str, skip: int, per_page: int) -> List[Dict]:
+        """读取从 rev 开始跳过 skip 个提交后的一页，按提交SHA缓存（提交不可变，缓存不会过期）"""
+        key = (git_cmd.working_dir, rev, skip, per_page)
+        commits = self._cache_get(key)
+        if commits is None:
+            commits = read_log(git_cmd, rev, skip, per_page)
+            self._cache_put(key, commits)
+        return [dict(commit) for commit in commits]
+
+    def _prefetch_history_page(self, git_cmd, rev: str, skip: int, per_page: int):
+        """在后台读取下一页（git_cmd 为独立命令对象，后台线程不持有仓库锁）"""
+        key = (git_cmd.working_dir, rev, skip, per_page)
+        with self._history_lock:
+            if key in self._history_cache or key in self._prefetching:
+                return
+            self._prefetching.add(key)
+
+        def prefetch():
+            try:
+                self._read_history_page(git_cmd, rev, skip, per_page)
+            except Exception as e:
+                self.logger.debug(f"预读提交历史失败: {str(e)}")
+            finally:
+                with self._history_lock:
+                    self._prefetching.discard(key)
+
+        threading.Thread(target=prefetch, daemon=True).start()
+
+    def get_file_history(self, task_id: int, path: str, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        """获取单个文件的修改记录（新的在前），cursor 为上一页最后一个提交
+
+        已建立提交索引时按路径直接读取；索引建立期间按路径执行一次 git log。
+        """
+        self.refresh_remote_refs(task_id, wait=False)
+        with self.repo_lock(task_id):
+            task = self.get_task_info(task_id)
+            repo = self.init_repo(task['source_path'])
+            path = normalize_snapshot_path(path)
+            if not path:
+                raise ValueError("未提供文件路径")
+            result = {'path': path, 'revisions': [], 'next_cursor': None, 'indexed': False}
+            resolved = resolve_history_ref(repo, task.get('branch', 'main'))
+            if not resolved:
+                return result
+
+            history = None
+            if self.history_index and self.history_index.sync(task, repo, resolved):
+                history = self.history_index.get_file_history(task_id, path, limit, cursor)
+                result['indexed'] = history is not None
+            if history is None:
+                history = self._read_file_history(repo, resolved[1], path, limit, cursor)
+            revisions, has_more = history
+            result['revisions'] = revisions
+            result['next_cursor'] = revisions[-1]['hash'] if has_more and revisions else None
+            return result
+
+    def _read_file_history(self, repo, tip: str, path: str, limit: int, cursor: Optional[str] = None):
+        """不使用索引时读取文件的修改记录，返回 (版本列表, 是否还有更多)"""
+        try:
+            rev, skip = (repo.commit(cursor).hexsha, 1) if cursor else (tip, 0)
+        except (ValueError, git.BadName, git.BadObject):
+            raise ValueError(f"提交 {cursor} 不存在")
+        rows = []
+        for commit in read_file_log(repo.git, rev, path, skip, limit + 1):
+            for file_path, insertions, deletions, status, blob in commit['files']:
+                if file_path == path:
+                    rows.append((commit, status, blob, insertions, deletions))
+        revisions = []
+        for i, (commit, status, blob, insertions, deletions) in enumerate(rows[:limit]):
+            revisions.append({
+                'hash': commit['hash'],
+                'message': commit['message'],
+                'date': commit['date'],
+                'timestamp': commit['timestamp'],
+                'author': commit['author'],
+                'status': status,
+                'blob': blob,
+                'previous_blob': rows[i + 1][2] if i + 1 < len(rows) else None,
+                'insertions': insertions,
+                'deletions': deletions
+            })
+        return revisions, len(rows) > limit
+
+    def refresh_remote_refs(self, task_id: int, wait: bool = True):
+        """刷新任务仓库的远程引用（有效期内不访问网络），不在仓库锁内调用"""
+        try:
+            task = self.get_task_info(task_id)
+        except Exception:
+            # 任务无效时由具体操作报告错误
+            return False
+        if not wait and self.remote_refs.has_checked(task):
+            return self.remote_refs.refresh(task, wait=False)
+        return self.remote_refs.refresh(task)
+
     def restore_commit(self, task_id, commit_hash, branch=None):
         """还原到指定的提交版本"""
+        self.refresh_remote_refs(task_id)
+        return self._restore_commit(task_id, commit_hash, branch)
+
+    def _restore_commit(self, task_id, commit_hash, branch=None):
+        """把工作区还原为指定提交的内容，并在目标分支上记录为一个新提交
+
+        只改写与目标提交不同的文件（并行检出），目标中不存在的已跟踪文件被删除，
+        未跟踪的文件保持不变；不创建临时分支，也不改写分支历史。
+        本地的还原和提交持有仓库锁，推送只访问网络，释放锁后执行。
+        """
+        auth = None
         try:
             task = self.get_task_info(task_id)
             if not task:
@@ -161,121 +349,394 @@ class RestoreManager:
             target_branch = branch or task.get('branch', 'main')
             self.logger.info(f"目标分支: {target_branch}")
             
-            # 获取或创建临时分支名称
-            temp_branch = f'restore_{int(time.time())}'
-            
-            # 设置Git凭据
-            self._setup_git_credentials(task)
+            # 设置Git凭据（只作用于本次还原的git命令）
+            auth = GitAuthSession(task, self.ssh_mux).open()
             
-            repo = self.init_repo(task['source_path'])
-            remote = repo.remote('origin')
-            
-            # 确保本地有最新的远程分支信息
-            try:
-                self.logger.info("正在获取远程仓库更新...")
-                remote.fetch()
-                self.logger.info("成功获取远程仓库更新")
-            except git.GitCommandError as e:
-                self.logger.warning(f"获取远程更新失败: {str(e)}")
-            
-            # 验证提交是否存在
             try:
-                commit = repo.commit(commit_hash)
-                self.logger.info(f"找到目标提交: {commit.message.strip()}")
-            except git.GitCommandError:
-                error_msg = f"提交 {commit_hash} 不存在"
-                self.logger.error(error_msg)
-                self.emit_status(task_id, 'error', error_msg)
-                return False
-            
-            # 创建并切换到临时分支
-            self.logger.info(f"创建临时分支: {temp_branch}")
-            self.emit_status(task_id, 'info', '正在创建临时分支...')
-            
-            if temp_branch in repo.heads:
-                repo.delete_head(temp_branch, force=True)
-            temp = repo.create_head(temp_branch, commit_hash)
-            temp.checkout()
-            
-            try:
-                # 执行还原
-                self.logger.info("正在执行还原操作...")
-                self.emit_status(task_id, 'info', '正在执行还原操作...')
-                
-                # 强制检出指定提交
-                repo.git.reset('--hard', commit_hash)
+                with self.repo_lock(task_id):
+                    if not self._restore_local(task, commit_hash, target_branch, auth):
+                        return False
+
+                # 推送到远程仓库
+                self.logger.info(f"推送更改到远程分支 {target_branch}")
+                self._push_restore(task, target_branch, auth.env)
+                self.remote_refs.mark_fresh(task)
                 
-                # 处理目标分支
-                try:
-                    # 检查远程是否存在目标分支
-                    remote_branch_exists = False
-                    for ref in remote.refs:
-                        if ref.name == f'origin/{target_branch}':
-                            remote_branch_exists = True
-                            break
-
-                    if target_branch in repo.heads:
-                        # 本地分支存在
-                        self.logger.info(f"切换到本地分支: {target_branch}")
-                        current_branch = repo.heads[target_branch]
-                        current_branch.checkout()
-                    elif remote_branch_exists:
-                        # 从远程创建本地分支
-                        self.logger.info(f"从远程创建本地分支: {target_branch}")
-                        repo.create_head(target_branch, f'origin/{target_branch}').checkout()
-                    else:
-                        # 创建新的本地分支
-                        self.logger.info(f"创建新的本地分支: {target_branch}")
-                        repo.create_head(target_branch, commit_hash).checkout()
-
-                    # 合并临时分支
-                    try:
-                        self.logger.info(f"合并临时分支到 {target_branch}")
-                        repo.git.merge(temp_branch, '--no-ff', m=f'还原到提交 {commit_hash[:8]}')
-                        
-                        # 推送到远程仓库
-                        self.logger.info(f"推送更改到远程分支 {target_branch}")
-                        remote.push(f'{target_branch}:{target_branch}', force=True)
-                        
-                        success_msg = f"成功还原到提交 {commit_hash[:8]} 并同步到远程仓库"
-                        self.logger.info(success_msg)
-                        self.emit_status(task_id, 'success', success_msg)
-                        return True
-                        
-                    except git.GitCommandError as merge_error:
-                        # 合并冲突处理
-                        warning_msg = f"还原成功但存在合并冲突，更改已保存在分支 {temp_branch} 中"
-                        self.logger.warning(warning_msg)
-                        self.emit_status(task_id, 'warning', warning_msg)
-                        return True
-                        
-                except git.GitCommandError as branch_error:
-                    error_msg = f"切换到目标分支 {target_branch} 失败: {str(branch_error)}"
-                    self.logger.error(error_msg)
-                    self.emit_status(task_id, 'error', error_msg)
-                    return False
+                success_msg = f"成功还原到提交 {commit_hash[:8]} 并同步到远程仓库"
+                self.logger.info(success_msg)
+                self.emit_status(task_id, 'success', success_msg)
+                return True
                     
             except git.GitCommandError as restore_error:
                 error_msg = f"还原操作失败: {str(restore_error)}"
                 self.logger.error(error_msg)
                 self.emit_status(task_id, 'error', error_msg)
                 return False
-                
-            finally:
-                # 清理临时分支
-                if temp_branch in repo.heads:
-                    current = repo.active_branch.name
-                    if current != temp_branch:
-                        repo.delete_head(temp_branch, force=True)
             
         except Exception as e:
             error_msg = f"还原失败: {str(e)}"
             self.logger.error(error_msg)
             self.emit_status(task_id, 'error', error_msg)
             return False
+        finally:
+            if auth:
+                auth.close()
+
+    def _restore_local(self, task, commit_hash, target_branch, auth):
+        """在本地还原工作区并提交（调用方持有仓库锁），提交不存在时返回False"""
+        task_id = task['id']
+        repo = self.init_repo(task['source_path'])
+        
+        # 验证提交是否存在，本地找不到时强制刷新一次远程引用
+        try:
+            try:
+                commit = repo.commit(commit_hash)
+            except (ValueError, git.BadName, git.BadObject):
+                self.remote_refs.refresh(task, max_age=0)
+                commit = repo.commit(commit_hash)
+            self.logger.info(f"找到目标提交: {commit.message.strip()}")
+        except (git.GitCommandError, ValueError, git.BadName, git.BadObject):
+            error_msg = f"提交 {commit_hash} 不存在"
+            self.logger.error(error_msg)
+            self.emit_status(task_id, 'error', error_msg)
+            return False
+        
+        self._checkout_branch(repo, target_branch)
+        
+        self.logger.info("正在执行还原操作...")
+        self.emit_status(task_id, 'info', '正在比较工作区与目标提交...')
+        started = time.time()
+        updated, removed = self._apply_tree(task, repo, commit)
+        self.emit_status(task_id, 'info', f'已更新 {updated} 个文件，删除 {removed} 个文件')
+        
+        # 以目标提交的目录树在当前分支上创建一个提交
+        head = repo.head.commit
+        if head.tree.hexsha == commit.tree.hexsha:
+            self.logger.info("当前分支已与目标提交一致，无需提交")
+        else:
+            new_sha = repo.git.commit_tree(commit.tree.hexsha, '-p', head.hexsha,
+                                           '-m', f'还原到提交 {commit_hash[:8]}')
+            repo.git.update_ref(f'refs/heads/{target_branch}', new_sha, head.hexsha)
+        self.logger.info(f"还原完成: 更新 {updated} 个, 删除 {removed} 个, 耗时 {time.time() - started:.2f}s")
+        
+        # 将大文件指针还原为原始文件（未启用大文件存储的任务中不会有指针文件）
+        if self.large_files.is_enabled(task):
+            restored = self.large_files.rehydrate(repo, fetch_env=auth.env)
+            if restored:
+                self.emit_status(task_id, 'info', f'已还原 {restored} 个大文件')
+        return True
+
+    def _push_restore(self, task, target_branch, env):
+        """强制推送还原后的分支，通过 --porcelain 输出校验目标引用，被拒绝时抛出 GitCommandError
+
+        使用独立的命令对象，不持有仓库锁。
+        """
+        refspec = f'{target_branch}:refs/heads/{target_branch}'
+        status, stdout, stderr = self.git_pool.command(task['source_path']).push(
+            'origin', '--porcelain', '--force', refspec, env=env,
+            with_extended_output=True, with_exceptions=False)
+        results = [result for result in parse_porcelain_push(stdout)
+                   if result['dst'] == f'refs/heads/{target_branch}']
+        if status != 0 or not results or not all(result['ok'] for result in results):
+            raise git.GitCommandError(['git', 'push', 'origin', refspec], status, strip_progress(stderr), stdout)
+
+    def _checkout_branch(self, repo, target_branch):
+        """切换到目标分支，本地不存在时从远程分支或当前提交创建"""
+        try:
+            if repo.active_branch.name == target_branch:
+                return
+        except TypeError:
+            # 分离头指针
+            pass
+        if target_branch in repo.heads:
+            self.logger.info(f"切换到本地分支: {target_branch}")
+            repo.heads[target_branch].checkout()
+        elif f'origin/{target_branch}' in repo.refs:
+            self.logger.info(f"从远程创建本地分支: {target_branch}")
+            repo.create_head(target_branch, f'origin/{target_branch}').checkout()
+        else:
+            self.logger.info(f"创建新的本地分支: {target_branch}")
+            repo.create_head(target_branch).checkout()
+
+    def _apply_tree(self, task, repo, commit):
+        """让索引和工作区与提交的目录树一致，只处理有差异的路径，返回 (更新数, 删除数)"""
+        env = {'GIT_LITERAL_PATHSPECS': '1'}
+        # 刷新索引中的文件状态，避免内容未变的文件因时间戳变化被当作差异
+        repo.git.update_index('-q', '--refresh', with_exceptions=False)
+        output = repo.git.diff('--name-status', '-z', '--no-renames', commit.hexsha)
+        fields = output.split('\0')
+        to_checkout = []
+        to_remove = []
+        for status, path in zip(fields[0::2], fields[1::2]):
+            # 相对目标提交：A 为目标中不存在的路径，其余（修改、删除、类型变化）从目标检出
+            (to_remove if status == 'A' else to_checkout).append(path)
+
+        pathspec_file = os.path.join(get_task_state_dir(self.base_dir, task), 'restore_pathspec')
+        try:
+            if to_remove:
+                self._write_pathspec(pathspec_file, to_remove)
+                repo.git.rm('-q', '-f', '--ignore-unmatch', f'--pathspec-from-file={pathspec_file}',
+                            '--pathspec-file-nul', env=env)
+            if to_checkout:
+                self._write_pathspec(pathspec_file, to_checkout)
+                repo.git(c=f'checkout.workers={CHECKOUT_WORKERS}').checkout(
+                    commit.hexsha, f'--pathspec-from-file={pathspec_file}', '--pathspec-file-nul', env=env)
+        finally:
+            if os.path.exists(pathspec_file):
+                os.remove(pathspec_file)
+
+        # 索引应与目标目录树完全一致，否则（例如子模块）整体重置索引
+        if repo.git.write_tree() != commit.tree.hexsha:
+            self.logger.warning("索引与目标提交不一致，重新读取目标目录树")
+            repo.git.read_tree(commit.hexsha)
+            repo.git.checkout_index('-a', '-f')
+            repo.git.update_index('-q', '--refresh', with_exceptions=False)
+        return len(to_checkout), len(to_remove)
+
+    @staticmethod
+    def _write_pathspec(pathspec_file, paths):
+        with open(pathspec_file, 'wb') as f:
+            f.write(b'\0'.join(os.fsencode(path) for path in paths))
+
+    def _resolve_snapshot(self, task_id: int, commit_hash: str, path: str = ''):
+        """解析快照中的路径，返回 (任务, 仓库, 提交SHA, 规范化路径, 对象类型)"""
+        task = self.get_task_info(task_id)
+        path = normalize_snapshot_path(path)
+        # 解析提交会用到句柄的常驻 cat-file 进程，只在查找对象时持有仓库锁
+        with self.git_pool.lock(task['source_path']):
+            repo = self.init_repo(task['source_path'])
+            try:
+                sha = repo.commit(commit_hash).hexsha
+            except (ValueError, git.BadName, git.BadObject, GitCommandError):
+                raise ValueError(f"提交 {commit_hash} 不存在")
+            obj_type = object_type(repo, f'{sha}:{path}') if path else 'tree'
+        if obj_type not in ('blob', 'tree'):
+            raise ValueError(f"提交 {sha[:8]} 中不存在路径: {path}")
+        return task, repo, sha, path, obj_type
+
+    def stream_archive(self, task_id: int, commit_hash: str, path: str = '', fmt: str = 'tar'):
+        """以归档格式流式输出快照中的文件、目录或整个目录树
+
+        直接从对象库生成，不修改工作区、不持有仓库锁，内存占用与快照大小无关。
+        返回 (数据块生成器, 文件名, MIME类型)。
+        """
+        if fmt not in ARCHIVE_FORMATS:
+            raise ValueError(f"不支持的归档格式: {fmt}")
+        task, repo, sha, path, _ = self._resolve_snapshot(task_id, commit_hash, path)
+        self.logger.info(f"导出任务 {task_id} 的快照 {sha[:8]}:{path or '/'} ({fmt})")
+        chunks = stream_process(open_archive(self.git_pool.command(repo.working_dir), sha, path, fmt))
+        return chunks, f'{snapshot_name(task, sha, path)}.{fmt}', ARCHIVE_FORMATS[fmt][1]
+
+    def _resolve_object(self, task_id: int, commit_hash: str, path: str = ''):
+        """通过常驻的 cat-file 进程解析快照中的路径，返回 (任务, 提交SHA, 规范化路径, (对象SHA, 类型, 大小))"""
+        task = self.get_task_info(task_id)
+        repo_path = task['source_path']
+        path = normalize_snapshot_path(path)
+        rev = f'{commit_hash}^{{commit}}'
+        commit = self.git_pool.object_headers(repo_path, [rev]).get(rev)
+        if not commit:
+            raise ValueError(f"提交 {commit_hash} 不存在")
+        sha = commit[0]
+        spec = f'{sha}:{path}' if path else f'{sha}^{{tree}}'
+        header = self.git_pool.object_headers(repo_path, [spec]).get(spec)
+        if not header or header[1] not in ('blob', 'tree'):
+            raise ValueError(f"提交 {sha[:8]} 中不存在路径: {path}")
+        return task, sha, path, header
+
+    def _read_tree(self, repo_path: str, tree_sha: str) -> List[Dict]:
+        """读取并解析tree对象（目录在前，按名称排序），按SHA缓存"""
+        with self._history_lock:
+            entries = self._tree_cache.get(tree_sha)
+            if entries is not None:
+                self._tree_cache.move_to_end(tree_sha)
+                return entries
+        _, _, _, data = self.git_pool.read_object(repo_path, tree_sha)
+        entries = sorted(parse_tree(data), key=lambda e: (e[0] != '40000', e[1]))
+        with self._history_lock:
+            self._tree_cache[tree_sha] = entries
+            while len(self._tree_cache) > TREE_CACHE_SIZE:
+                self._tree_cache.popitem(last=False)
+        return entries
+
+    def list_tree(self, task_id: int, commit_hash: str, path: str = '', offset: int = 0,
+                  limit: int = 100) -> Dict:
+        """分页列出快照中的一个目录（不检出、不启动子进程），只查询当前页文件的大小"""
+        task, sha, path, (tree_sha, obj_type, _) = self._resolve_object(task_id, commit_hash, path)
+        if obj_type != 'tree':
+            raise ValueError(f"路径不是目录: {path}")
+        entries = self._read_tree(task['source_path'], tree_sha)
+        page = [tree_entry(path, *entry) for entry in entries[offset:offset + limit]]
+        sizes = self.git_pool.object_headers(
+            task['source_path'], [e['sha'] for e in page if e['type'] in ('file', 'symlink')])
+        for entry in page:
+            if entry['sha'] in sizes:
+                entry['size'] = sizes[entry['sha']][2]
+        next_offset = offset + limit if offset + limit < len(entries) else None
+        return {'commit': sha, 'path': path, 'tree': tree_sha, 'total': len(entries), 'offset': offset,
+                'entries': page, 'next_offset': next_offset}
+
+    def stat_file(self, task_id: int, commit_hash: str, path: str) -> Dict:
+        """获取快照中单个文件的信息；分块存储的大文件返回原始大小"""
+        task, sha, path, (blob_sha, obj_type, size) = self._resolve_object(task_id, commit_hash, path)
+        if obj_type != 'blob':
+            raise ValueError(f"路径不是文件: {path or '/'}")
+        info = {'task_id': task_id, 'commit': sha, 'path': path, 'sha': blob_sha, 'size': size,
+                'filename': posixpath.basename(path), 'data': None, 'pointer': None}
+        if size <= SMALL_BLOB_SIZE:
+            # 小文件直接读入内存，同时识别大文件的指针
+            info['data'] = self.git_pool.read_object(task['source_path'], blob_sha)[3]
+            info['pointer'] = parse_pointer(info['data'])
+            if info['pointer']:
+                info['size'] = info['pointer']['size']
+        return info
+
+    def iter_file(self, info: Dict, start: int = 0, stop: Optional[int] = None):
+        """按字节范围 [start, stop) 流式输出 stat_file 返回的文件"""
+        stop = info['size'] if stop is None else stop
+        task = self.get_task_info(info['task_id'])
+        if info['pointer']:
+            repo = self.init_repo(task['source_path'])
+            yield from self.large_files.iter_chunks(repo, info['pointer'], start=start, stop=stop)
+        elif info['data'] is not None:
+            yield info['data'][start:stop]
+        else:
+            with self.git_pool.blob_reader(task['source_path']) as reader:
+                if not reader.open(info['sha']):
+                    raise ValueError(f"对象不存在: {info['sha']}")
+                reader.skip(start)
+                remaining = stop - start
+                while remaining > 0:
+                    data = reader.read(min(remaining, STREAM_CHUNK_SIZE))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+
+    def extract_snapshot(self, task_id: int, commit_hash: str, path: str, target_dir: str,
+                         overwrite: bool = False) -> Dict:
+        """把快照中的文件或目录写入其他目录，不修改源目录和远程仓库
+
+        目标目录（解析符号链接后）必须位于 extract_roots 中某个目录之下。
+        """
+        task, repo, sha, path, _ = self._resolve_snapshot(task_id, commit_hash, path)
+        if not target_dir or not os.path.isabs(target_dir):
+            raise ValueError("目标目录必须是绝对路径")
+        target_dir = os.path.realpath(target_dir)
+        if not any(is_within(target_dir, root) and target_dir != os.path.realpath(root)
+                   for root in self.extract_roots):
+            raise ValueError(f"目标目录不在允许导出的目录中: {target_dir}")
+        if is_within(target_dir, task['source_path']) or is_within(task['source_path'], target_dir):
+            raise ValueError("目标目录不能与源目录重叠，还原源目录请使用还原功能")
+        if os.path.isdir(target_dir) and os.listdir(target_dir) and not overwrite:
+            raise ValueError(f"目标目录不为空: {target_dir}")
+        os.makedirs(target_dir, exist_ok=True)
+
+        self.emit_status(task_id, 'info', f'正在导出 {sha[:8]}:{path or "/"} 到 {target_dir}...')
+        extract_filter = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+        files = 0
+        proc = open_archive(self.git_pool.command(repo.working_dir), sha, path)
+        try:
+            # 流式解包：边读取边写入，不在内存或磁盘上保留整个归档
+            with tarfile.open(fileobj=proc.stdout, mode='r|') as tar:
+                for member in tar:
+                    tar.extract(member, target_dir, **extract_filter)
+                    if member.isfile():
+                        files += 1
+                        if files % 1000 == 0:
+                            self.emit_status(task_id, 'info', f'已导出 {files} 个文件...')
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+        restored = 0
+        if self.large_files.is_enabled(task):
+            with self.git_pool.lock(repo.working_dir):
+                restored = self.large_files.rehydrate(repo, sha, work_dir=target_dir, pathspec=path or None)
+        message = f'已导出 {files} 个文件到 {target_dir}'
+        self.logger.info(f"任务 {task_id} 快照 {sha[:8]}: {message}")
+        self.emit_status(task_id, 'success', message)
+        return {'commit': sha, 'path': path, 'target_dir': target_dir, 'files': files,
+                'large_files': restored}
+
+    def get_diff_summary(self, task_id: int, commit_hash: str, base: str = 'worktree',
+                         offset: int = 0, limit: int = 100) -> Dict:
+        """还原前预览：分页返回还原到指定提交时会变化的文件（只比较状态，不读取内容）
+
+        base 为 worktree 时与当前工作区比较（即还原实际会改写的内容，未跟踪的文件不受影响），
+        为 head 时与当前分支的 HEAD 比较。
+        """
+        _, repo, sha, _, _ = self._resolve_snapshot(task_id, commit_hash)
+        git_cmd = self.git_pool.command(repo.working_dir)
+        files = []
+        for i, (status, path) in enumerate(iter_name_status(git_cmd, sha, base)):
+            if i < offset:
+                continue
+            if len(files) == limit:
+                # 多读一个即可判断是否还有下一页，不需要遍历全部差异
+                return {'commit': sha, 'base': base, 'offset': offset, 'files': files,
+                        'next_offset': offset + limit}
+            files.append(summarize(status, path))
+        return {'commit': sha, 'base': base, 'offset': offset, 'files': files, 'next_offset': None}
+
+    def iter_diff_pages(self, task_id: int, commit_hash: str, base: str = 'worktree', per_page: int = 100):
+        """流式生成变更文件列表的分页，最后一页之后返回各状态的文件数"""
+        _, repo, sha, _, _ = self._resolve_snapshot(task_id, commit_hash)
+        page = []
+        counts = {}
+        offset = 0
+        for status, path in iter_name_status(self.git_pool.command(repo.working_dir), sha, base):
+            item = summarize(status, path)
+            counts[item['status']] = counts.get(item['status'], 0) + 1
+            page.append(item)
+            if len(page) == per_page:
+                yield {'commit': sha, 'base': base, 'offset': offset, 'files': page}
+                offset += len(page)
+                page = []
+        if page:
+            yield {'commit': sha, 'base': base, 'offset': offset, 'files': page}
+        yield {'commit': sha, 'base': base, 'done': True, 'total': offset + len(page), 'counts': counts}
+
+    def get_file_diff(self, task_id: int, commit_hash: str, path: str, base: str = 'worktree') -> Dict:
+        """单个文件还原前后的补丁，二进制文件和大文件只返回两侧大小"""
+        _, repo, sha, _, _ = self._resolve_snapshot(task_id, commit_hash)
+        path = normalize_snapshot_path(path)
+        if not path:
+            raise ValueError("未提供文件路径")
+        result = file_diff(self.git_pool.command(repo.working_dir), sha, path, base)
+        result['commit'] = sha
+        result['base'] = base
+        return result
 
     def get_commit_details(self, task_id: int, commit_hash: str) -> Optional[Dict]:
-        """获取提交详细信息"""
+        """获取提交详细信息，已建立提交索引时直接从索引读取"""
+        if self.history_index:
+            commit = self.history_index.get_commit(task_id, commit_hash)
+            if commit:
+                return {
+                    "hash": commit['hash'],
+                    "message": commit['message'],
+                    "date": commit['date'],
+                    "author": commit['author'],
+                    "stats": {
+                        "files_changed": commit['stats']['files'],
+                        "insertions": commit['stats']['insertions'],
+                        "deletions": commit['stats']['deletions']
+                    },
+                    "files": [
+                        {
+                            "path": f['path'],
+                            "status": f['status'],
+                            "changes": f['insertions'] + f['deletions'],
+                            "insertions": f['insertions'],
+                            "deletions": f['deletions']
+                        }
+                        for f in commit['files']
+                    ]
+                }
+        with self.repo_lock(task_id):
+            return self._get_commit_details(task_id, commit_hash)
+
+    def _get_commit_details(self, task_id: int, commit_hash: str) -> Optional[Dict]:
         try:
             self.logger.info(f"正在获取提交 {commit_hash} 的详细信息")
             self.emit_status(task_id, 'info', f'正在获取提交 {commit_hash[:8]} 的详细信息...')
@@ -0,0 +1,100 @@
+import json
+import logging
+import threading
+from modules.database import get_db, init_db
+
+logger = logging.getLogger('git_backup')
+
+
+class RunLedger:
+    """备份执行记录和持久化队列
+
+    - jobs 表保存等待和执行中的备份，进程重启后重新提交
+    - runs 表记录每次执行的开始/结束时间、各阶段耗时、提交SHA、变化文件数、推送字节数和结果
+    作为执行器的状态回调使用，所有写入通过同一连接串行执行。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.logger = logger
+        init_db(db_path)
+        self._conn = get_db(db_path)
+        self._lock = threading.Lock()
+
+    def on_job_update(self, job):
+        """执行器状态回调
+
+        回调在状态变化之后执行，读到的可能已经是更新的状态（例如排队的回调执行时任务已开始运行），
+        因此不依赖触发回调的状态转换：未结束的状态一律写入完整的 jobs 记录，
+        已有执行结果的任务不再写回 jobs，结束状态则记录执行结果。
+        """
+        try:
+            if job.status in ('queued', 'running'):
+                self._execute('INSERT OR REPLACE INTO jobs (job_id, task_id, source, status, submitted_at, started_at) '
+                              'SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM runs WHERE job_id = ?)',
+                              (job.id, job.task_id, job.source, job.status, job.submitted_at, job.started_at,
+                               job.id))
+            else:
+                self._record_run(job)
+        except Exception as e:
+            self.logger.error(f"写入执行记录失败 {job.id}: {str(e)}")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(sql, params)
+
+    def _record_run(self, job):
+        stats = job.stats or {}
+        duration = job.finished_at - job.started_at if job.started_at and job.finished_at else None
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO runs (job_id, task_id, source, status, message, submitted_at, '
+                    'started_at, finished_at, duration, phases, commit_sha, files_changed, bytes_pushed, '
+                    'pushed, batch_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job.id, job.task_id, job.source, job.status, job.message, job.submitted_at,
+                     job.started_at, job.finished_at, duration, json.dumps(stats.get('phases', {})),
+                     stats.get('commit_sha'), stats.get('files_changed', 0), stats.get('bytes_pushed', 0),
+                     int(bool(stats.get('pushed'))), stats.get('batch_size', job.batch_size)))
+                self._conn.execute('DELETE FROM jobs WHERE job_id = ?', (job.id,))
+
+    def pending_jobs(self):
+        """获取上次运行时未完成的备份（按提交时间排序）"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT job_id, task_id, source, status, submitted_at FROM jobs ORDER BY submitted_at').fetchall()
+        return [dict(row) for row in rows]
+
+    def discard_job(self, job_id):
+        """删除无法恢复的排队记录"""
+        self._execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+
+    def get_runs(self, task_id=None, limit=100, before=None):
+        """查询执行记录（新的在前），before 为开始时间游标"""
+        sql = 'SELECT * FROM runs'
+        conditions = []
+        params = []
+        if task_id is not None:
+            conditions.append('task_id = ?')
+            params.append(task_id)
+        if before is not None:
+            conditions.append('started_at < ?')
+            params.append(before)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY started_at DESC LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        runs = []
+        for row in rows:
+            run = dict(row)
+            run['phases'] = json.loads(run['phases'] or '{}')
+            run['pushed'] = bool(run['pushed'])
+            runs.append(run)
+        return runs
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,70 @@
+import os
+import hashlib
+import logging
+from datetime import timedelta, datetime
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.cron import CronTrigger
+
+logger = logging.getLogger('git_backup')
+
+# 默认错峰窗口（秒），0表示不错峰；任务可通过 stagger_window 单独设置
+DEFAULT_STAGGER_WINDOW = int(os.getenv('SCHEDULE_STAGGER_WINDOW', '0'))
+
+
+def get_stagger_offset(task_id, window):
+    """根据任务ID计算窗口内固定的偏移秒数，同一任务每次启动都相同"""
+    if window <= 0:
+        return 0
+    digest = hashlib.sha1(f'task_{task_id}'.encode('utf-8')).hexdigest()
+    return int(digest, 16) % window
+
+
+class StaggeredCronTrigger(BaseTrigger):
+    """在cron表达式的每个触发时间上加固定偏移
+
+    触发次数和周期与原cron表达式一致，只是整体推迟 offset 秒；
+    偏移不超过cron的最短周期，避免相邻两次触发顺序颠倒。
+    """
+
+    __slots__ = 'trigger', 'offset'
+
+    def __init__(self, trigger, offset):
+        self.trigger = trigger
+        self.offset = timedelta(seconds=offset)
+
+    @classmethod
+    def from_crontab(cls, expr, task_id, window, timezone=None):
+        trigger = CronTrigger.from_crontab(expr, timezone=timezone)
+        offset = get_stagger_offset(task_id, window)
+        period = cls._min_period(trigger)
+        if period:
+            offset %= period
+        return cls(trigger, offset)
+
+    @staticmethod
+    def _min_period(trigger, samples=8):
+        """估算cron相邻两次触发的最短间隔（秒）"""
+        now = datetime.now(trigger.timezone)
+        previous = None
+        period = None
+        for _ in range(samples):
+            next_time = trigger.get_next_fire_time(previous, now)
+            if next_time is None:
+                break
+            if previous is not None:
+                gap = int((next_time - previous).total_seconds())
+                period = gap if period is None else min(period, gap)
+            previous = next_time
+            now = next_time
+        return period
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        previous = previous_fire_time - self.offset if previous_fire_time else None
+        nominal = self.trigger.get_next_fire_time(previous, now - self.offset)
+        return nominal + self.offset if nominal else None
+
+    def __str__(self):
+        return f'{self.trigger} +{int(self.offset.total_seconds())}s'
+
+    def __repr__(self):
+        return f'<StaggeredCronTrigger ({self.trigger!r}, offset={int(self.offset.total_seconds())}s)>'
@@ -0,0 +1,116 @@
+import os
+import posixpath
+import logging
+import git
+
+logger = logging.getLogger('git_backup')
+
+# 流式输出时每次读取的字节数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 支持的归档格式: 格式 -> (git archive --format, MIME类型)
+ARCHIVE_FORMATS = {
+    'tar': ('tar', 'application/x-tar'),
+    'tar.gz': ('tar.gz', 'application/gzip'),
+    'zip': ('zip', 'application/zip'),
+}
+
+
+def normalize_snapshot_path(path):
+    """规范化快照内的相对路径，空字符串表示整个目录树；不允许跳出仓库根目录"""
+    path = (path or '').replace('\\', '/').strip().strip('/')
+    if not path:
+        return ''
+    path = posixpath.normpath(path)
+    if path == '.':
+        return ''
+    if path == '..' or path.startswith('../') or path == '.git' or path.startswith('.git/'):
+        raise ValueError(f"无效的路径: {path}")
+    return path
+
+
+def object_type(repo, spec):
+    """获取对象类型（blob/tree/commit），对象不存在时返回None"""
+    try:
+        return repo.git.cat_file('-t', spec)
+    except git.exc.GitCommandError:
+        return None
+
+
+def stream_process(proc, chunk_size=STREAM_CHUNK_SIZE):
+    """逐块读取git进程的标准输出，读取结束或客户端断开时结束进程"""
+    finished = False
+    try:
+        while True:
+            data = proc.stdout.read(chunk_size)
+            if not data:
+                finished = True
+                break
+            yield data
+    finally:
+        proc.stdout.close()
+        killed = not finished and proc.proc.poll() is None
+        if killed:
+            proc.proc.kill()
+        try:
+            proc.wait()
+        except git.exc.GitCommandError as e:
+            if not killed:
+                logger.warning(f"读取快照失败: {str(e)}")
+
+
+def open_archive(git_cmd, sha, path='', fmt='tar'):
+    """启动 git archive，返回进程（从对象库直接生成，不经过工作区）
+
+    git_cmd 为 GitProcessPool.command() 返回的独立命令对象，读取期间不占用仓库句柄。
+    """
+    args = [f'--format={ARCHIVE_FORMATS[fmt][0]}', sha]
+    if path:
+        args += ['--', path]
+    return git_cmd.archive(*args, as_process=True)
+
+
+# 目录树条目的文件模式 -> 类型
+TREE_ENTRY_TYPES = {
+    '40000': 'dir',
+    '120000': 'symlink',
+    '160000': 'submodule',
+}
+
+
+def parse_tree(data):
+    """解析 cat-file 读取的原始tree对象，返回 [(模式, 名称, SHA)]"""
+    entries = []
+    pos = 0
+    while pos < len(data):
+        space = data.index(b' ', pos)
+        nul = data.index(b'\0', space)
+        entries.append((data[pos:space].decode(), os.fsdecode(data[space + 1:nul]), data[nul + 1:nul + 21].hex()))
+        pos = nul + 21
+    return entries
+
+
+def tree_entry(parent, mode, name, sha):
+    """目录树条目的字典表示"""
+    return {
+        'name': name,
+        'path': f'{parent}/{name}' if parent else name,
+        'type': TREE_ENTRY_TYPES.get(mode, 'file'),
+        'mode': mode.zfill(6),
+        'sha': sha
+    }
+
+
+def snapshot_name(task, sha, path=''):
+    """下载文件名: <任务名>-<短SHA>[-<路径最后一级>]"""
+    name = f"{task.get('name') or task.get('id')}-{sha[:8]}"
+    if path:
+        name += f'-{posixpath.basename(path)}'
+    return name.replace('/', '_')
+
+
+def is_within(path, directory):
+    """path 是否位于 directory 之内（包括相同目录）"""
+    path = os.path.realpath(path)
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([path, directory]) == directory
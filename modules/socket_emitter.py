@@ -0,0 +1,46 @@
+import queue
+import logging
+
+logger = logging.getLogger('git_backup')
+
+# 后台任务检查待发送事件的间隔（秒）
+DRAIN_INTERVAL = 0.1
+
+
+class SocketEmitter:
+    """把其他线程中产生的WebSocket事件转交给事件循环发送
+
+    gevent模式下SocketIO只能在事件循环所在的线程中使用，备份执行器、调度器等
+    普通线程直接调用 socketio.emit 并不安全。事件先放入线程安全的队列，
+    由 start_background_task 启动的后台任务在事件循环中取出并发送。
+    emit 的参数与 socketio.emit 相同，可以直接替代。
+    """
+
+    def __init__(self, socketio, interval=DRAIN_INTERVAL):
+        self.socketio = socketio
+        self.interval = interval
+        self.logger = logger
+        self._queue = queue.SimpleQueue()
+        self._task = None
+
+    def start(self):
+        """启动发送事件的后台任务"""
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._drain)
+
+    def emit(self, event, *args, **kwargs):
+        """把事件放入发送队列，可以在任意线程中调用"""
+        self._queue.put((event, args, kwargs))
+
+    def _drain(self):
+        while True:
+            while True:
+                try:
+                    event, args, kwargs = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self.socketio.emit(event, *args, **kwargs)
+                except Exception as e:
+                    self.logger.error(f"发送WebSocket事件失败 {event}: {str(e)}")
+            self.socketio.sleep(self.interval)
@@ -0,0 +1,161 @@
+import os
+import hashlib
+import time
+import logging
+import tempfile
+import threading
+import subprocess
+from urllib.parse import urlparse
+from modules.git_env import ensure_key_dir
+
+logger = logging.getLogger('git_backup')
+
+# 主连接空闲多久（秒）后自动退出，0表示不使用连接复用
+SSH_CONTROL_PERSIST = int(os.getenv('SSH_CONTROL_PERSIST', '600'))
+# 建立主连接的超时时间（秒）
+SSH_CONNECT_TIMEOUT = int(os.getenv('SSH_CONNECT_TIMEOUT', '30'))
+# 建立主连接失败后，在此时间（秒）内不再重试，直接使用普通连接
+SSH_RETRY_INTERVAL = 60
+
+
+def parse_ssh_remote(remote_url):
+    """解析SSH远程地址，返回 (user, host, port)，不是SSH地址时返回None"""
+    if remote_url.startswith('ssh://'):
+        parsed = urlparse(remote_url)
+        if not parsed.hostname:
+            return None
+        return parsed.username, parsed.hostname, parsed.port
+    if '://' in remote_url:
+        return None
+    # scp格式: [user@]host:path，冒号前不能含有路径分隔符
+    user_host, sep, _ = remote_url.partition(':')
+    if not sep or '/' in user_host or len(user_host) < 2:
+        return None
+    user, _, host = user_host.rpartition('@')
+    return user or None, host, None
+
+
+class SSHMultiplexer:
+    """按 (主机, 密钥) 维护常驻的SSH主连接（ControlMaster），供所有git网络操作复用
+
+    主连接由本类显式启动（ssh -fN），git命令只以 ControlMaster=no 连接到控制套接字；
+    主连接不可用时ssh会自动回退为普通连接，不影响备份。空闲超时由 ControlPersist 处理，
+    每次使用前通过 ssh -O check 检查主连接是否存活。
+    """
+
+    def __init__(self, persist=SSH_CONTROL_PERSIST):
+        self.persist = persist
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._masters = {}
+        self._failed = {}
+
+    @property
+    def enabled(self):
+        return self.persist > 0
+
+    def _control_path(self, target, identity):
+        digest = hashlib.sha1(f'{target}\0{identity}'.encode('utf-8')).hexdigest()[:20]
+        return os.path.join(ensure_key_dir(), f'cm-{digest}')
+
+    def _base_args(self, control_path, target):
+        user, host, port = target
+        args = ['ssh', '-o', f'ControlPath={control_path}', '-o', 'BatchMode=yes']
+        if port:
+            args += ['-p', str(port)]
+        args.append(f'{user}@{host}' if user else host)
+        return args
+
+    def _check(self, control_path, target):
+        """检查主连接是否存活"""
+        if not os.path.exists(control_path):
+            return False
+        args = self._base_args(control_path, target)
+        args[1:1] = ['-O', 'check']
+        result = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, timeout=SSH_CONNECT_TIMEOUT)
+        return result.returncode == 0
+
+    def _start(self, control_path, target, key_path):
+        """启动后台主连接"""
+        args = self._base_args(control_path, target)
+        args[1:1] = ['-fN', '-i', key_path,
+                     '-o', 'IdentitiesOnly=yes',
+                     '-o', 'StrictHostKeyChecking=no',
+                     '-o', 'ControlMaster=yes',
+                     '-o', f'ControlPersist={self.persist}',
+                     '-o', f'ConnectTimeout={SSH_CONNECT_TIMEOUT}',
+                     '-o', 'ServerAliveInterval=30']
+        # 错误输出写入临时文件：后台主连接继承的句柄不会让这里一直等待管道关闭
+        with tempfile.TemporaryFile() as stderr:
+            result = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=stderr, timeout=SSH_CONNECT_TIMEOUT + 10)
+            if result.returncode != 0:
+                stderr.seek(0)
+                message = stderr.read().decode('utf-8', 'replace').strip()
+                raise RuntimeError(message or f'exit {result.returncode}')
+
+    def ensure(self, remote_url, key_path, identity):
+        """确保到远程主机的主连接可用，返回控制套接字路径；无法复用时返回None
+
+        identity 用于区分密钥（密钥内容的摘要或密钥文件路径），
+        临时密钥文件在会话结束后删除，已认证的主连接仍可继续使用。
+        """
+        if not self.enabled:
+            return None
+        target = parse_ssh_remote(remote_url)
+        if not target:
+            return None
+        try:
+            control_path = self._control_path(target, identity)
+            with self._lock:
+                lock = self._locks.setdefault(control_path, threading.Lock())
+            with lock:
+                if self._check(control_path, target):
+                    with self._lock:
+                        self._masters[control_path] = target
+                    return control_path
+                if time.time() - self._failed.get(control_path, 0) < SSH_RETRY_INTERVAL:
+                    return None
+                if os.path.exists(control_path):
+                    # 主连接已退出，清理残留的套接字
+                    os.remove(control_path)
+                try:
+                    self._start(control_path, target, key_path)
+                except Exception:
+                    self._failed[control_path] = time.time()
+                    raise
+                self._failed.pop(control_path, None)
+                with self._lock:
+                    self._masters[control_path] = target
+                self.logger.info(f"已建立SSH主连接: {target[1]}")
+                return control_path
+        except Exception as e:
+            self.logger.warning(f"建立SSH主连接失败，使用普通连接: {str(e)}")
+            return None
+
+    def get_stats(self):
+        """获取主连接状态"""
+        with self._lock:
+            masters = dict(self._masters)
+        return {
+            'enabled': self.enabled,
+            'persist': self.persist,
+            'masters': [{'host': target[1], 'alive': self._check(path, target)}
+                        for path, target in masters.items()]
+        }
+
+    def close_all(self):
+        """关闭所有主连接"""
+        with self._lock:
+            masters = dict(self._masters)
+            self._masters.clear()
+        for control_path, target in masters.items():
+            args = self._base_args(control_path, target)
+            args[1:1] = ['-O', 'exit']
+            try:
+                subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, timeout=10)
+            except Exception as e:
+                self.logger.debug(f"关闭SSH主连接失败 {target[1]}: {str(e)}")
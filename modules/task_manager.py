@@ -3,6 +3,11 @@ import hashlib
 import logging
 from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime
+from modules.backup_executor import BackupExecutor
+from modules.schedule import StaggeredCronTrigger, DEFAULT_STAGGER_WINDOW
+from modules.adaptive_schedule import AdaptiveScheduler
+from modules.run_ledger import RunLedger
+from apscheduler.triggers.date import DateTrigger
 
 logger = logging.getLogger('git_backup')
 
@@ -14,7 +19,15 @@ class TaskManager:
         self.scheduler = scheduler
         self.logger = logger
         self.tasks = {}
+        self.adaptive = AdaptiveScheduler(git_manager.state_dir)
+        self.executor = BackupExecutor(self.git_backup_wrapper,
+                                       batch_func=self.git_backup_batch_wrapper,
+                                       group_func=self.git_manager.push_group_key,
+                                       stats_func=self.git_manager.get_run_stats)
+        self.ledger = RunLedger(config.DATABASE_PATH)
+        self.executor.add_listener(self.ledger.on_job_update)
         self.load_tasks()
+        self.resume_jobs()
     
     def remove_job_safe(self, job_id):
         """安全地移除调度任务"""
@@ -23,6 +36,61 @@ class TaskManager:
         except Exception as e:
             self.logger.debug(f"移除任务调度失败 {job_id}: {str(e)}")
     
+    def build_trigger(self, task):
+        """根据任务的cron表达式生成触发器，启用错峰时在每次触发上加固定偏移"""
+        window = int(task.get('stagger_window', DEFAULT_STAGGER_WINDOW) or 0)
+        if window > 0:
+            return StaggeredCronTrigger.from_crontab(task['schedule'], task['id'], window)
+        return CronTrigger.from_crontab(task['schedule'])
+    
+    def schedule_task(self, task):
+        """任务启用且有调度设置时添加到调度器
+        
+        自适应模式的任务不使用cron表达式，每次执行后按学习到的间隔安排下一次执行。
+        """
+        adaptive = self.adaptive.is_enabled(task)
+        if not (task.get('enabled', True) and (task.get('schedule') or adaptive)):
+            return
+        task_id = task['id']
+        try:
+            job_options = {}
+            if adaptive:
+                trigger = DateTrigger(self.adaptive.next_run_time(task, self.scheduler.timezone))
+                # 一次性触发器错过后不会再触发，任务也就不再被调度，因此延迟多久都要执行
+                job_options = {'misfire_grace_time': None, 'coalesce': True}
+            else:
+                trigger = self.build_trigger(task)
+            self.scheduler.add_job(
+                self.run_scheduled_backup,
+                trigger,
+                args=[task_id],
+                id=f'task_{task_id}',
+                replace_existing=True,
+                **job_options
+            )
+        except Exception as e:
+            self.logger.error(f"添加任务调度失败 {task_id}: {str(e)}")
+    
+    def after_backup(self, task_id, success):
+        """备份结束后更新自适应调度并安排下一次执行"""
+        task = self.get_task(task_id)
+        if not task or not self.adaptive.is_enabled(task):
+            return
+        try:
+            stats = self.git_manager.get_run_stats(task['id'])
+            self.adaptive.record(task, success, stats.get('committed', False), stats.get('files_changed', 0))
+            self.schedule_task(task)
+        except Exception as e:
+            self.logger.error(f"更新自适应调度失败 {task_id}: {str(e)}")
+    
+    def get_schedule_info(self, task_id):
+        """获取任务的实际下次执行时间（已包含错峰偏移）"""
+        job = self.scheduler.get_job(f'task_{task_id}')
+        if not job or not job.next_run_time:
+            return {'next_run_time': None, 'schedule_offset': 0}
+        offset = job.trigger.offset.total_seconds() if isinstance(job.trigger, StaggeredCronTrigger) else 0
+        return {'next_run_time': job.next_run_time.isoformat(), 'schedule_offset': int(offset)}
+    
     def load_tasks(self):
         """从配置中加载所有任务并设置调度"""
         try:
@@ -31,18 +99,9 @@ class TaskManager:
                 task_id = task.get('id')
                 if task_id:
                     self.tasks[task_id] = task
+                    self.git_manager.update_watcher(task)
                     # 如果任务启用且有调度设置，添加到调度器
-                    if task.get('enabled', True) and task.get('schedule'):
-                        try:
-                            self.scheduler.add_job(
-                                self.git_backup_wrapper,
-                                CronTrigger.from_crontab(task['schedule']),
-                                args=[task_id],
-                                id=f'task_{task_id}',
-                                replace_existing=True
-                            )
-                        except Exception as e:
-                            self.logger.error(f"添加任务调度失败 {task_id}: {str(e)}")
+                    self.schedule_task(task)
             self.logger.info(f"成功加载 {len(tasks)} 个任务")
         except Exception as e:
             self.logger.error(f"加载任务失败: {str(e)}")
@@ -50,14 +109,8 @@ class TaskManager:
     
     def is_duplicate_task(self, task_data, exclude_id=None):
         """检查是否存在重复任务"""
-        tasks = self.config.get_all_tasks()
-        for task in tasks:
-            if exclude_id and task.get('id') == exclude_id:
-                continue
-            if (task.get('source_path') == task_data.get('source_path') and 
-                task.get('remote_url') == task_data.get('remote_url')):
-                return True
-        return False
+        return self.config.find_duplicate_task(task_data.get('source_path'), task_data.get('remote_url'),
+                                               exclude_id) is not None
     
     def add_task(self, task_data):
         """添加新任务"""
@@ -94,19 +147,10 @@ class TaskManager:
             task_id = task['id']
 
             # 如果设置了定时任务，添加到调度器
-            if task.get('enabled', True) and task.get('schedule'):
-                try:
-                    self.scheduler.add_job(
-                        self.git_backup_wrapper,
-                        CronTrigger.from_crontab(task['schedule']),
-                        args=[task_id],
-                        id=f'task_{task_id}',
-                        replace_existing=True
-                    )
-                except Exception as e:
-                    self.logger.error(f"添加任务调度失败 {task_id}: {str(e)}")
+            self.schedule_task(task)
 
             self.tasks[task_id] = task
+            self.git_manager.update_watcher(task)
             return task
         except Exception as e:
             self.logger.error(f"添加任务失败: {str(e)}")
@@ -134,19 +178,10 @@ class TaskManager:
             job_id = f'task_{task_id}'
             self.remove_job_safe(job_id)
             
-            if task.get('enabled', True) and task.get('schedule'):
-                try:
-                    self.scheduler.add_job(
-                        self.git_backup_wrapper,
-                        CronTrigger.from_crontab(task['schedule']),
-                        args=[task_id],
-                        id=job_id,
-                        replace_existing=True
-                    )
-                except Exception as e:
-                    self.logger.error(f"更新任务调度失败 {task_id}: {str(e)}")
+            self.schedule_task(task)
 
             self.tasks[task_id] = task
+            self.git_manager.update_watcher(task)
             return task
         except Exception as e:
             self.logger.error(f"更新任务失败: {str(e)}")
@@ -158,12 +193,19 @@ class TaskManager:
             # 从调度器中移除任务
             self.remove_job_safe(f'task_{task_id}')
             
+            # 停止目录监听
+            task = self.get_task(task_id)
+            if task:
+                self.git_manager.stop_watcher(task)
+            
             # 删除任务配置
             if not self.config.delete_task(task_id):
                 raise ValueError("任务不存在")
 
             # 从内存中移除任务
             self.tasks.pop(task_id, None)
+            if self.git_manager.history_index:
+                self.git_manager.history_index.drop(task_id)
         except Exception as e:
             self.logger.error(f"删除任务失败: {str(e)}")
             raise
@@ -182,19 +224,10 @@ class TaskManager:
             job_id = f'task_{task_id}'
             self.remove_job_safe(job_id)
             
-            if task['enabled'] and task.get('schedule'):
-                try:
-                    self.scheduler.add_job(
-                        self.git_backup_wrapper,
-                        CronTrigger.from_crontab(task['schedule']),
-                        args=[task_id],
-                        id=job_id,
-                        replace_existing=True
-                    )
-                except Exception as e:
-                    self.logger.error(f"更新任务调度失败 {task_id}: {str(e)}")
+            self.schedule_task(task)
 
             self.tasks[task_id] = task
+            self.git_manager.update_watcher(task)
             return task
         except Exception as e:
             self.logger.error(f"切换任务状态失败: {str(e)}")
@@ -212,8 +245,80 @@ class TaskManager:
         """获取所有任务"""
         return list(self.tasks.values()) or self.config.get_all_tasks()
     
+    def submit_backup(self, task_id, source='manual'):
+        """将备份任务提交到执行器，返回执行记录
+        
+        手动触发时，同一任务已在等待或执行中则直接返回已有的执行。
+        """
+        task = self.get_task(task_id)
+        if not task:
+            raise ValueError("任务不存在")
+        return self.executor.submit(task, source, collapse_running=(source == 'manual'))
+
+    def resume_jobs(self):
+        """重新提交上次进程退出时仍在等待或执行中的备份"""
+        for row in self.ledger.pending_jobs():
+            task = self.get_task(row['task_id'])
+            if not task or not task.get('enabled', True):
+                self.ledger.discard_job(row['job_id'])
+                continue
+            try:
+                self.executor.submit(task, row['source'] or 'resume', job_id=row['job_id'])
+                self.logger.info(f"已恢复未完成的备份: 任务 {row['task_id']} ({row['status']})")
+            except Exception as e:
+                self.logger.error(f"恢复备份失败 {row['task_id']}: {str(e)}")
+
+    def get_runs(self, task_id=None, limit=100, before=None):
+        """查询备份执行记录"""
+        return self.ledger.get_runs(task_id, limit, before)
+
+    def get_job(self, job_id):
+        """获取备份执行记录"""
+        return self.executor.get_job(job_id)
+
+    def list_jobs(self, task_id=None, limit=50):
+        """列出最近的备份执行记录"""
+        return self.executor.list_jobs(task_id, limit)
+
+    def run_scheduled_backup(self, task_id):
+        """调度器触发的备份，只负责入队，实际执行由执行器完成"""
+        try:
+            self.submit_backup(task_id, 'schedule')
+        except Exception as e:
+            self.logger.error(f"提交定时备份失败 {task_id}: {str(e)}")
+            # 自适应模式的一次性触发已消耗，需要重新安排
+            self.after_backup(task_id, False)
+
+    def get_executor_stats(self):
+        """获取备份执行器状态"""
+        return self.executor.get_stats()
+
+    def git_backup_batch_wrapper(self, task_ids):
+        """合并推送多个任务，每个任务单独发送通知，返回 {任务ID: (是否成功, 消息)}"""
+        tasks = []
+        results = {}
+        for task_id in task_ids:
+            task = self.get_task(task_id)
+            if task:
+                tasks.append(task)
+            else:
+                results[task_id] = (False, '任务不存在')
+                self.logger.error(f"执行任务 '{task_id}' 失败: 任务不存在")
+
+        backup_results = self.git_manager.git_backup_batch(tasks) if tasks else {}
+        for task in tasks:
+            success, message = backup_results.get(task['id'], (False, '备份未执行'))
+            self.notification_manager.send_notification(
+                task,
+                'success' if success else 'error',
+                message
+            )
+            results[task['id']] = (success, message)
+            self.after_backup(task['id'], success)
+        return results
+
     def git_backup_wrapper(self, task_id):
-        """执行Git备份任务的包装方法"""
+        """执行Git备份任务的包装方法，返回 (是否成功, 消息)"""
         try:
             task = self.get_task(task_id)
             if not task:
@@ -236,7 +341,8 @@ class TaskManager:
                     message
                 )
 
-            return success
+            self.after_backup(task_id, success)
+            return success, message
         except Exception as e:
             error_message = f"执行任务 '{task_id}' 失败: {str(e)}"
             self.logger.error(error_message)
@@ -245,4 +351,5 @@ class TaskManager:
                 'error',
                 error_message
             )
+            self.after_backup(task_id, False)
             raise 
\ No newline at end of file
@@ -0,0 +1,51 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger('git_backup')
+
+
+def get_task_key(task):
+    """获取任务在状态目录中的唯一标识"""
+    task_id = task.get('id')
+    if task_id is not None:
+        return f"task_{task_id}"
+    # 没有ID的任务（例如临时执行）使用源路径的摘要
+    digest = hashlib.sha1(os.path.abspath(task['source_path']).encode('utf-8')).hexdigest()
+    return f"path_{digest[:12]}"
+
+
+def get_task_state_dir(base_dir, task):
+    """获取任务的状态目录，不存在时自动创建"""
+    state_dir = os.path.join(base_dir, 'state', get_task_key(task))
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+def load_json(path, default=None):
+    """读取JSON状态文件，文件不存在或损坏时返回默认值"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (ValueError, OSError) as e:
+        logger.warning(f"读取状态文件失败 {path}: {str(e)}")
+        return default
+
+
+def save_json(path, data):
+    """原子地写入JSON状态文件"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,194 @@
+import os
+import json
+import yaml
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Dict, List, Optional
+from modules.database import get_db, init_db
+
+logger = logging.getLogger('git_backup')
+
+
+class YamlTaskStore:
+    """任务保存在YAML文件中，每次修改整体重写（兼容旧部署）"""
+
+    def __init__(self, config_file):
+        self.config_file = config_file
+        self.logger = logger
+        self._tasks: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        """加载配置文件"""
+        try:
+            if os.path.exists(self.config_file):
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    config_data = yaml.safe_load(f) or {}
+                self._tasks = {task['id']: task for task in config_data.get('tasks') or [] if task.get('id')}
+                self.logger.info(f"成功加载 {len(self._tasks)} 个任务")
+            else:
+                self.logger.info("配置文件不存在，将创建新的配置文件")
+                self.save()
+        except Exception as e:
+            self.logger.error(f"加载配置文件失败: {str(e)}")
+            self._tasks = {}
+
+    def save(self) -> None:
+        """保存配置到文件：先写临时文件再替换，中途失败不会留下半个文件"""
+        try:
+            content = yaml.dump({'tasks': list(self._tasks.values())}, allow_unicode=True, sort_keys=False)
+            directory = os.path.dirname(os.path.abspath(self.config_file))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.yaml')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                os.replace(tmp_path, self.config_file)
+            except OSError:
+                os.remove(tmp_path)
+                # 单独挂载到容器中的配置文件不能被替换，只能原地写入
+                with open(self.config_file, 'w', encoding='utf-8') as f:
+                    f.write(content)
+            self.logger.info("配置文件保存成功")
+        except Exception as e:
+            self.logger.error(f"保存配置文件失败: {str(e)}")
+
+    def get(self, task_id: int) -> Optional[Dict]:
+        return self._tasks.get(task_id)
+
+    def all(self) -> List[Dict]:
+        return list(self._tasks.values())
+
+    def add(self, task_data: Dict) -> Dict:
+        with self._lock:
+            task_data['id'] = max(self._tasks, default=0) + 1
+            self._tasks[task_data['id']] = task_data
+            self.save()
+        return task_data
+
+    def update(self, task_id: int, task_data: Dict) -> Optional[Dict]:
+        with self._lock:
+            if task_id not in self._tasks:
+                return None
+            task_data['id'] = task_id
+            self._tasks[task_id] = task_data
+            self.save()
+        return task_data
+
+    def delete(self, task_id: int) -> bool:
+        with self._lock:
+            if self._tasks.pop(task_id, None) is None:
+                return False
+            self.save()
+        return True
+
+    def find_duplicate(self, source_path, remote_url, exclude_id=None) -> Optional[Dict]:
+        for task in self._tasks.values():
+            if task['id'] != exclude_id and task.get('source_path') == source_path \
+                    and task.get('remote_url') == remote_url:
+                return task
+        return None
+
+
+class SQLiteTaskStore:
+    """任务保存在SQLite中，每次修改只写一行
+
+    id 为主键，(source_path, remote_url) 有索引，查找和查重都不需要扫描全部任务；
+    每次写入都是一个事务。首次启动时自动导入YAML配置文件中的任务。
+    """
+
+    def __init__(self, db_path, config_file=None):
+        self.db_path = db_path
+        self.logger = logger
+        init_db(db_path)
+        self._conn = get_db(db_path)
+        self._lock = threading.Lock()
+        if config_file:
+            self.migrate_from_yaml(config_file)
+
+    def migrate_from_yaml(self, config_file) -> None:
+        """一次性导入YAML配置文件中的任务，导入后YAML文件不再读取
+
+        导入时记录文件内容的哈希，之后文件被修改时输出警告（修改不会生效）。
+        """
+        content = b''
+        if os.path.exists(config_file):
+            with open(config_file, 'rb') as f:
+                content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'yaml_migrated'").fetchone():
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'yaml_sha256'").fetchone()
+                if row is None:
+                    # 旧版本迁移时没有记录哈希，以当前内容为准
+                    with self._conn:
+                        self._conn.execute("INSERT INTO meta (key, value) VALUES ('yaml_sha256', ?)", (digest,))
+                elif row['value'] != digest:
+                    self.logger.warning(f"{config_file} 在迁移到SQLite后被修改，修改不会生效；"
+                                        f"请在页面中修改任务，或设置 TASK_STORE=yaml 继续使用YAML文件")
+                return
+            config_data = (yaml.safe_load(content.decode('utf-8')) or {}) if content else {}
+            tasks = [task for task in config_data.get('tasks') or [] if task.get('id')]
+            with self._conn:
+                for task in tasks:
+                    self._conn.execute(
+                        'INSERT OR IGNORE INTO tasks (id, name, source_path, remote_url, enabled, data) '
+                        'VALUES (?, ?, ?, ?, ?, ?)', self._row(task))
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('yaml_migrated', ?)",
+                                   (os.path.abspath(config_file),))
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('yaml_sha256', ?)", (digest,))
+        if tasks:
+            self.logger.info(f"已从 {config_file} 导入 {len(tasks)} 个任务")
+
+    @staticmethod
+    def _row(task):
+        return (task['id'], task.get('name', ''), task.get('source_path', ''), task.get('remote_url', ''),
+                int(bool(task.get('enabled', True))), json.dumps(task, ensure_ascii=False))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, task_id: int) -> Optional[Dict]:
+        rows = self._query('SELECT data FROM tasks WHERE id = ?', (task_id,))
+        return json.loads(rows[0]['data']) if rows else None
+
+    def all(self) -> List[Dict]:
+        return [json.loads(row['data']) for row in self._query('SELECT data FROM tasks ORDER BY id')]
+
+    def add(self, task_data: Dict) -> Dict:
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO tasks (name, source_path, remote_url, enabled, data) VALUES (?, ?, ?, ?, '{}')",
+                    self._row(dict(task_data, id=None))[1:5])
+                task_data['id'] = cursor.lastrowid
+                self._conn.execute('UPDATE tasks SET data = ? WHERE id = ?',
+                                   (json.dumps(task_data, ensure_ascii=False), task_data['id']))
+        return task_data
+
+    def update(self, task_id: int, task_data: Dict) -> Optional[Dict]:
+        task_data['id'] = task_id
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    'UPDATE tasks SET name = ?, source_path = ?, remote_url = ?, enabled = ?, data = ?, '
+                    'updated_at = CURRENT_TIMESTAMP WHERE id = ?', self._row(task_data)[1:] + (task_id,))
+        return task_data if cursor.rowcount else None
+
+    def delete(self, task_id: int) -> bool:
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+        return cursor.rowcount > 0
+
+    def find_duplicate(self, source_path, remote_url, exclude_id=None) -> Optional[Dict]:
+        rows = self._query('SELECT data FROM tasks WHERE source_path = ? AND remote_url = ? AND id IS NOT ? LIMIT 1',
+                           (source_path, remote_url, exclude_id))
+        return json.loads(rows[0]['data']) if rows else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,167 @@
+import os
+import time
+import uuid
+import glob
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import git
+from modules.task_state import get_task_key, load_json, save_json
+
+logger = logging.getLogger('git_backup')
+
+# 快照目录的默认保留时间（秒）
+WORKTREE_TTL = int(os.getenv('WORKTREE_TTL', '86400'))
+# 同时执行的快照还原数量
+WORKTREE_WORKERS = int(os.getenv('WORKTREE_WORKERS', '2'))
+
+
+class WorktreeRestoreManager:
+    """把快照还原到 BACKUP_DIR/worktrees 下的独立目录，不修改源目录和远程仓库
+
+    整个目录树使用 git worktree（与源仓库共享对象库，按提交检出）；
+    只还原部分路径时从对象库流式导出到普通目录。多个还原并行执行，
+    每个目录的元数据保存在同名的JSON文件中，过期后自动删除。
+    """
+
+    def __init__(self, restore_manager, base_dir, ttl=WORKTREE_TTL, max_workers=WORKTREE_WORKERS):
+        self.restore_manager = restore_manager
+        self.root = os.path.join(base_dir, 'worktrees')
+        self.ttl = ttl
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='worktree')
+        os.makedirs(self.root, exist_ok=True)
+        self._recover()
+
+    def _recover(self):
+        """进程重启前未完成的还原标记为失败并删除目录"""
+        for info in self.list():
+            if info['status'] in ('pending', 'running'):
+                self._remove_dir(info)
+                info.update(status='failed', message='进程重启，还原已中断')
+                self._save(info)
+
+    def _meta_file(self, worktree_id):
+        return os.path.join(self.root, f'{worktree_id}.json')
+
+    def _save(self, info):
+        with self._lock:
+            save_json(self._meta_file(info['id']), info)
+
+    def get(self, worktree_id):
+        """获取快照目录信息"""
+        if not worktree_id.isalnum():
+            return None
+        return load_json(self._meta_file(worktree_id))
+
+    def list(self, task_id=None):
+        """列出快照目录（新的在前）"""
+        items = []
+        for meta_file in glob.glob(os.path.join(self.root, '*.json')):
+            info = load_json(meta_file)
+            if info and (task_id is None or info.get('task_id') == task_id):
+                items.append(info)
+        return sorted(items, key=lambda info: info['created_at'], reverse=True)
+
+    def create(self, task_id, commit_hash, path='', ttl=None):
+        """提交还原请求，立即返回快照目录信息，进度通过 restore_status 事件推送"""
+        task, repo, sha, path, _ = self.restore_manager._resolve_snapshot(task_id, commit_hash, path)
+        worktree_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        info = {
+            'id': worktree_id,
+            'task_id': task_id,
+            'commit': sha,
+            'path': path,
+            'mode': 'sparse' if path else 'worktree',
+            'source_path': task['source_path'],
+            'dir': os.path.join(self.root, f'{get_task_key(task)}-{sha[:8]}-{worktree_id}'),
+            'status': 'pending',
+            'message': '',
+            'created_at': now,
+            'expires_at': now + (ttl or self.ttl)
+        }
+        self._save(info)
+        self._executor.submit(self._run, repo, info)
+        return info
+
+    def _run(self, repo, info):
+        task_id = info['task_id']
+        emit = self.restore_manager.emit_status
+        info['status'] = 'running'
+        self._save(info)
+        started = time.time()
+        try:
+            emit(task_id, 'info', f"正在还原 {info['commit'][:8]}:{info['path'] or '/'} 到 {info['dir']}...")
+            if info['mode'] == 'worktree':
+                # 独立工作区：只写入新目录，源仓库中只增加 .git/worktrees 下的管理文件
+                # 使用独立的git命令对象，不在执行器线程中共享仓库句柄
+                git_pool = self.restore_manager.git_pool
+                git_pool.command(repo.working_dir)(c=f'checkout.workers={os.cpu_count() or 1}').worktree(
+                    'add', '--detach', '--force', info['dir'], info['commit'])
+                large_files = 0
+                task = self.restore_manager.get_task_info(task_id)
+                if self.restore_manager.large_files.is_enabled(task):
+                    with git_pool.lock(repo.working_dir):
+                        large_files = self.restore_manager.large_files.rehydrate(
+                            repo, info['commit'], work_dir=info['dir'])
+                message = f"已还原到 {info['dir']}"
+                if large_files:
+                    message += f'（{large_files} 个大文件）'
+            else:
+                result = self.restore_manager.extract_snapshot(
+                    task_id, info['commit'], info['path'], info['dir'])
+                message = f"已还原 {result['files']} 个文件到 {info['dir']}"
+            info.update(status='ready', message=message, duration=round(time.time() - started, 3))
+            self.logger.info(f"任务 {task_id} 快照还原完成: {message}")
+            emit(task_id, 'success', message)
+        except Exception as e:
+            info.update(status='failed', message=str(e))
+            self.logger.error(f"任务 {task_id} 快照还原失败: {str(e)}")
+            emit(task_id, 'error', f"快照还原失败: {str(e)}")
+            self._remove_dir(info)
+        self._save(info)
+
+    def _remove_dir(self, info):
+        """删除快照目录；git worktree 同时清理源仓库中的管理文件"""
+        if os.path.exists(info['dir']):
+            shutil.rmtree(info['dir'], ignore_errors=True)
+        if info['mode'] == 'worktree' and os.path.isdir(os.path.join(info['source_path'], '.git')):
+            try:
+                self.restore_manager.git_pool.command(info['source_path']).worktree('prune')
+            except git.exc.GitCommandError as e:
+                self.logger.warning(f"清理工作区记录失败: {str(e)}")
+
+    def remove(self, worktree_id):
+        """删除快照目录及其元数据，返回是否存在"""
+        info = self.get(worktree_id)
+        if not info:
+            return False
+        if info['status'] in ('pending', 'running'):
+            raise ValueError("快照正在还原中，暂时不能删除")
+        self._remove_dir(info)
+        with self._lock:
+            if os.path.exists(self._meta_file(worktree_id)):
+                os.remove(self._meta_file(worktree_id))
+        self.logger.info(f"已删除快照目录: {info['dir']}")
+        return True
+
+    def cleanup_expired(self):
+        """删除过期的快照目录"""
+        now = time.time()
+        removed = 0
+        for info in self.list():
+            if info['expires_at'] <= now and info['status'] in ('ready', 'failed'):
+                try:
+                    self.remove(info['id'])
+                    removed += 1
+                except Exception as e:
+                    self.logger.error(f"删除过期快照目录失败 {info['dir']}: {str(e)}")
+        if removed:
+            self.logger.info(f"已清理 {removed} 个过期的快照目录")
+        return removed
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
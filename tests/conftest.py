@@ -0,0 +1,81 @@
+import os
+import sys
+import subprocess
+
+import git
+import pytest
+
+# 测试直接导入 modules 包，不依赖安装
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.chunk_store import LargeFileManager  # noqa: E402
+from modules.git_pool import GitProcessPool  # noqa: E402
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='t', GIT_AUTHOR_EMAIL='t@t',
+               GIT_COMMITTER_NAME='t', GIT_COMMITTER_EMAIL='t@t')
+
+
+def _run_git(cwd, *args):
+    result = subprocess.run(['git', *args], cwd=cwd, env=GIT_ENV, check=True, capture_output=True)
+    return result.stdout.decode('utf-8').strip()
+
+
+@pytest.fixture
+def large_files(tmp_path):
+    """状态目录在临时目录中的大文件管理器"""
+    return LargeFileManager(str(tmp_path / 'state'))
+
+
+@pytest.fixture
+def write_file(tmp_path):
+    """在临时目录中写入文件并返回路径"""
+    def write(name, data):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def git_pool():
+    pool = GitProcessPool()
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def run_git():
+    """在指定目录执行git命令，返回标准输出"""
+    return _run_git
+
+
+@pytest.fixture
+def git_repo(tmp_path):
+    """临时的空仓库（分支 main）"""
+    path = tmp_path / 'repo'
+    path.mkdir()
+    _run_git(path, 'init', '-q', '-b', 'main')
+    # 被测代码通过GitPython提交时使用仓库配置中的身份
+    _run_git(path, 'config', 'user.name', 't')
+    _run_git(path, 'config', 'user.email', 't@t')
+    repo = git.Repo(path)
+    yield repo
+    repo.close()
+
+
+@pytest.fixture
+def commit(git_repo):
+    """写入文件并提交，返回提交SHA：commit({路径: 内容}, 提交信息)，内容为None时删除文件"""
+    def make_commit(files, message):
+        for rel_path, content in files.items():
+            abs_path = os.path.join(git_repo.working_dir, rel_path)
+            if content is None:
+                os.remove(abs_path)
+                continue
+            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+            with open(abs_path, 'wb') as f:
+                f.write(content.encode('utf-8') if isinstance(content, str) else content)
+        _run_git(git_repo.working_dir, 'add', '-A')
+        _run_git(git_repo.working_dir, 'commit', '-q', '--allow-empty', '-m', message)
+        return _run_git(git_repo.working_dir, 'rev-parse', 'HEAD')
+    return make_commit
@@ -0,0 +1,73 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from modules.adaptive_schedule import AdaptiveScheduler
+
+UTC = timezone.utc
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return AdaptiveScheduler(str(tmp_path))
+
+
+def _task(**options):
+    task = {'id': 1, 'name': 'docs', 'adaptive': True,
+            'adaptive_min_interval': 60, 'adaptive_max_interval': 3600}
+    task.update(options)
+    return task
+
+
+def test_next_run_time_without_history_uses_min_interval(scheduler):
+    before = datetime.now(UTC)
+    run_time = scheduler.next_run_time(_task(), UTC)
+    assert before + timedelta(seconds=60) <= run_time <= datetime.now(UTC) + timedelta(seconds=60)
+
+
+def test_next_run_time_follows_last_run(scheduler):
+    task = _task()
+    now = time.time()
+    scheduler.record(task, True, committed=False, now=now - 10)
+    state = scheduler.get_state(task)
+    expected = datetime.fromtimestamp(state['last_run'], UTC) + timedelta(seconds=state['interval'])
+    assert scheduler.next_run_time(task, UTC) == expected
+
+
+def test_next_run_time_overdue_runs_soon(scheduler):
+    task = _task()
+    scheduler.record(task, True, committed=False, now=time.time() - 7200)
+    run_time = scheduler.next_run_time(task, UTC)
+    assert run_time - datetime.now(UTC) <= timedelta(seconds=1)
+    assert run_time > datetime.now(UTC) - timedelta(seconds=1)
+
+
+def test_next_run_time_is_clamped_to_rpo(scheduler):
+    task = _task()
+    now = time.time()
+    for step in range(10):
+        scheduler.record(task, True, committed=False, now=now - 9000 + step * 1000)
+    state = scheduler.get_state(task)
+    assert state['interval'] > 600
+    last_run = datetime.fromtimestamp(state['last_run'], UTC)
+    task['rpo'] = 600
+    assert scheduler.next_run_time(task, UTC) == last_run + timedelta(seconds=600)
+
+
+def test_interval_widens_when_idle_and_tightens_on_changes(scheduler):
+    task = _task()
+    now = time.time()
+    scheduler.record(task, True, committed=False, now=now)
+    idle = scheduler.record(task, True, committed=False, now=now + 60)['interval']
+    assert idle > 60
+    busy = scheduler.record(task, True, committed=True, files_changed=5, now=now + 60 + idle)['interval']
+    assert busy < idle
+
+
+def test_failure_retries_at_min_interval(scheduler):
+    task = _task()
+    now = time.time()
+    scheduler.record(task, True, committed=False, now=now)
+    scheduler.record(task, True, committed=False, now=now + 60)
+    assert scheduler.record(task, False, now=now + 200)['interval'] == 60
@@ -0,0 +1,95 @@
+import os
+import random
+
+import pytest
+
+from modules import chunk_store
+from modules.chunk_store import CHUNK_MAX_SIZE, CHUNK_MIN_SIZE, find_boundary
+
+
+def _data(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+@pytest.fixture
+def staging(large_files):
+    return large_files._staging({'id': 1})
+
+
+def test_find_boundary_short_data_is_one_chunk():
+    data = _data(CHUNK_MIN_SIZE)
+    assert find_boundary(data) == len(data)
+    assert find_boundary(b'') == 0
+
+
+def test_find_boundary_respects_min_and_max():
+    data = _data(CHUNK_MAX_SIZE * 2)
+    cut = find_boundary(data)
+    assert CHUNK_MIN_SIZE < cut <= CHUNK_MAX_SIZE
+    # 不可能命中的掩码时在最大分块处切分
+    assert find_boundary(data, mask=(1 << 64) - 1) == CHUNK_MAX_SIZE
+
+
+def test_find_boundary_depends_only_on_content():
+    data = _data(CHUNK_MAX_SIZE * 2, seed=1)
+    cut = find_boundary(data)
+    # 边界之后的内容不影响边界位置
+    assert find_boundary(data[:cut] + _data(CHUNK_MAX_SIZE, seed=2)) == cut
+
+
+def test_chunk_file_unchanged_file_has_no_new_chunks(large_files, staging, write_file):
+    path = write_file('big.bin', _data(3 * 1024 * 1024, seed=4))
+    chunks, stored = large_files._chunk_file(path, [], staging)
+    assert sum(size for _, size in chunks) == 3 * 1024 * 1024
+    assert len(stored) == len(chunks)
+    again, stored = large_files._chunk_file(path, chunks, staging)
+    assert again == chunks
+    assert stored == []
+    assert staging.get(chunks[0][0]) is not None
+
+
+def test_chunk_file_reuses_chunks_after_insert_and_delete(large_files, staging, write_file, monkeypatch):
+    data = _data(8 * 1024 * 1024, seed=3)
+    chunks, _ = large_files._chunk_file(write_file('big.bin', data), [], staging)
+    calls = []
+    monkeypatch.setattr(chunk_store, 'find_boundary', lambda buffer: calls.append(1) or find_boundary(buffer))
+
+    # 插入数据后所有偏移都变化，但只有修改附近的分块需要重新计算边界
+    inserted = data[:1000000] + b'inserted' * 64 + data[1000000:]
+    new_chunks, stored = large_files._chunk_file(write_file('big.bin', inserted), chunks, staging)
+    assert sum(size for _, size in new_chunks) == len(inserted)
+    assert len(stored) <= 2
+    assert len(calls) <= 3
+
+    calls.clear()
+    deleted = inserted[:3000000] + inserted[3000500:]
+    _, stored = large_files._chunk_file(write_file('big.bin', deleted), new_chunks, staging)
+    assert len(stored) <= 2
+    assert len(calls) <= 3
+
+
+def test_prepare_skips_ignored_large_files(large_files, git_repo, run_git):
+    task = {'id': 1, 'large_files': True, 'large_file_threshold_mb': 1}
+    repo_path = git_repo.working_dir
+    for name in ['big.bin', 'cache/big.bin', 'dump.tmp']:
+        os.makedirs(os.path.dirname(os.path.join(repo_path, name)), exist_ok=True)
+        with open(os.path.join(repo_path, name), 'wb') as f:
+            f.write(_data(1024 * 1024 + 1, seed=5))
+    with open(os.path.join(repo_path, '.gitignore'), 'w') as f:
+        f.write('cache/\n*.tmp\n')
+
+    assert large_files.prepare(task, git_repo, repo_path) == {'big.bin'}
+    assert run_git(repo_path, 'ls-files') == 'big.bin'
+
+
+def test_prepare_keeps_chunks_only_in_repository(large_files, staging, git_repo, run_git):
+    task = {'id': 1, 'large_files': True, 'large_file_threshold_mb': 1}
+    data = _data(3 * 1024 * 1024, seed=6)
+    with open(os.path.join(git_repo.working_dir, 'big.bin'), 'wb') as f:
+        f.write(data)
+    large_files.prepare(task, git_repo, git_repo.working_dir)
+
+    # 暂存的分块写入对象库后删除
+    assert not os.path.exists(staging.root)
+    pointer = chunk_store.parse_pointer(run_git(git_repo.working_dir, 'show', ':big.bin') + '\n')
+    assert b''.join(large_files.iter_chunks(git_repo, pointer)) == data
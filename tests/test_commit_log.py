@@ -0,0 +1,57 @@
+import pytest
+
+from modules.commit_log import count_commits, iter_log, read_log
+
+DOC = 'docs/使用 说明.md'
+
+
+@pytest.fixture
+def git_cmd(git_repo, git_pool):
+    return git_pool.command(git_repo.working_dir)
+
+
+@pytest.fixture
+def history(commit):
+    first = commit({'src/app.py': 'a\nb\nc\n', DOC: '一\n二\n', 'logo.png': b'\x89PNG\r\n\x1a\n\x00\x01'},
+                   '初始提交\n\n详细说明')
+    second = commit({'src/app.py': 'a\nB\nc\nd\n', 'logo.png': b'\x89PNG\r\n\x1a\n\x00\x02', DOC: None},
+                    'fix:\t更新图标')
+    empty = commit({}, '空提交')
+    return first, second, empty
+
+
+def test_read_log_parses_real_git_output(git_repo, git_cmd, history):
+    first, second, empty = history
+    commits = read_log(git_cmd, 'HEAD')
+    assert [c['hash'] for c in commits] == [empty, second, first]
+    assert commits[2]['author'] == 't'
+    assert commits[2]['message'] == '初始提交\n\n详细说明'
+    assert commits[2]['timestamp'] == int(git_repo.commit(first).committed_date)
+    assert commits[2]['stats'] == {'files': 3, 'insertions': 5, 'deletions': 0}
+    # 二进制文件的行数按0计，删除的文件计入删除行数
+    assert commits[1]['message'] == 'fix:\t更新图标'
+    assert commits[1]['stats'] == {'files': 3, 'insertions': 2, 'deletions': 3}
+    assert commits[0]['stats'] == {'files': 0, 'insertions': 0, 'deletions': 0}
+
+
+def test_read_log_pages(git_cmd, history):
+    first, second, _ = history
+    assert [c['hash'] for c in read_log(git_cmd, 'HEAD', skip=1, max_count=1)] == [second]
+    assert [c['hash'] for c in read_log(git_cmd, 'HEAD', skip=2, max_count=5)] == [first]
+    assert read_log(git_cmd, 'HEAD', skip=3) == []
+    assert count_commits(git_cmd, 'HEAD') == 3
+
+
+def test_iter_log_returns_file_status_and_blob(git_repo, git_cmd, run_git, history):
+    first, second, empty = history
+    commits = list(iter_log(git_cmd, 'HEAD'))
+    assert [c['hash'] for c in commits] == [empty, second, first]
+    assert commits[0]['files'] == []
+    # 非ASCII路径按原样输出，与按路径查询时一致
+    assert sorted(commits[1]['files']) == [
+        (DOC, 0, 2, 'D', None),
+        ('logo.png', 0, 0, 'M', run_git(git_repo.working_dir, 'rev-parse', f'{second}:logo.png')),
+        ('src/app.py', 2, 1, 'M', run_git(git_repo.working_dir, 'rev-parse', f'{second}:src/app.py')),
+    ]
+    assert {path: status for path, _, _, status, _ in commits[2]['files']} == {
+        DOC: 'A', 'logo.png': 'A', 'src/app.py': 'A'}
@@ -0,0 +1,88 @@
+import hashlib
+
+import pytest
+
+PARTS = [b'abcd', b'efgh', b'ijkl']
+TASK = {'id': 1, 'large_files': True}
+
+
+def _add_chunks(large_files, repo, chunks):
+    """把 {分块ID: 内容} 写入仓库的 refs/gitbackup/chunks"""
+    staging = large_files._staging(TASK)
+    for chunk_id, data in chunks.items():
+        staging.put(chunk_id, data)
+    large_files._add_chunks_to_ref(TASK, repo, sorted(chunks), staging)
+    staging.clear()
+
+
+def _pointer(parts):
+    chunks = [(hashlib.sha256(data).hexdigest(), len(data)) for data in parts]
+    return {'size': sum(len(data) for data in parts), 'chunks': chunks}
+
+
+@pytest.fixture
+def pointer(large_files, git_repo):
+    """分块已写入仓库分块引用的指针"""
+    pointer = _pointer(PARTS)
+    _add_chunks(large_files, git_repo, {chunk_id: data for (chunk_id, _), data in zip(pointer['chunks'], PARTS)})
+    return pointer
+
+
+@pytest.mark.parametrize('start, stop', [(0, None), (0, 1), (3, 7), (4, 8), (9, 12), (11, 12), (2, 11)])
+def test_iter_chunks_returns_requested_range(large_files, git_repo, pointer, start, stop):
+    content = b''.join(PARTS)
+    assert b''.join(large_files.iter_chunks(git_repo, pointer, start=start, stop=stop)) == content[start:stop]
+
+
+def test_iter_chunks_skips_chunks_outside_range(large_files, git_repo, pointer):
+    read = []
+    read_chunk = large_files._read_chunk
+    large_files._read_chunk = lambda repo, chunk_id, fetch_env=None: \
+        read.append(chunk_id) or read_chunk(repo, chunk_id, fetch_env)
+    assert b''.join(large_files.iter_chunks(git_repo, pointer, start=5, stop=7)) == b'fg'
+    assert read == [pointer['chunks'][1][0]]
+
+
+def test_iter_chunks_rejects_corrupt_chunk(large_files, git_repo):
+    pointer = _pointer(PARTS)
+    _add_chunks(large_files, git_repo, {pointer['chunks'][0][0]: b'abce'})
+    with pytest.raises(ValueError):
+        b''.join(large_files.iter_chunks(git_repo, pointer))
+
+
+def test_blob_reader_skip_and_partial_read(git_repo, git_pool, commit, run_git):
+    content = bytes(range(256)) * 40
+    commit({'data.bin': content}, 'data')
+    sha = run_git(git_repo.working_dir, 'rev-parse', 'HEAD:data.bin')
+    with git_pool.blob_reader(git_repo.working_dir) as reader:
+        assert reader.open(sha) == (sha, 'blob', len(content))
+        reader.skip(1000)
+        assert reader.read(24) == content[1000:1024]
+    # 提前归还的读取器读完剩余内容后可以复用
+    with git_pool.blob_reader(git_repo.working_dir) as reader:
+        assert reader.open(sha)[2] == len(content)
+        data = b''
+        while True:
+            chunk = reader.read(4096)
+            if not chunk:
+                break
+            data += chunk
+        assert data == content
+        assert reader.open('f' * 40) is None
+    assert git_pool.get_stats()['blob_readers']['spawns'] == 1
+
+
+@pytest.mark.parametrize('rev', ['HEAD\nHEAD:secret.txt', 'HEAD:a\rb', 'HEAD\x00', 'HEAD:\x7f'])
+def test_batch_requests_reject_control_characters(git_repo, git_pool, commit, rev):
+    head = commit({'public.txt': 'public\n', 'secret.txt': 'secret\n'}, 'files')
+    with pytest.raises(ValueError):
+        git_pool.object_headers(git_repo.working_dir, [rev])
+    with pytest.raises(ValueError):
+        git_pool.read_object(git_repo.working_dir, rev)
+    with git_pool.blob_reader(git_repo.working_dir) as reader:
+        with pytest.raises(ValueError):
+            reader.open(rev)
+    # 常驻进程没有收到多余的请求，之后的读取仍然对应各自的请求
+    headers = git_pool.object_headers(git_repo.working_dir, ['HEAD', 'HEAD:public.txt'])
+    assert headers['HEAD'] == (head, 'commit', headers['HEAD'][2])
+    assert git_pool.read_object(git_repo.working_dir, 'HEAD:public.txt')[3] == b'public\n'
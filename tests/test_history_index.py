@@ -0,0 +1,122 @@
+import time
+import threading
+
+import pytest
+
+from modules import history_index as history_index_module
+from modules.history_index import HistoryIndex
+
+COMMITS = 12
+
+
+@pytest.fixture
+def repo(git_repo, commit):
+    """每个提交修改 notes.txt 并新增一个文件"""
+    for i in range(COMMITS):
+        commit({'notes.txt': ''.join(f'line {n}\n' for n in range(i + 1)), f'file{i}.txt': f'{i}\n'},
+               f'commit {i}')
+    return git_repo
+
+
+@pytest.fixture
+def index(tmp_path, git_pool):
+    history_index = HistoryIndex(str(tmp_path / 'index.db'), git_pool)
+    yield history_index
+    history_index.close()
+
+
+def _build(index, repo, task):
+    assert index.sync(task, repo) is False
+    deadline = time.time() + 30
+    while task['id'] in index._building and time.time() < deadline:
+        time.sleep(0.05)
+    assert index.sync(task, repo) is True
+
+
+def test_get_page_by_offset_and_cursor(index, repo):
+    task = {'id': 1, 'branch': 'main'}
+    _build(index, repo, task)
+    count = index.get_state(1)['count']
+    assert count == COMMITS
+
+    first = index.get_page(1, count, 0, 5)
+    assert [c['message'] for c in first] == [f'commit {i}' for i in range(11, 6, -1)]
+    assert first[0]['hash'] == repo.head.commit.hexsha
+    assert first[0]['stats'] == {'files': 2, 'insertions': 2, 'deletions': 0}
+
+    # 偏移和游标得到同一页
+    by_skip = index.get_page(1, count, 5, 5)
+    by_cursor = index.get_page(1, count, 0, 5, cursor=first[-1]['hash'])
+    assert by_skip == by_cursor
+    assert [c['message'] for c in by_cursor] == [f'commit {i}' for i in range(6, 1, -1)]
+
+    last = index.get_page(1, count, 10, 5)
+    assert [c['message'] for c in last] == ['commit 1', 'commit 0']
+    assert index.get_page(1, count, 20, 5) == []
+    assert index.get_page(1, count, 0, 5, cursor='f' * 40) is None
+
+
+def test_sync_appends_new_commits(index, repo, commit):
+    task = {'id': 2, 'branch': 'main'}
+    _build(index, repo, task)
+    commit({'notes.txt': ''.join(f'line {n}\n' for n in range(COMMITS + 1))}, f'commit {COMMITS}')
+    assert index.sync(task, repo) is True
+    page = index.get_page(2, index.get_state(2)['count'], 0, 2)
+    assert [c['message'] for c in page] == [f'commit {COMMITS}', f'commit {COMMITS - 1}']
+
+    details = index.get_commit(2, page[0]['hash'])
+    assert details['files'] == [{'path': 'notes.txt', 'status': 'M', 'insertions': 1, 'deletions': 0}]
+
+
+def test_sync_does_not_run_commands_on_shared_handle(index, repo, commit, monkeypatch):
+    class SharedGit:
+        def __getattr__(self, name):
+            raise AssertionError(f'git {name} 使用了共享的仓库句柄')
+
+        def __call__(self, **kwargs):
+            raise AssertionError('临时选项设置在共享的仓库句柄上')
+
+    task = {'id': 5, 'branch': 'main'}
+    monkeypatch.setattr(repo, 'git', SharedGit())
+    _build(index, repo, task)
+    commit({'notes.txt': 'changed\n'}, 'append')
+    assert index.sync(task, repo) is True
+    assert index.get_state(5)['count'] == COMMITS + 1
+
+
+def test_drop_removes_index(index, repo):
+    task = {'id': 3, 'branch': 'main'}
+    _build(index, repo, task)
+    index.drop(3)
+    assert index.get_state(3) is None
+    assert index.get_page(3, COMMITS, 0, 5) == []
+
+
+def test_drop_cancels_running_backfill(index, repo, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    iter_log = history_index_module.iter_log
+
+    def slow_iter_log(git_cmd, rev):
+        for i, commit in enumerate(iter_log(git_cmd, rev)):
+            if i == 4:
+                started.set()
+                release.wait(10)
+            yield commit
+
+    monkeypatch.setattr(history_index_module, 'iter_log', slow_iter_log)
+    monkeypatch.setattr(history_index_module, 'BACKFILL_BATCH', 2)
+    task = {'id': 4, 'branch': 'main'}
+    assert index.sync(task, repo) is False
+    assert started.wait(10)
+
+    # 不等待正在进行的建立
+    began = time.time()
+    index.drop(4)
+    assert time.time() - began < 1
+    release.set()
+    deadline = time.time() + 10
+    while 4 in index._building and time.time() < deadline:
+        time.sleep(0.05)
+    assert index.get_state(4) is None
+    assert index._query('SELECT count(*) AS n FROM commits WHERE task_id = 4')[0]['n'] == 0
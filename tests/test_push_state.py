@@ -0,0 +1,37 @@
+from modules.push_state import parse_porcelain_push, parse_push_bytes, strip_progress
+
+
+def test_parse_porcelain_push_per_ref_results():
+    output = ('To github.com:user/repo.git\n'
+              '=\trefs/heads/main:refs/heads/main\t[up to date]\n'
+              '+\trefs/tasks/a/main:refs/heads/dev\t1a2b3c...4d5e6f (forced update)\n'
+              '!\trefs/heads/feature:refs/heads/feature\t[rejected] (non-fast-forward)\n'
+              'Done\n')
+    results = parse_porcelain_push(output)
+    assert [(r['dst'], r['ok']) for r in results] == [
+        ('refs/heads/main', True),
+        ('refs/heads/dev', True),
+        ('refs/heads/feature', False),
+    ]
+    assert results[1]['src'] == 'refs/tasks/a/main'
+    assert results[1]['flag'] == '+'
+    assert results[2]['summary'] == '[rejected] (non-fast-forward)'
+
+
+def test_parse_porcelain_push_ignores_noise():
+    assert parse_porcelain_push(None) == []
+    assert parse_porcelain_push('') == []
+    assert parse_porcelain_push('To /tmp/remote.git\nwarning: something\nDone\n') == []
+
+
+def test_parse_push_bytes_uses_last_writing_line():
+    stderr = ('Enumerating objects: 5, done.\r'
+              'Writing objects:  50% (1/2), 1.00 KiB | 1.00 MiB/s\r'
+              'Writing objects: 100% (2/2), 1.50 MiB | 3.00 MiB/s, done.\n')
+    assert parse_push_bytes(stderr) == int(1.5 * 1024 * 1024)
+    assert parse_push_bytes('') == 0
+
+
+def test_strip_progress_keeps_errors():
+    stderr = 'Counting objects: 100% (3/3)\rWriting objects: 100%\nerror: failed to push some refs\n'
+    assert strip_progress(stderr) == 'error: failed to push some refs'
@@ -0,0 +1,99 @@
+import os
+import time
+import threading
+
+import pytest
+
+from modules.restore_manager import RestoreManager
+
+
+class TaskConfig:
+    def __init__(self, tasks):
+        self.tasks = {task['id']: task for task in tasks}
+
+    def get_task(self, task_id):
+        return self.tasks.get(task_id)
+
+
+@pytest.fixture
+def remote(tmp_path, git_repo, run_git):
+    """任务仓库的 origin（本地裸仓库）"""
+    path = tmp_path / 'remote.git'
+    run_git(tmp_path, 'init', '-q', '--bare', str(path))
+    run_git(git_repo.working_dir, 'remote', 'add', 'origin', str(path))
+    return str(path)
+
+
+@pytest.fixture
+def restore(tmp_path, git_repo, git_pool):
+    task = {'id': 1, 'source_path': git_repo.working_dir, 'branch': 'main',
+            'remote_url': 'https://github.com/example/backup.git', 'access_token': 'token'}
+    manager = RestoreManager(str(tmp_path / 'backup'), git_pool, config=TaskConfig([task]))
+    return manager
+
+
+@pytest.fixture
+def history(git_repo, remote, commit, run_git):
+    first = commit({'a.txt': 'one\n'}, 'first')
+    second = commit({'a.txt': 'two\n', 'b.txt': 'new\n'}, 'second')
+    run_git(git_repo.working_dir, 'push', '-q', 'origin', 'main')
+    return first, second
+
+
+def test_restore_commit_pushes_restored_tree(restore, git_repo, remote, run_git, history):
+    first, second = history
+    assert restore.restore_commit(1, first) is True
+    assert run_git(remote, 'rev-parse', 'main^{tree}') == run_git(git_repo.working_dir, 'rev-parse', f'{first}^{{tree}}')
+    assert run_git(remote, 'rev-parse', 'main~1') == second
+    assert not os.path.exists(os.path.join(git_repo.working_dir, 'b.txt'))
+
+
+def test_restore_commit_fails_when_push_is_rejected(restore, git_repo, remote, history):
+    first, second = history
+    hook = os.path.join(remote, 'hooks', 'pre-receive')
+    with open(hook, 'w') as f:
+        f.write('#!/bin/sh\necho rejected >&2\nexit 1\n')
+    os.chmod(hook, 0o755)
+    assert restore.restore_commit(1, first) is False
+
+
+def test_restore_commit_releases_lock_before_push(restore, git_repo, git_pool, remote, tmp_path, history):
+    first, _ = history
+    pushing, release = tmp_path / 'pushing', tmp_path / 'release'
+    hook = os.path.join(remote, 'hooks', 'pre-receive')
+    with open(hook, 'w') as f:
+        f.write(f'#!/bin/sh\ntouch {pushing}\nwhile [ ! -e {release} ]; do sleep 0.05; done\n')
+    os.chmod(hook, 0o755)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(restore.restore_commit(1, first)))
+    thread.start()
+    try:
+        deadline = time.time() + 10
+        while not pushing.exists() and time.time() < deadline:
+            time.sleep(0.05)
+        assert pushing.exists()
+        # 推送期间其他请求可以使用仓库
+        repo_lock = git_pool.lock(git_repo.working_dir)
+        assert repo_lock.acquire(timeout=5)
+        repo_lock.release()
+    finally:
+        release.touch()
+        thread.join(10)
+    assert result == [True]
+
+
+def test_extract_snapshot_only_writes_under_allowed_roots(restore, tmp_path, history):
+    first, _ = history
+    exports = tmp_path / 'backup' / 'exports'
+    result = restore.extract_snapshot(1, first, '', str(exports / 'first'))
+    assert result['files'] == 1
+    assert (exports / 'first' / 'a.txt').read_text() == 'one\n'
+
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    exports.joinpath('link').symlink_to(outside)
+    for target_dir in [str(outside), str(exports / '..' / '..' / 'outside'), str(exports / 'link' / 'x'),
+                       str(exports)]:
+        with pytest.raises(ValueError):
+            restore.extract_snapshot(1, first, '', target_dir)
+    assert list(outside.iterdir()) == []
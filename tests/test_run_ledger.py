@@ -0,0 +1,53 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from modules.run_ledger import RunLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    run_ledger = RunLedger(str(tmp_path / 'runs.db'))
+    yield run_ledger
+    run_ledger.close()
+
+
+def _job(status, job_id='job1'):
+    now = time.time()
+    return SimpleNamespace(id=job_id, task_id=1, source='schedule', status=status, submitted_at=now,
+                           started_at=now if status != 'queued' else None, finished_at=None,
+                           message='', stats=None, batch_size=1)
+
+
+def test_running_without_queued_callback_is_still_recorded(ledger):
+    # 排队回调执行时任务已开始运行，只会看到 running
+    job = _job('running')
+    ledger.on_job_update(job)
+    assert [(j['job_id'], j['status']) for j in ledger.pending_jobs()] == [('job1', 'running')]
+
+
+def test_finished_job_moves_to_runs(ledger):
+    job = _job('queued')
+    ledger.on_job_update(job)
+    job.status, job.started_at = 'running', time.time()
+    ledger.on_job_update(job)
+    job.status, job.finished_at, job.message = 'failed', time.time(), '推送失败: rejected'
+    job.stats = {'phases': {'push': 0.5}, 'files_changed': 3}
+    ledger.on_job_update(job)
+    assert ledger.pending_jobs() == []
+    run = ledger.get_runs(task_id=1)[0]
+    assert run['status'] == 'failed'
+    assert run['message'] == '推送失败: rejected'
+    assert run['phases'] == {'push': 0.5}
+    assert run['files_changed'] == 3
+
+
+def test_late_callback_does_not_resurrect_finished_job(ledger):
+    job = _job('running')
+    job.status, job.finished_at = 'success', time.time()
+    ledger.on_job_update(job)
+    job.status = 'running'
+    ledger.on_job_update(job)
+    assert ledger.pending_jobs() == []
+    assert len(ledger.get_runs()) == 1
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+
+from modules.schedule import StaggeredCronTrigger, get_stagger_offset
+
+UTC = timezone.utc
+
+
+def test_stagger_offset_is_stable_and_within_window():
+    assert get_stagger_offset(1, 0) == 0
+    offsets = [get_stagger_offset(task_id, 600) for task_id in range(1, 200)]
+    assert all(0 <= offset < 600 for offset in offsets)
+    assert offsets == [get_stagger_offset(task_id, 600) for task_id in range(1, 200)]
+    # 不同任务分散在窗口内
+    assert len(set(offsets)) > 100
+
+
+def test_staggered_trigger_shifts_every_fire_time():
+    trigger = StaggeredCronTrigger.from_crontab('0 * * * *', 7, 600, timezone=UTC)
+    offset = trigger.offset
+    assert timedelta(0) <= offset < timedelta(seconds=600)
+
+    now = datetime(2024, 1, 1, 10, 30, tzinfo=UTC)
+    first = trigger.get_next_fire_time(None, now)
+    assert first == datetime(2024, 1, 1, 11, 0, tzinfo=UTC) + offset
+    second = trigger.get_next_fire_time(first, first)
+    assert second - first == timedelta(hours=1)
+
+
+def test_staggered_trigger_fires_in_current_period_before_offset():
+    trigger = StaggeredCronTrigger(StaggeredCronTrigger.from_crontab('0 * * * *', 1, 0, timezone=UTC).trigger, 300)
+    # 整点已过但还没到偏移后的时间，本小时的触发仍然有效
+    now = datetime(2024, 1, 1, 10, 2, tzinfo=UTC)
+    assert trigger.get_next_fire_time(None, now) == datetime(2024, 1, 1, 10, 5, tzinfo=UTC)
+
+
+def test_offset_is_limited_to_cron_period():
+    trigger = StaggeredCronTrigger.from_crontab('*/5 * * * *', 3, 86400, timezone=UTC)
+    assert trigger.offset < timedelta(minutes=5)